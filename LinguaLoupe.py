@@ -1,13 +1,15 @@
-from src.run_pipeline import run_sentiment_pipeline
-from src.generate_report import install_stopwords
 import argparse
 import os
+import re
 import webbrowser
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-ti", "--title", type=str, help="Title of the report,if not specified it will be the same as the file containig the collection of texts.",
                     default = "None", required=False)
-parser.add_argument("-t", "--text_data", type=str, help="csv, json, jsonl, tsv or xlsx file with text data.", required=True)
+parser.add_argument("-t", "--text_data", type=str, help="csv, json, jsonl, tsv, xlsx, parquet, feather or arrow file with text data. It can also be a glob pattern (e.g. 'exports/2024-*.jsonl'), a directory or a manifest (.manifest or .txt file with one path or glob pattern per line) to read the texts of many files, the file each text comes from is kept in the source_file column. Directories of parquet or arrow files can be hive partitioned. Only TEXT_COLUMN and COLUMNS_TO_KEEP_TEXT are read from csv, tsv, parquet, feather and arrow files.", required=True)
+parser.add_argument("-filter", "--filter", help="Condition the texts to analyze must meet, written as COLUMN OPERATOR VALUE with one of the operators ==, !=, >=, <=, >, < or in (e.g. 'created_at>=2024-01-01' or 'language in en,es'). In parquet, feather and arrow files the filter is applied while reading so the data that does not match is skipped. This parameter can be specified more than once.",
+                    action="append", required=False, default=[])
+parser.add_argument("-read_workers", "--read_workers", type=int, default=8, help="Number of threads used to read the files of TEXT_DATA when it has more than one, 8 by default.")
 parser.add_argument("-text_c", "--text_column", type=str, help="Column in TEXT_DATA which contains the texts to be analyzed",
                     required=True)
 
@@ -21,12 +23,19 @@ parser.add_argument("-mt", "--mean_text", help="Columns in TEXT_DATA to compute
                     action="append", required=False, default=[])
 parser.add_argument("-st", "--sum_text", help="Columns in TEXT_DATA to sum in Summary.csv.",
                     action="append", required=False, default=[])
+parser.add_argument("-sb", "--summary_breakdown", help="Comma separated columns (e.g. 'emotion,topic') to count texts and compute MEAN_TEXT and SUM_TEXT for every combination of their values, the result will be found in Summary_Breakdowns.csv. A date column can be grouped by time buckets adding @ and a pandas frequency (e.g. 'emotion,created_at@W'). This parameter can be specified more than once.",
+                    action="append", required=False, default=[])
+parser.add_argument("-time_column", "--time_column", type=str, default=None, help="Date column in COLUMNS_TO_KEEP_TEXT to count the texts of each emotion and global topic and compute the mean and standard deviation of the scores of each emotion per time window, the results will be found in Emotion_Trends.csv and Topic_Trends.csv and shown as trends in the report. Not used by default.")
+parser.add_argument("-window", "--window", type=str, default="D", help="Time window of the trends as a pandas frequency (e.g. 'h', 'D', 'W' or 'M'), 'D' by default.")
+parser.add_argument("-rolling_windows", "--rolling_windows", type=int, default=1, help="Number of time windows the trends of the emotions shown in the report are added up over (e.g. 7 with WINDOW 'D' for weekly rolling trends), 1 by default.")
 parser.add_argument("-umap_colour", "--umap_colour", help="Column in TEXT_DATA by which the umap shown in the report will be colored by, this parameter can be specified more than once in case you want to generate multiple UMAPs coloured by different values.",
                     default=["emotion"], action="append",
                     required=False)
 
 parser.add_argument("-o", "--output_directory", type=str, help="Output directory, it will be the current working directory by default.", default=os.getcwd(),
                         required=False)
+parser.add_argument("-output_format", "--output_format", type=str, default="csv", help="Format of the tables saved in the output directory: 'csv' (separated by semicolons), 'parquet' or 'arrow', 'csv' by default. In parquet and arrow formats Texts is partitioned by emotion.")
+parser.add_argument("-output_compression", "--output_compression", type=str, default=None, help="Compression of parquet or arrow tables (e.g. 'zstd', 'lz4', 'snappy'), the default of each format is used if not specified.")
 parser.add_argument("-csv_sep", "--csv_separation", type=str, help="In case a csv file is used as input, specify the separation between values, it will be ',' by default.",
                     default=",", required=False)
 parser.add_argument("-min_rows_paralllelize", "--minimum_rows_paralllelize", type=int,
@@ -44,70 +53,198 @@ parser.add_argument("-umap_n_components_BERTopic", "--umap_n_components_BERTopic
 parser.add_argument("-low_memory_BERTopic", "--umap_low_memory_BERTopic", type=str, default="True", help="True when datasets may consume a lot of memory. Using millions of documents can lead to memory issues and setting this value to True might alleviate some of the issues.")
 # n_neighbors=15, n_components=5, low_memory= True
 
-parser.add_argument("-lang", "--language", type=str, help="The main language used in your documents, it can be: 'english' (default), 'spanish', or 'portuguese'.", default="english", required=False)
+parser.add_argument("-lang", "--language", type=str, help="The main language used in your documents, it can be: 'english' (default), 'spanish', or 'portuguese'. Use 'auto' to detect the language of each text and classify it with the model of its language.", default="english", required=False)
 parser.add_argument("-umap_metric", "--umap_metric", type=str, default="cosine", help="Metric to be used when computing distances for umap, will be cosine by default. You can check all avalaible metrics here: https://umap-learn.readthedocs.io/en/latest/parameters.html")
 parser.add_argument("-umap_n_neighbours", "--umap_n_neighbours", type=int, default=15, help="Number of approximate nearest neighbors used to construct the UMAP, 15 by default.")
 parser.add_argument("-umap_min_dist", "--umap_min_dist", type=float, default=0.1, help="Minimum distance apart that points are allowed to be in the umap, 0.1 by default.")
+parser.add_argument("-scalable_umap", "--scalable_umap", type=str, default="False", help="Whether to fit the summary umap on a sample of the texts and draw it as a single WebGL plot (True) or not (False), False by default. Recommended for large collections of texts.")
+parser.add_argument("-umap_sample_size", "--umap_sample_size", type=int, default=50000, help="Number of texts the summary umap is fitted on when SCALABLE_UMAP is True, the rest are projected in batches, 50,000 by default.")
+parser.add_argument("-umap_max_points", "--umap_max_points", type=int, default=100000, help="Maximum number of texts drawn in the summary umap when SCALABLE_UMAP is True, 100,000 by default.")
 
-parser.add_argument("-clean_html", "--clean_html", type=str, default="True", help="Whether to remove html characters from text_column or not, True by default.")
-args = parser.parse_args()
-
-# Check if nltk stopwords are installed
-install_stopwords()
-
-# Defining input arguments
-text_data = args.text_data
-title = args.title
-if title == "None":
-    title = text_data.split(".")[0]
-text_col = args.text_column
-cols_keep_text = args.Columns_to_Keep_Text
-
-count_text_group = args.group_to_count_text
-if ("emotion" in count_text_group) == False:
-    count_text_group.append("emotion")
-mean_text_cols = args.mean_text
-sum_text_cols = args.sum_text
-output_directory=os.path.join(args.output_directory, title)
-csv_sep = args.csv_separation
-min_rows_par = args.minimum_rows_paralllelize
-#cancel_par = args.cancel_parallelisation
-cancel_par = True
-ch_size = args.chunk_size
-m_topic_size = args.minimum_topic_size
-lang = args.language
-u_col = args.umap_colour
-umap_metric_d = args.umap_metric
-neighbours_umap = args.umap_n_neighbours
-min_dist_umap = args.umap_min_dist
-m_type = args.model_type
-
-n_neighbours_BERTopic = args.umap_n_neighbours_BERTopic
-n_components_BERTopic = args.umap_n_components_BERTopic
-
-# Converting boolean values to the appropiate data type.
-l_memory = True
-
-if args.umap_low_memory_BERTopic == "False":
-    l_memory = False
-
-c_html = True
-
-if args.clean_html == "False":
-    c_html = False
-
-
-for c in u_col:
-    if (c != "emotion") and (c not in cols_keep_text):
-        print(f"{c} not in Columns_to_Keep_Text")
-        exit()
+parser.add_argument("-plotly_js", "--plotly_js", type=str, default="embed", help="Whether to embed plotly.js, jQuery and DataTables in report.html so it can be opened offline ('embed') or load them from their CDNs ('cdn'), 'embed' by default.")
+
+parser.add_argument("-table_mode", "--table_mode", type=str, default="inline", help="Whether to include the texts of each emotion in report.html ('inline') or to write them in shards next to the report that are loaded page by page ('sharded'), 'inline' by default.")
+parser.add_argument("-table_shard_size", "--table_shard_size", type=int, default=5000, help="Number of texts in each shard when TABLE_MODE is 'sharded', 5,000 by default.")
+
+parser.add_argument("-executor", "--executor", type=str, default=None, help="Backend used to classify the texts and compute their embeddings by partitions: 'thread' (threads of this process), 'process' (processes of this machine) or 'dask' (workers of a dask cluster, which needs dask.distributed). Not used by default, the texts are processed by this process as a whole.")
+parser.add_argument("-workers", "--workers", type=int, default=None, help="Number of threads, processes or local dask workers used by EXECUTOR, the default of each backend is used if not specified.")
+parser.add_argument("-scheduler_address", "--scheduler_address", type=str, default=None, help="Address of the scheduler of the dask cluster (e.g. 'tcp://10.0.0.1:8786') when EXECUTOR is 'dask', a cluster of local processes is started if not specified.")
+parser.add_argument("-partition_size", "--partition_size", type=int, default=50000, help="Number of texts of each partition classified or embedded by a worker of EXECUTOR, 50,000 by default.")
+
+parser.add_argument("-batch_size", "--batch_size", type=int, default=32, help="Number of texts the sentiment model classifies at once, 32 by default.")
+parser.add_argument("-threads", "--threads", type=int, default=None, help="Number of threads torch uses to run the models in each process, one per core by default.")
+parser.add_argument("-autotune", "--autotune", type=str, default="False", help="Whether to choose BATCH_SIZE, THREADS and, with a 'process' EXECUTOR or a local dask cluster, WORKERS measuring the texts/sec of the sentiment model on a sample of TEXT_DATA (True) or not (False), False by default. The result is saved in AUTOTUNE_CACHE for this machine and model, so later runs do not measure again.")
+parser.add_argument("-memory_budget", "--memory_budget", type=float, default=None, help="Memory in GB the workers tuned by AUTOTUNE can use together, 80%% of the memory of the machine by default.")
+parser.add_argument("-autotune_cache", "--autotune_cache", type=str, default=None, help="Json file where the settings chosen by AUTOTUNE are saved, ~/.cache/lingualoupe/autotune.json by default.")
+
+parser.add_argument("-cascade_threshold", "--cascade_threshold", type=float, default=None, help="Probability from which a linear model over hashed word n-grams, trained on the emotions the sentiment model gives to CASCADE_TRAIN_SIZE texts, labels a text instead of the sentiment model (e.g. 0.9). Lower values classify more texts with the linear model, which is faster but agrees less with the sentiment model. Not used by default.")
+parser.add_argument("-cascade_train_size", "--cascade_train_size", type=int, default=5000, help="Number of texts classified by the sentiment model to train the linear model of the cascade, 20%% of them are held out to measure its agreement with the sentiment model, 5,000 by default.")
 
+parser.add_argument("-progress", "--progress", type=str, default="True", help="Whether to print the texts done, texts per second and time left of the stage running every PROGRESS_INTERVAL seconds (True) or not (False), True by default.")
+parser.add_argument("-progress_file", "--progress_file", type=str, default=None, help="File where the progress of every stage is appended as json lines every PROGRESS_INTERVAL seconds, so a scheduler can poll it. Not used by default.")
+parser.add_argument("-progress_interval", "--progress_interval", type=float, default=10.0, help="Seconds between reports of the progress of a stage, 10 by default.")
 
-run_sentiment_pipeline(text_data, title, text_col, cols_keep_text, count_text_group, mean_text_cols, sum_text_cols,
-                       output_directory, csv_sep, min_rows_par, cancel_par, ch_size, m_topic_size, lang, umap_colour=u_col,
-                       umap_metric=umap_metric_d, umap_neighbours=neighbours_umap, umap_minimum_distance=min_dist_umap, model_type=m_type,
-                       n_neighbours_BERTopic=n_neighbours_BERTopic, umap_n_components_BERTopic=n_components_BERTopic, low_memory_BERTopic=l_memory,
-                       clean_html=c_html)
+parser.add_argument("-report_workers", "--report_workers", type=int, default=1, help="Number of processes used to render the sections of report.html in parallel, 1 by default.")
+
+parser.add_argument("-report_only", "--report_only", type=str, default="False", help="Whether to only generate report.html again from the files and topic models saved in the output directory by a previous run (True) or to run the whole pipeline (False), False by default.")
+
+parser.add_argument("-dry_run", "--dry_run", type=str, default="False", help="Whether to only check the columns and filters used and estimate the number of texts and the time the pipeline will take (True) or to run the pipeline afterwards (False), False by default.")
+
+parser.add_argument("-profile", "--profile", type=str, default="False", help="Whether to save a cProfile dump of each stage of the pipeline in the profiles folder of the output directory (True) or not (False), False by default. The time, rows per second and memory of each stage are always written to metrics.json.")
+
+parser.add_argument("-offline_bundle", "--offline_bundle", type=str, default=None, help="Directory with the nltk data and models downloaded by 'python -m src.resources prefetch', they are read from it without connecting to the internet. Not used by default.")
+
+parser.add_argument("-clean_html", "--clean_html", type=str, default="True", help="Whether to remove html characters from text_column or not, True by default.")
+def main():
+    '''
+    Parse the arguments, check the columns they use with a preflight of the text data and run the pipeline. The modules of the pipeline are imported once the
+    arguments have been checked, so --help or a wrong argument do not wait for transformers, BERTopic or umap to be imported.
+    '''
+    args = parser.parse_args()
+
+    # The bundle has to be used before any module that loads models is imported
+    if args.offline_bundle is not None:
+        from src.resources import use_offline_bundle
+        try:
+            use_offline_bundle(args.offline_bundle)
+        except FileNotFoundError as e:
+            print(e)
+            exit()
+
+    from src.read_data import parse_row_filter
+    from src.preflight import preflight, print_preflight, check_kept_columns
+
+    # Defining input arguments
+    text_data = args.text_data
+    title = args.title
+    if title == "None":
+        # Glob patterns are named after the part before the first wildcard
+        title = re.split(r"[*?\[]", text_data)[0].rstrip("/").split(".")[0]
+    text_col = args.text_column
+    cols_keep_text = args.Columns_to_Keep_Text
+
+    count_text_group = args.group_to_count_text
+    if ("emotion" in count_text_group) == False:
+        count_text_group.append("emotion")
+    mean_text_cols = args.mean_text
+    sum_text_cols = args.sum_text
+    summary_breakdowns = [b.split(",") for b in args.summary_breakdown]
+    row_filters = [parse_row_filter(f) for f in args.filter]
+    output_directory=os.path.join(args.output_directory, title)
+    csv_sep = args.csv_separation
+    min_rows_par = args.minimum_rows_paralllelize
+    #cancel_par = args.cancel_parallelisation
+    cancel_par = True
+    ch_size = args.chunk_size
+    m_topic_size = args.minimum_topic_size
+    lang = args.language
+    u_col = args.umap_colour
+    umap_metric_d = args.umap_metric
+    neighbours_umap = args.umap_n_neighbours
+    min_dist_umap = args.umap_min_dist
+    m_type = args.model_type
+
+    n_neighbours_BERTopic = args.umap_n_neighbours_BERTopic
+    n_components_BERTopic = args.umap_n_components_BERTopic
+
+    # Converting boolean values to the appropiate data type.
+    l_memory = True
+
+    if args.umap_low_memory_BERTopic == "False":
+        l_memory = False
+
+    c_html = True
+
+    if args.clean_html == "False":
+        c_html = False
+
+    s_umap = False
+
+    if args.scalable_umap == "True":
+        s_umap = True
+
+
+    # Checking the columns used before loading the text data or any model, only its header or schema and a sample are read
+    if args.report_only == "True":
+        errors = check_kept_columns(cols_keep_text, umap_colour=u_col, language=lang)
+        if args.rolling_windows < 1:
+            errors.append("ROLLING_WINDOWS must be at least 1")
+        if args.plotly_js not in ["embed", "cdn"]:
+            errors.append("PLOTLY_JS can only be 'embed' or 'cdn'")
+        if args.table_mode not in ["inline", "sharded"]:
+            errors.append("TABLE_MODE can only be 'inline' or 'sharded'")
+        if args.progress_interval <= 0:
+            errors.append("PROGRESS_INTERVAL must be greater than 0")
+        for error in errors:
+            print(error)
+    else:
+        preflight_result = preflight(text_data, text_col, cols_keep_text, count_text_group, mean_text_cols, sum_text_cols,
+                                     summary_breakdowns=summary_breakdowns, umap_colour=u_col, row_filters=row_filters,
+                                     csv_sep=csv_sep, chunk_size=ch_size, output_directory=output_directory, language=lang,
+                                     time_column=args.time_column, window=args.window)
+        if args.rolling_windows < 1:
+            preflight_result["errors"].append("ROLLING_WINDOWS must be at least 1")
+        if args.executor not in [None, "thread", "process", "dask"]:
+            preflight_result["errors"].append("EXECUTOR can only be 'thread', 'process' or 'dask'")
+        if args.output_format not in ["csv", "parquet", "arrow"]:
+            preflight_result["errors"].append("OUTPUT_FORMAT can only be 'csv', 'parquet' or 'arrow'")
+        if args.plotly_js not in ["embed", "cdn"]:
+            preflight_result["errors"].append("PLOTLY_JS can only be 'embed' or 'cdn'")
+        if args.table_mode not in ["inline", "sharded"]:
+            preflight_result["errors"].append("TABLE_MODE can only be 'inline' or 'sharded'")
+        if args.progress_interval <= 0:
+            preflight_result["errors"].append("PROGRESS_INTERVAL must be greater than 0")
+        if (args.cascade_threshold is not None) and not (0 < args.cascade_threshold <= 1):
+            preflight_result["errors"].append("CASCADE_THRESHOLD must be greater than 0 and at most 1")
+        if args.cascade_train_size < 10:
+            preflight_result["errors"].append("CASCADE_TRAIN_SIZE must be at least 10")
+        if args.batch_size < 1:
+            preflight_result["errors"].append("BATCH_SIZE must be at least 1")
+        if (args.threads is not None) and (args.threads < 1):
+            preflight_result["errors"].append("THREADS must be at least 1")
+        if (args.memory_budget is not None) and (args.memory_budget <= 0):
+            preflight_result["errors"].append("MEMORY_BUDGET must be greater than 0")
+        print_preflight(preflight_result, text_data)
+        errors = preflight_result["errors"]
+    if (len(errors) > 0) or (args.dry_run == "True"):
+        exit()
 
-absolute_path_to_html = os.path.abspath(output_directory)
-webbrowser.open(f"file://{absolute_path_to_html}/report.html")
\ No newline at end of file
+    # Check if nltk stopwords are installed
+    from src.resources import install_stopwords
+    install_stopwords()
+
+    if args.report_only == "True":
+        from src.run_pipeline import run_report_only
+        run_report_only(title, output_directory, lang, umap_colour=u_col, umap_metric=umap_metric_d, umap_neighbours=neighbours_umap,
+                        umap_minimum_distance=min_dist_umap, scalable_umap=s_umap, umap_sample_size=args.umap_sample_size,
+                        umap_max_points=args.umap_max_points, plotly_js=args.plotly_js, table_mode=args.table_mode,
+                        table_shard_size=args.table_shard_size, report_workers=args.report_workers,
+                        profile=args.profile == "True", rolling_windows=args.rolling_windows,
+                        show_progress=args.progress == "True", progress_file=args.progress_file,
+                        progress_interval=args.progress_interval)
+    else:
+        from src.run_pipeline import run_sentiment_pipeline
+        run_sentiment_pipeline(text_data, title, text_col, cols_keep_text, count_text_group, mean_text_cols, sum_text_cols,
+                               output_directory, csv_sep, min_rows_par, cancel_par, ch_size, m_topic_size, lang, umap_colour=u_col,
+                               umap_metric=umap_metric_d, umap_neighbours=neighbours_umap, umap_minimum_distance=min_dist_umap, model_type=m_type,
+                               n_neighbours_BERTopic=n_neighbours_BERTopic, umap_n_components_BERTopic=n_components_BERTopic, low_memory_BERTopic=l_memory,
+                               clean_html=c_html, scalable_umap=s_umap, umap_sample_size=args.umap_sample_size, umap_max_points=args.umap_max_points,
+                               plotly_js=args.plotly_js, table_mode=args.table_mode, table_shard_size=args.table_shard_size,
+                               report_workers=args.report_workers, summary_breakdowns=summary_breakdowns,
+                               output_format=args.output_format, output_compression=args.output_compression,
+                               row_filters=row_filters, read_workers=args.read_workers,
+                               profile=args.profile == "True", time_column=args.time_column, window=args.window,
+                               rolling_windows=args.rolling_windows, executor_backend=args.executor, workers=args.workers,
+                               scheduler_address=args.scheduler_address, partition_size=args.partition_size,
+                               batch_size=args.batch_size, threads=args.threads, autotune=args.autotune == "True",
+                               memory_budget=args.memory_budget, autotune_cache=args.autotune_cache,
+                               show_progress=args.progress == "True", progress_file=args.progress_file,
+                               progress_interval=args.progress_interval, cascade_threshold=args.cascade_threshold,
+                               cascade_train_size=args.cascade_train_size)
+
+    absolute_path_to_html = os.path.abspath(output_directory)
+    webbrowser.open(f"file://{absolute_path_to_html}/report.html")
+
+# Guarding the pipeline so processes started to render the report do not run it again.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+'''
+Synthetic corpora used by the benchmarks. Texts are built from a few topics and a small sentiment lexicon with a fixed seed,
+so the same corpus is generated on every machine.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+
+topics = {
+    "climate": "climate warming carbon emissions heat temperature planet energy solar ice sea drought".split(),
+    "football": "football match goal team score player league coach stadium season referee fans".split(),
+    "food": "pizza pasta cheese tomato restaurant dinner taste chef menu dessert waiter kitchen".split(),
+    "phones": "phone battery screen camera charger apps update storage signal speaker design price".split(),
+    "travel": "hotel flight airport room beach trip luggage booking staff view breakfast city".split(),
+}
+
+positive_words = "great love amazing excellent happy perfect wonderful best enjoy fantastic".split()
+negative_words = "terrible hate awful worst broken angry disappointing poor horrible useless".split()
+filler_words = "the a and of to in it is was this that with for on but really very".split()
+
+def random_texts(rng, n_rows, min_words, max_words):
+    '''
+    Generate n_rows texts, each one mostly made of the words of a topic mixed with sentiment and filler words.
+    '''
+    topic_names = list(topics.keys())
+    topic_index = rng.integers(len(topic_names), size=n_rows)
+    lengths = rng.integers(min_words, max_words + 1, size=n_rows)
+    # Share of sentiment words of each text, positive if above 0 and negative if below
+    polarity = rng.choice([-1, 0, 1], size=n_rows)
+
+    texts = []
+    for i in range(n_rows):
+        vocabulary = topics[topic_names[topic_index[i]]]
+        words = rng.choice(vocabulary, size=lengths[i]).astype(object)
+        filler_positions = rng.random(lengths[i]) < 0.35
+        words[filler_positions] = rng.choice(filler_words, size=filler_positions.sum())
+        if polarity[i] != 0:
+            lexicon = positive_words if polarity[i] > 0 else negative_words
+            sentiment_positions = rng.random(lengths[i]) < 0.15
+            words[sentiment_positions] = rng.choice(lexicon, size=sentiment_positions.sum())
+        texts.append(" ".join(words))
+    return texts, np.array(topic_names)[topic_index], polarity
+
+def generate_tweets(n_rows, seed=42):
+    '''
+    Short texts with mentions, hashtags, links and html entities, like the ones found in social media.
+    '''
+    rng = np.random.default_rng(seed)
+    texts, topic, polarity = random_texts(rng, n_rows, 5, 30)
+    decorations = rng.integers(4, size=n_rows)
+    for i in np.flatnonzero(decorations == 1):
+        texts[i] = f"@user{rng.integers(1000)} {texts[i]} #{topic[i]}"
+    for i in np.flatnonzero(decorations == 2):
+        texts[i] = f"{texts[i]} &amp; more https://t.co/{rng.integers(10**6)}"
+    for i in np.flatnonzero(decorations == 3):
+        texts[i] = f"<p>{texts[i]}</p>"
+    return pd.DataFrame({
+        "text": texts,
+        "likes": rng.poisson(20, size=n_rows),
+        "retweets": rng.poisson(5, size=n_rows),
+        "created_at": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(365 * 24 * 3600, size=n_rows), unit="s"),
+    })
+
+def generate_reviews(n_rows, seed=42):
+    '''
+    Long product and service reviews with a star rating, some of them longer than the 512 tokens the sentiment models
+    accept so they are divided in chunks.
+    '''
+    rng = np.random.default_rng(seed)
+    texts, topic, polarity = random_texts(rng, n_rows, 40, 400)
+    # 2% of the reviews are very long
+    for i in np.flatnonzero(rng.random(n_rows) < 0.02):
+        texts[i] = " ".join([texts[i]] * 4)
+    stars = np.clip(3 + 2 * polarity + rng.integers(-1, 2, size=n_rows), 1, 5)
+    return pd.DataFrame({
+        "text": texts,
+        "stars": stars,
+        "product": topic,
+        "created_at": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(365 * 24 * 3600, size=n_rows), unit="s"),
+    })
+
+corpus_generators = {
+    "tweets": generate_tweets,
+    "reviews": generate_reviews,
+}
+
+def corpus_path(corpus, n_rows, data_directory, seed=42):
+    '''
+    Path of a synthetic corpus saved as parquet, generating it the first time it is requested.
+    '''
+    file_path = os.path.join(data_directory, f"{corpus}_{n_rows}_{seed}.parquet")
+    if not os.path.exists(file_path):
+        os.makedirs(data_directory, exist_ok=True)
+        corpus_generators[corpus](n_rows, seed=seed).to_parquet(file_path + ".tmp", index=False)
+        os.replace(file_path + ".tmp", file_path)
+    return file_path
@@ -0,0 +1,195 @@
+'''
+Benchmark of every stage of the LinguaLoupe pipeline on synthetic corpora, using stub models so no network is needed.
+The seconds, rows per second, latency percentiles and peak memory of each stage are saved in benchmark_results.json and
+compared with a stored baseline. Run it from the root of the repository:
+
+    python -m benchmarks.run_benchmarks -c tweets -c reviews -r 10000 -r 100000 -repeat 3
+
+The exit status is 1 if any stage is slower, or uses more memory, than the baseline by more than THRESHOLD.
+'''
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.corpora import corpus_generators, corpus_path
+
+benchmarks_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Columns kept, averaged and summed for each corpus
+corpus_columns = {
+    "tweets": (["likes", "retweets", "created_at"], ["likes"], ["retweets"]),
+    "reviews": (["stars", "product", "created_at"], ["stars"], []),
+}
+
+def run_once(corpus, n_rows, data_path, output_directory):
+    '''
+    Run the pipeline with stub models on a corpus and return its metrics. It is called in a new process for every run so the
+    peak memory measured belongs to that run only.
+    '''
+    from benchmarks.stub_models import stub_models
+    from src.run_pipeline import run_sentiment_pipeline
+
+    columns_to_keep, columns_to_mean, columns_to_sum = corpus_columns[corpus]
+    os.makedirs(output_directory, exist_ok=True)
+    with stub_models():
+        run_sentiment_pipeline(data_path, f"{corpus}_{n_rows}", "text", columns_to_keep, ["emotion"], columns_to_mean, columns_to_sum,
+                               output_directory, ",", 10000, True, 512, 10, "english", scalable_umap=True,
+                               table_mode="sharded", summary_breakdowns=[["emotion", "created_at@M"]])
+
+    with open(os.path.join(output_directory, "metrics.json"), encoding="utf-8") as file:
+        return json.load(file)
+
+def summarize_runs(runs):
+    '''
+    Combine the metrics of the repetitions of a benchmark: median and 90th percentile of the seconds of each stage, rows per
+    second at the median, median of the latency percentiles of the calls and the highest peak memory, in total and per row.
+    '''
+    stages = {}
+    for name in runs[0]["stages"].keys():
+        stage_runs = [r["stages"][name] for r in runs if name in r["stages"]]
+        seconds = [s["seconds"] for s in stage_runs]
+        summary = {
+            "seconds_median": statistics.median(seconds),
+            "seconds_p90": sorted(seconds)[min(len(seconds) - 1, int(0.9 * len(seconds)))],
+            "calls": stage_runs[0]["calls"],
+            "rows": stage_runs[0]["rows"],
+        }
+        if (summary["rows"] > 0) and (summary["seconds_median"] > 0):
+            summary["rows_per_second"] = summary["rows"] / summary["seconds_median"]
+        if "latency_ms" in stage_runs[0]:
+            summary["latency_ms"] = {q: statistics.median(s["latency_ms"][q] for s in stage_runs) for q in stage_runs[0]["latency_ms"].keys()}
+        if "peak_rss_mb" in stage_runs[0]:
+            summary["peak_rss_mb"] = max(s["peak_rss_mb"] for s in stage_runs)
+        stages[name] = summary
+
+    return {
+        "total_seconds_median": statistics.median(r["total_seconds"] for r in runs),
+        "peak_rss_mb": max(r["peak_rss_mb"] for r in runs),
+        "peak_rss_kb_per_row": max(r.get("peak_rss_kb_per_row", 0) for r in runs),
+        "repeat": len(runs),
+        "stages": stages,
+    }
+
+def compare_with_baseline(results, baseline, threshold=0.2, min_seconds=0.1):
+    '''
+    Find the stages whose median seconds, or the benchmarks whose peak memory, are higher than in the baseline by more than
+    threshold (0.2 is 20 %). Stages that took less than min_seconds in the baseline are ignored since they are mostly noise.
+    '''
+    regressions = []
+    for benchmark, result in results.items():
+        if benchmark not in baseline:
+            continue
+        expected = baseline[benchmark]
+        for name, stage in result["stages"].items():
+            if name not in expected["stages"]:
+                continue
+            baseline_seconds = expected["stages"][name]["seconds_median"]
+            if (baseline_seconds >= min_seconds) and (stage["seconds_median"] > baseline_seconds * (1 + threshold)):
+                regressions.append(f"{benchmark} {name}: {stage['seconds_median']:.2f} s, {baseline_seconds:.2f} s in the baseline "
+                                   f"(+{100 * (stage['seconds_median'] / baseline_seconds - 1):.0f} %)")
+        if result["peak_rss_mb"] > expected["peak_rss_mb"] * (1 + threshold):
+            regressions.append(f"{benchmark} peak memory: {result['peak_rss_mb']:.0f} MB, {expected['peak_rss_mb']:.0f} MB in the baseline")
+    return regressions
+
+def print_results(results):
+    '''
+    Print the median seconds, rows per second and latencies of each stage.
+    '''
+    for benchmark, result in results.items():
+        print(f"\n{benchmark}: {result['total_seconds_median']:.1f} s, peak memory {result['peak_rss_mb']:.0f} MB "
+              f"({result.get('peak_rss_kb_per_row', 0):.1f} KB per text)")
+        for name, stage in result["stages"].items():
+            line = f"    {name:<45} {stage['seconds_median']:>9.3f} s"
+            if "rows_per_second" in stage:
+                line += f" {stage['rows_per_second']:>12.0f} rows/s"
+            if "latency_ms" in stage:
+                line += f"   p50 {stage['latency_ms']['p50']:.3f} ms p99 {stage['latency_ms']['p99']:.3f} ms"
+            print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--corpus", help="Synthetic corpus to benchmark: 'tweets' (short social media texts) or 'reviews' (long reviews, some of them divided in chunks). This parameter can be specified more than once, both are used by default.",
+                        action="append", default=[], choices=list(corpus_generators.keys()))
+    parser.add_argument("-r", "--rows", help="Number of texts of the corpus (e.g. 10000, 100000 or 1000000). This parameter can be specified more than once, 10,000 by default.",
+                        action="append", default=[], type=int)
+    parser.add_argument("-repeat", "--repeat", type=int, default=3, help="Number of times each benchmark is run, 3 by default.")
+    parser.add_argument("-seed", "--seed", type=int, default=42, help="Seed used to generate the corpora, 42 by default.")
+    parser.add_argument("-baseline", "--baseline", type=str, default=os.path.join(benchmarks_directory, "baseline.json"),
+                        help="Results to compare with, benchmarks/baseline.json by default.")
+    parser.add_argument("-update_baseline", "--update_baseline", type=str, default="False",
+                        help="Whether to save the results as the new baseline (True) or not (False), False by default. Regressions against the previous baseline are reported but do not change the exit status when it is updated.")
+    parser.add_argument("-threshold", "--threshold", type=float, default=0.2,
+                        help="Increase over the baseline above which a stage is considered a regression, 0.2 (20 %%) by default.")
+    parser.add_argument("-min_seconds", "--min_seconds", type=float, default=0.1,
+                        help="Stages faster than this in the baseline are not compared, 0.1 seconds by default.")
+    parser.add_argument("-o", "--output_directory", type=str, default=os.path.join(benchmarks_directory, "output"),
+                        help="Directory where the outputs of the pipeline and benchmark_results.json are saved, benchmarks/output by default.")
+    parser.add_argument("-data_directory", "--data_directory", type=str, default=os.path.join(benchmarks_directory, "data"),
+                        help="Directory where the synthetic corpora are saved so they are generated only once, benchmarks/data by default.")
+    args = parser.parse_args()
+
+    corpora = args.corpus if len(args.corpus) > 0 else list(corpus_generators.keys())
+    row_counts = args.rows if len(args.rows) > 0 else [10000]
+
+    results = {}
+    for corpus in corpora:
+        for n_rows in row_counts:
+            benchmark = f"{corpus}_{n_rows}"
+            print(f"Generating {benchmark}...")
+            data_path = corpus_path(corpus, n_rows, args.data_directory, seed=args.seed)
+            runs = []
+            for i in range(args.repeat):
+                print(f"Running {benchmark} ({i + 1}/{args.repeat})...")
+                # A new process for every run, spawned so it does not inherit the memory of this one
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    runs.append(executor.submit(run_once, corpus, n_rows, data_path,
+                                                os.path.join(args.output_directory, benchmark)).result())
+            results[benchmark] = summarize_runs(runs)
+
+    print_results(results)
+
+    output = {
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    os.makedirs(args.output_directory, exist_ok=True)
+    with open(os.path.join(args.output_directory, "benchmark_results.json"), "w", encoding="utf-8") as file:
+        json.dump(output, file, indent=4)
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare_with_baseline(results, baseline["results"], threshold=args.threshold, min_seconds=args.min_seconds)
+        print(f"\nCompared with {args.baseline} (recorded on {baseline['environment']['platform']}):")
+        for regression in regressions:
+            print(f"    REGRESSION {regression}")
+        if len(regressions) == 0:
+            print(f"    No stage is more than {100 * args.threshold:.0f} % slower than the baseline.")
+    else:
+        print(f"\nNo baseline found in {args.baseline}, use -update_baseline True to save these results as the baseline.")
+
+    if args.update_baseline == "True":
+        # Benchmarks not run this time are kept in the baseline
+        if os.path.exists(args.baseline):
+            baseline["results"].update(results)
+            baseline["environment"] = output["environment"]
+            output = baseline
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(output, file, indent=4)
+        print(f"Baseline saved in {args.baseline}")
+        # The regressions were against the previous baseline, the new one accepts them
+        regressions = []
+
+    sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,73 @@
+'''
+Benchmark of the startup time of LinguaLoupe: the time to print the help, to reject an input with a missing column (which
+should not load any model) and to import the pipeline. Each command is run in a new Python process and the median of the
+runs is printed. Run it from the root of the repository:
+
+    python -m benchmarks.startup -repeat 5 -importtime True
+'''
+
+import argparse
+import csv
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+repository_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_command(command, repeat=5):
+    '''
+    Median seconds it takes to run a command in a new process.
+    '''
+    seconds = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=repository_directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+def slowest_imports(module, n=15):
+    '''
+    Modules that take longest to import (including the modules they import) when importing module, from python -X importtime.
+    '''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=repository_directory,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        # Lines are "import time: self [us] | cumulative | imported package"
+        parts = line.split("|")
+        if (len(parts) != 3) or (parts[1].strip().isdigit() == False):
+            continue
+        imports.append((int(parts[1].strip()) / 10**6, parts[2].strip()))
+    return sorted(imports, reverse=True)[:n]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-repeat", "--repeat", type=int, default=5, help="Number of times each command is run, 5 by default.")
+    parser.add_argument("-importtime", "--importtime", type=str, default="False",
+                        help="Whether to list the slowest imports of the pipeline (True) or not (False), False by default.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Small csv without the column asked for, LinguaLoupe should exit before loading anything
+        data_path = os.path.join(directory, "texts.csv")
+        with open(data_path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["text", "likes"])
+            writer.writerow(["I love it", 3])
+
+        commands = {
+            "help": [sys.executable, "LinguaLoupe.py", "--help"],
+            "missing column": [sys.executable, "LinguaLoupe.py", "-t", data_path, "-text_c", "review", "-o", directory],
+            "import pipeline": [sys.executable, "-c", "import src.run_pipeline"],
+            "python": [sys.executable, "-c", "pass"],
+        }
+        for name, command in commands.items():
+            print(f"{name:<20} {time_command(command, args.repeat):>8.3f} s")
+
+    if args.importtime == "True":
+        print("\nSlowest imports of src.run_pipeline:")
+        for seconds, module in slowest_imports("src.run_pipeline"):
+            print(f"    {module:<50} {seconds:>8.3f} s")
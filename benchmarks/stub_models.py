@@ -0,0 +1,69 @@
+'''
+Small models that stand in for the sentiment classifier, its tokenizer and the sentence transformer, so the benchmarks run
+without downloading models or using the network. They are cheap but have the same interface as the real ones, so the rest
+of the pipeline (chunking, UMAP, HDBSCAN, c-TF-IDF, report) does the same work it does with real models.
+'''
+
+from contextlib import contextmanager
+
+import numpy as np
+from bertopic.backend import BaseEmbedder
+from sklearn.feature_extraction.text import HashingVectorizer
+
+import src.get_topics
+import src.reviews
+from benchmarks.corpora import negative_words, positive_words
+
+class StubTokenizer:
+    '''
+    Whitespace tokenizer with the interface of a transformers tokenizer.
+    '''
+    def __call__(self, text, **kwargs):
+        if isinstance(text, list):
+            return {"input_ids": [self(t)["input_ids"] for t in text]}
+        return {"input_ids": list(range(len(text.split()) + 2))}
+
+class StubClassifier:
+    '''
+    Lexicon based classifier with the interface of a transformers sentiment-analysis pipeline of cardiffnlp/twitter-roberta-base-sentiment.
+    '''
+    def __init__(self):
+        self.positive = set(positive_words)
+        self.negative = set(negative_words)
+
+    def __call__(self, text, **kwargs):
+        if isinstance(text, list):
+            return [self(t)[0] for t in text]
+        words = text.split()
+        balance = sum(w in self.positive for w in words) - sum(w in self.negative for w in words)
+        label = "LABEL_2" if balance > 0 else "LABEL_0" if balance < 0 else "LABEL_1"
+        return [{"label": label, "score": min(0.5 + abs(balance) / 10, 0.99)}]
+
+class StubEmbedder(BaseEmbedder):
+    '''
+    Sentence embeddings made with a hashing vectorizer and a fixed random projection.
+    '''
+    def __init__(self, dimensions=64):
+        super().__init__()
+        self.vectorizer = HashingVectorizer(n_features=2**14, alternate_sign=False, norm="l2")
+        self.projection = np.random.default_rng(0).normal(size=(2**14, dimensions)).astype(np.float32)
+
+    def encode(self, documents, **kwargs):
+        return np.asarray(self.vectorizer.transform(documents) @ self.projection)
+
+    def embed(self, documents, verbose=False):
+        return self.encode(documents)
+
+@contextmanager
+def stub_models():
+    '''
+    Replace the models loaded by the pipeline with the stubs while in the context.
+    '''
+    originals = (src.reviews.load_classification_model, src.reviews.load_tokenizer, src.get_topics.load_embedding_model)
+    src.reviews.load_classification_model = lambda language="english", model_type="social_media": StubClassifier()
+    src.reviews.load_tokenizer = lambda language="english", m_type="social_media": StubTokenizer()
+    src.get_topics.load_embedding_model = lambda lang="english": StubEmbedder()
+    try:
+        yield
+    finally:
+        src.reviews.load_classification_model, src.reviews.load_tokenizer, src.get_topics.load_embedding_model = originals
@@ -0,0 +1,125 @@
+'''
+Python API to classify texts as they arrive, e.g. from a message queue, instead of running the whole pipeline on a file.
+Records are read from any iterator and yielded back with their emotion, without writing files or a report:
+
+    from src.api import load_models, classify_stream
+
+    models = load_models(language="english", topic_models_directory="results/Title/models")
+    for record in classify_stream(consumer_records, text_column="message", columns_to_keep=["id"], models=models):
+        ...
+'''
+
+import collections
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.reviews import classify_emotions, clean_html, load_tokenizer
+from src.sentiment import load_classification_model
+from src.get_topics import load_topic_centroids, load_embedding_model, assign_topics
+
+def load_models(language="english", model_type="social_media", topic_models_directory=None):
+    '''
+    Load the sentiment classification model and its tokenizer and, if topic_models_directory (output_directory/models of a run
+    of the pipeline) is given, the embeddings of the topics saved in it and the embedding model they were computed with.
+    Returns a dictionary with the models to pass to classify_records and classify_stream, so they are loaded only once.
+    '''
+    models = {
+        "language": language,
+        "model_type": model_type,
+        "classifier": load_classification_model(language=language, model_type=model_type),
+        "tokenizer": load_tokenizer(language, model_type),
+        "embedding_model": None,
+        "topic_centroids": None,
+    }
+    if topic_models_directory is not None:
+        manifest, models["topic_centroids"] = load_topic_centroids(topic_models_directory)
+        models["embedding_model"] = load_embedding_model(manifest["language"] or language)
+    return models
+
+def classify_records(records, models, text_column="text", columns_to_keep=[], clean_html_text=True, divide_in_chunks=512,
+                     batch_size=32):
+    '''
+    Classify a list of records (dictionaries) with the models returned by load_models. Returns a list with a dictionary for
+    each record with its text, emotion, emotion_score, the columns to keep and, if there are topic models, its global_topic and
+    topic. Records without text, or whose text does not contain any letter, are returned with None as emotion.
+    '''
+    texts = [r.get(text_column) for r in records]
+    if clean_html_text:
+        texts = [clean_html(t) if isinstance(t, str) else t for t in texts]
+    valid = np.array([isinstance(t, str) and (re.search(r"[A-Za-z]", t) is not None) for t in texts], dtype=bool)
+    positions = np.flatnonzero(valid)
+    valid_texts = [texts[i] for i in positions]
+
+    emotions = np.full(len(records), None, dtype=object)
+    scores = np.full(len(records), np.nan, dtype=np.float32)
+    if positions.shape[0] > 0:
+        valid_emotions, scores[positions] = classify_emotions(pd.Series(valid_texts, dtype="string[pyarrow]"), models["classifier"],
+                                                              models["tokenizer"], language=models["language"],
+                                                              m_type=models["model_type"], divide_in_chunks=divide_in_chunks,
+                                                              batch_size=batch_size, block_size=max(len(valid_texts), 1))
+        emotions[positions] = np.asarray(valid_emotions, dtype=object)
+
+    topic_columns = {}
+    if (models["topic_centroids"] is not None) and (positions.shape[0] > 0):
+        topics = assign_topics(valid_texts, emotions[positions], models["topic_centroids"], models["embedding_model"])
+        for c in ("global_topic", "topic"):
+            topic_columns[c] = np.full(len(records), None, dtype=object)
+            topic_columns[c][positions] = topics[c].tolist()
+
+    results = []
+    for i, record in enumerate(records):
+        result = {"text": texts[i], "emotion": emotions[i], "emotion_score": None if np.isnan(scores[i]) else float(scores[i])}
+        for c in columns_to_keep:
+            result[c] = record.get(c)
+        for c, values in topic_columns.items():
+            result[c] = values[i]
+        results.append(result)
+    return results
+
+def classify_stream(records, text_column="text", columns_to_keep=[], models=None, language="english", model_type="social_media",
+                    topic_models_directory=None, batch_records=256, max_in_flight=2, clean_html_text=True, divide_in_chunks=512,
+                    batch_size=32):
+    '''
+    Classify the records (dictionaries) of an iterator, which can be endless, yielding a dictionary for each of them in the
+    same order (see classify_records). Records are read in batches of batch_records and classified in a background thread while
+    the previous results are consumed. At most max_in_flight batches are held at once, counting the batch being read, the
+    batches being classified or waiting to be yielded and the batch being yielded, so records are only taken from the iterator
+    as fast as the results are consumed. Batches already classified are yielded whenever a record is read, so a
+    slow iterator does not hold back results until the next batch is full; if the iterator stops sending records, the results
+    wait for the next record (a smaller batch_records lowers that latency). The models are loaded with load_models if not given.
+    '''
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1")
+    if models is None:
+        models = load_models(language=language, model_type=model_type, topic_models_directory=topic_models_directory)
+
+    records = iter(records)
+    in_flight = collections.deque()
+    # The iterator is only read from the thread consuming the generator, so it does not need to be thread safe
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        try:
+            while True:
+                # The batch about to be read counts toward max_in_flight, so it is only read once a batch has been yielded
+                if len(in_flight) >= max_in_flight:
+                    yield from in_flight.popleft().result()
+                batch = []
+                for record in records:
+                    batch.append(record)
+                    while (len(in_flight) > 0) and in_flight[0].done():
+                        yield from in_flight.popleft().result()
+                    if len(batch) >= batch_records:
+                        break
+                if len(batch) == 0:
+                    break
+                in_flight.append(executor.submit(classify_records, batch, models, text_column=text_column,
+                                                 columns_to_keep=columns_to_keep, clean_html_text=clean_html_text,
+                                                 divide_in_chunks=divide_in_chunks, batch_size=batch_size))
+            while len(in_flight) > 0:
+                yield from in_flight.popleft().result()
+        finally:
+            # Batches not started yet are discarded if the generator is closed before the end
+            for future in in_flight:
+                future.cancel()
@@ -0,0 +1,171 @@
+'''
+Calibration of the number of torch threads, the batch size and the number of worker processes used to classify the texts.
+The texts/sec of every configuration are measured on a sample of the texts to classify, together with the memory a worker
+needs, and the fastest configuration that fits in a memory budget is chosen. The result is saved for the machine and the model
+in a json file, so later runs on the same machine start already tuned without measuring again.
+'''
+
+import json
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+import psutil
+
+from src.metrics import rss_mb
+from src.sentiment import classification_model_name, classify_texts, set_torch_threads
+from src.language import detect_languages
+
+default_cache = os.path.join(os.path.expanduser("~"), ".cache", "lingualoupe", "autotune.json")
+candidate_batch_sizes = [8, 16, 32, 64]
+
+def candidate_threads(cpus):
+    '''
+    Numbers of torch threads tried on a machine with cpus cores: the powers of two below cpus and cpus.
+    '''
+    threads = [t for t in (2**i for i in range(cpus.bit_length())) if t < cpus]
+    return threads + [cpus]
+
+def default_memory_budget():
+    '''
+    Memory budget in GB when none is given, 80% of the memory of the machine.
+    '''
+    return 0.8 * psutil.virtual_memory().total / 2**30
+
+def machine_key():
+    '''
+    Identifier of the machine the calibration is valid for: its name, architecture, cores and memory.
+    '''
+    memory = round(psutil.virtual_memory().total / 2**30)
+    return f"{platform.node()}/{platform.machine()}/{os.cpu_count()}cpu/{memory}GB"
+
+def settings_key(model_name, parallel, memory_budget, workers=None):
+    '''
+    Key of the settings of a model in the cache of a machine. Settings depend on the budget and on whether the texts are
+    classified by worker processes, and how many of them if they are not tuned.
+    '''
+    processes = f"processes:{workers or 'tuned'}" if parallel else "single"
+    return f"{machine_key()}|{model_name}|{processes}|{round(memory_budget, 1)}GB"
+
+def read_cache(cache_path):
+    '''
+    Settings saved in cache_path, an empty dictionary if there are none or the file can not be read.
+    '''
+    try:
+        with open(cache_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache_path, key, settings):
+    '''
+    Save the settings of a key in cache_path, keeping the settings of other machines and models.
+    '''
+    cache = read_cache(cache_path)
+    cache[key] = settings
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(cache, f, indent=4)
+
+def measure(function):
+    '''
+    Call function while the resident memory of the process is sampled. Returns the seconds it took and the peak memory in MB
+    it used above the memory of the process before the call.
+    '''
+    baseline = rss_mb()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            peak[0] = max(peak[0], rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        function()
+    finally:
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    return seconds, max(peak[0], rss_mb()) - baseline
+
+def calibrate(texts, model, language="english", m_type="social_media", memory_budget=None, parallel=False, workers=None,
+              max_seconds=60):
+    '''
+    Measure the texts/sec of a loaded model on a list of texts for every number of torch threads and batch size, and choose
+    the fastest within memory_budget (in GB). A worker needs the memory of this process with the model loaded and the peak
+    memory of classifying a batch. If parallel is True the texts are classified by worker processes, and the number of workers
+    is tuned too (unless workers is given) assuming each of them classifies as fast as this process with the cores left. Larger
+    batches are not tried once they are slower, and the calibration stops after max_seconds. Returns the settings chosen.
+    '''
+    cpus = os.cpu_count() or 1
+    budget_mb = (memory_budget if memory_budget is not None else default_memory_budget()) * 1024
+    # Memory of a worker before classifying, this process holds the data too so it is an upper bound
+    model_mb = rss_mb()
+    start = time.perf_counter()
+    # The first call is slower since torch allocates its buffers
+    classify_texts(texts[:candidate_batch_sizes[0]], model, language=language, model_type=m_type, batch_size=candidate_batch_sizes[0])
+
+    measurements = []
+    for threads in candidate_threads(cpus if workers is None else max(cpus // workers, 1)):
+        set_torch_threads(threads)
+        previous_rate = 0
+        for batch_size in candidate_batch_sizes:
+            seconds, batch_mb = measure(lambda: classify_texts(texts, model, language=language, model_type=m_type, batch_size=batch_size))
+            rate = len(texts) / seconds
+            worker_mb = model_mb + batch_mb
+            n_workers = 1
+            if parallel:
+                n_workers = workers if workers is not None else min(cpus // threads, int(budget_mb // worker_mb))
+            measurements.append({"threads": threads, "batch_size": batch_size, "workers": n_workers,
+                                 "texts_per_second": rate * n_workers, "worker_memory_mb": worker_mb,
+                                 "fits": (n_workers >= 1) and (n_workers * worker_mb <= budget_mb)})
+            if (rate < previous_rate) or (time.perf_counter() - start > max_seconds):
+                break
+            previous_rate = rate
+        if time.perf_counter() - start > max_seconds:
+            break
+
+    fitting = [m for m in measurements if m["fits"]]
+    if len(fitting) == 0:
+        # Nothing fits, the configuration using the least memory is the one most likely to finish
+        best = dict(min(measurements, key=lambda m: m["worker_memory_mb"]), workers=1)
+        print(f"No configuration fits in a memory budget of {budget_mb / 1024:.1f} GB, using the one that needs the least memory")
+    else:
+        best = max(fitting, key=lambda m: m["texts_per_second"])
+    return {"threads": best["threads"], "batch_size": best["batch_size"], "workers": best["workers"],
+            "texts_per_second": round(best["texts_per_second"], 2), "worker_memory_mb": round(best["worker_memory_mb"], 1),
+            "measured": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def tuned_settings(texts, load_models, language="english", m_type="social_media", memory_budget=None, parallel=False, workers=None,
+                   cache_path=None, sample_size=256):
+    '''
+    Threads, batch size and workers to classify a series of texts, read from cache_path (default_cache if None) if this machine
+    and model have been calibrated with the same budget, or calibrated on a random sample of sample_size of the texts with the
+    models returned by load_models(language, m_type) and saved otherwise. If language is "auto", the model of the language most
+    found in the sample is calibrated. Returns the settings, or None if there are no texts to calibrate with.
+    '''
+    if texts.shape[0] == 0:
+        return None
+    sample = texts.sample(min(sample_size, texts.shape[0]), random_state=0).astype(str).to_list()
+    if language == "auto":
+        languages = detect_languages(sample)
+        language = languages.categories[np.bincount(languages.codes, minlength=len(languages.categories)).argmax()]
+    cache_path = cache_path if cache_path is not None else default_cache
+    memory_budget = memory_budget if memory_budget is not None else default_memory_budget()
+    key = settings_key(classification_model_name(language, m_type), parallel, memory_budget, workers)
+
+    cache = read_cache(cache_path)
+    if key in cache:
+        return cache[key]
+
+    model, _ = load_models(language, m_type)
+    settings = calibrate(sample, model, language=language, m_type=m_type, memory_budget=memory_budget, parallel=parallel,
+                         workers=workers)
+    del model
+    save_cache(cache_path, key, settings)
+    return settings
@@ -0,0 +1,113 @@
+'''
+Cascade of a cheap classifier and the sentiment models. A linear model over hashed word n-grams is trained on the emotions
+the sentiment model gives to a sample of the texts, and labels the rest of the texts whose probability reaches a threshold;
+only the texts it is not confident about are classified by the sentiment model. Part of the sample is held out to measure how
+often the linear model agrees with the sentiment model above the threshold, so the accuracy given up for the time saved is
+known.
+'''
+
+import time
+
+import numpy as np
+
+from src.metrics import stage, count
+from src.progress import advance
+
+def hashed_ngrams(texts, n_features=2**20):
+    '''
+    Sparse matrix with the counts of the hashed words and pairs of words of a list of texts, normalized to unit length.
+    '''
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    vectorizer = HashingVectorizer(n_features=n_features, ngram_range=(1, 2), alternate_sign=False, norm="l2")
+    return vectorizer.transform(texts)
+
+def fit_linear_classifier(texts, emotions):
+    '''
+    Logistic regression trained with stochastic gradient descent on the hashed n-grams of a list of texts and their emotions.
+    '''
+    from sklearn.linear_model import SGDClassifier
+
+    model = SGDClassifier(loss="log_loss", alpha=1e-5, max_iter=50, tol=1e-4, random_state=0)
+    model.fit(hashed_ngrams(texts), emotions)
+    return model
+
+def linear_predictions(model, texts):
+    '''
+    Emotion and probability of the most likely emotion of each text of a list given by the linear model.
+    '''
+    probabilities = model.predict_proba(hashed_ngrams(texts))
+    best = probabilities.argmax(axis=1)
+    return model.classes_[best], probabilities[np.arange(best.shape[0]), best].astype(np.float32)
+
+def cascade_classify(texts, classify, threshold=0.9, train_size=5000, validation_share=0.2, chunk_size=100000, tracker=None):
+    '''
+    Classify a series of texts into emotions with the cascade. classify(positions, tracker) returns the emotions and scores
+    given by the sentiment model to the texts at some positions. A random sample of train_size texts is classified with it,
+    validation_share of them are held out and the linear model is trained on the rest, then it labels the texts it gives a
+    probability of at least threshold by chunks of chunk_size texts and the others are classified with classify. The score of
+    the texts labelled by the linear model is its probability. Returns the emotions as an array, their scores and the
+    statistics of the cascade: the share of texts labelled by the linear model, its agreement with the sentiment model and its
+    coverage on the held out texts, and the speedup over classifying every text with the sentiment model (estimated from the
+    seconds per text it took on the sample).
+    '''
+    start = time.perf_counter()
+    n_texts = texts.shape[0]
+    emotions = np.empty(n_texts, dtype=object)
+    scores = np.zeros(n_texts, dtype=np.float32)
+    statistics = {"threshold": threshold, "texts": n_texts, "linear_texts": 0, "linear_share": 0.0, "validation_agreement": None,
+                  "validation_coverage": None, "expected_agreement": 1.0, "speedup": 1.0}
+
+    # The cascade only pays off when most texts are not needed to train it
+    if n_texts < 2 * train_size:
+        emotions[:], scores[:] = classify(np.arange(n_texts), tracker)
+        return emotions, scores, statistics
+
+    positions = np.sort(np.random.default_rng(0).choice(n_texts, train_size, replace=False))
+    sample_start = time.perf_counter()
+    sample_emotions, scores[positions] = classify(positions, tracker)
+    seconds_per_text = (time.perf_counter() - sample_start) / train_size
+    emotions[positions] = np.asarray(sample_emotions, dtype=object)
+
+    n_validation = int(train_size * validation_share)
+    train, validation = positions[n_validation:], positions[:n_validation]
+    if len(set(emotions[train])) < 2:
+        # A single emotion can not be told apart from the rest, every text is classified with the sentiment model
+        rest = np.setdiff1d(np.arange(n_texts), positions)
+        emotions[rest], scores[rest] = classify(rest, tracker)
+        return emotions, scores, statistics
+
+    with stage("classification.cascade.training", rows=train.shape[0]):
+        model = fit_linear_classifier(texts.iloc[train].astype(str).to_list(), emotions[train].astype(str))
+        validation_emotions, validation_probabilities = linear_predictions(model, texts.iloc[validation].astype(str).to_list())
+    confident = validation_probabilities >= threshold
+    if n_validation > 0:
+        statistics["validation_coverage"] = float(confident.mean())
+    if confident.sum() > 0:
+        statistics["validation_agreement"] = float((validation_emotions[confident] == emotions[validation][confident]).mean())
+
+    # The rest of the texts are labelled by the linear model if it is confident enough, by chunks to bound the memory used
+    rest = np.setdiff1d(np.arange(n_texts), positions)
+    uncertain = []
+    with stage("classification.cascade.linear", rows=rest.shape[0]):
+        for chunk_start in range(0, rest.shape[0], chunk_size):
+            chunk = rest[chunk_start:chunk_start + chunk_size]
+            chunk_emotions, chunk_probabilities = linear_predictions(model, texts.iloc[chunk].astype(str).to_list())
+            chunk_confident = chunk_probabilities >= threshold
+            emotions[chunk[chunk_confident]] = chunk_emotions[chunk_confident]
+            scores[chunk[chunk_confident]] = chunk_probabilities[chunk_confident]
+            uncertain.append(chunk[~chunk_confident])
+            advance(tracker, int(chunk_confident.sum()))
+    uncertain = np.concatenate(uncertain) if len(uncertain) > 0 else np.array([], dtype=np.int64)
+    if uncertain.shape[0] > 0:
+        uncertain_emotions, scores[uncertain] = classify(uncertain, tracker)
+        emotions[uncertain] = np.asarray(uncertain_emotions, dtype=object)
+
+    linear_texts = rest.shape[0] - uncertain.shape[0]
+    count("cascade_linear_texts", linear_texts)
+    statistics["linear_texts"] = int(linear_texts)
+    statistics["linear_share"] = linear_texts / n_texts
+    if statistics["validation_agreement"] is not None:
+        statistics["expected_agreement"] = 1 - statistics["linear_share"] * (1 - statistics["validation_agreement"])
+    statistics["speedup"] = seconds_per_text * n_texts / (time.perf_counter() - start)
+    return emotions, scores, statistics
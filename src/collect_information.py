@@ -1,5 +1,5 @@
 '''
-File containing the function in charge of summarizing information.
+File containing the functions in charge of summarizing information.
 '''
 
 import pandas as pd
@@ -8,33 +8,71 @@ def summerize_information(review_dataframe, title, groups_to_count_reviews=[], c
     '''
     Summerize text dataframe information into a dataframe of 1 row
     '''
-    # Creating summary datframe
-    df = pd.DataFrame(index=[0])
+    # Values of the summary, the dataframe is created once all of them have been computed
+    summary = {}
 
     # Adding title and description if present
-    df["Title"] = title
-    
-    # Counting groups and adding them to the summary dataframe
-    def add_dataframe(x, df_counts, dataframe_name):
-        #print(x)
-        df[f"ammount_of_{x}"] = df_counts[df_counts["Group"] == x]["Count"].values[0]
-        
+    summary["Title"] = title
+
+    # Counting groups and adding them to the summary
     for i in groups_to_count_reviews:
-        counts_column = review_dataframe[i].value_counts().reset_index()
-        counts_column.columns = ["Group", "Count"]
-        counts_column["Group"].map(lambda y : add_dataframe(y, df_counts=counts_column, dataframe_name = "reviews"))
+        for group, count in review_dataframe[i].value_counts().items():
+            summary[f"ammount_of_{group}"] = count
 
     # Averaging the columns specified to do so
-        
+
     for i in columns_to_mean_review:
-        df[f"average_{i}"] = review_dataframe[i].mean()
+        summary[f"average_{i}"] = review_dataframe[i].mean()
 
     # Columns to sum
 
     for i in columns_to_sum_reviews:
-        df[f"count_{i}"] = review_dataframe[i].sum()
+        summary[f"count_{i}"] = review_dataframe[i].sum()
 
     # Review number is the number of rows in the review dataframe
-    df["Number of texts"] = review_dataframe.shape[0]
+    summary["Number of texts"] = review_dataframe.shape[0]
+
+    return pd.DataFrame([summary])
+
+def breakdown_keys(review_dataframe, breakdown):
+    '''
+    Get the columns to group by for a breakdown. Each element of breakdown is a column name, or a column name and a pandas
+    frequency separated by @ (e.g. "date@W") to group a date column by time buckets.
+    '''
+    keys = []
+    for column in breakdown:
+        if "@" in column:
+            date_column, frequency = column.split("@", 1)
+            dates = pd.to_datetime(review_dataframe[date_column], errors="coerce")
+            keys.append(dates.dt.to_period(frequency).dt.start_time.rename(column))
+        else:
+            keys.append(review_dataframe[column])
+    return keys
+
+def summarize_breakdowns(review_dataframe, breakdowns, columns_to_mean_review=[], columns_to_sum_reviews=[]):
+    '''
+    Count texts and compute the means and sums of the columns specified for every combination of values of each breakdown.
+    Each breakdown is a list of columns (e.g. ["emotion", "topic", "date@W"]). Returns a long format dataframe with the
+    breakdown, one column per grouping column, the metric and its value.
+    '''
+    # Aggregations computed in a single pass for every group
+    aggregations = {"count": (review_dataframe.columns[0], "size")}
+    for i in columns_to_mean_review:
+        aggregations[f"mean_{i}"] = (i, "mean")
+    for i in columns_to_sum_reviews:
+        aggregations[f"sum_{i}"] = (i, "sum")
+
+    results = []
+    for breakdown in breakdowns:
+        keys = breakdown_keys(review_dataframe, breakdown)
+        grouped = review_dataframe.groupby(keys, observed=True, sort=True, dropna=False).agg(**aggregations)
+        long_format = grouped.reset_index().melt(id_vars=list(breakdown), var_name="metric", value_name="value")
+        long_format.insert(0, "breakdown", " x ".join(breakdown))
+        results.append(long_format)
+
+    if len(results) == 0:
+        return pd.DataFrame(columns=["breakdown", "metric", "value"])
 
-    return df
\ No newline at end of file
+    # Grouping columns not used by a breakdown are left empty in its rows
+    summary = pd.concat(results, ignore_index=True)
+    return summary[["breakdown"] + [c for c in summary.columns if c not in ("breakdown", "metric", "value")] + ["metric", "value"]]
@@ -0,0 +1,91 @@
+'''
+Executors the pipeline maps partitions of the texts over, to classify them and compute their embeddings in threads, in other
+processes or in the workers of a dask cluster spread over several machines. Every backend is used through the
+concurrent.futures interface (submit and result), so the functions mapped over partitions do not depend on the backend, and
+their results are gathered in the main process in the order of the partitions and saved as in any other run.
+
+Functions mapped over partitions must be defined at the top level of a module of the pipeline so they can be sent to other
+processes, and the machines of a dask cluster need the repository and its dependencies installed.
+'''
+
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from src.progress import advance
+# dask.distributed is imported only when the dask backend is used since it is an optional dependency.
+
+executor_backends = ["thread", "process", "dask"]
+
+@contextmanager
+def open_executor(backend=None, workers=None, address=None):
+    '''
+    Start an executor of a backend: "thread" (threads of this process), "process" (processes of this machine) or "dask" (the
+    workers of the dask scheduler at address, or of a cluster of workers processes started on this machine if address is None).
+    Yields None if backend is None, so partitions are processed in this process without an executor. Workers is the number of
+    threads or processes, the default of each backend is used if it is None. The executor is shut down on exit.
+    '''
+    if backend is None:
+        yield None
+    elif backend == "thread":
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield executor
+    elif backend == "process":
+        # Processes are spawned since forking after torch has started its thread pools can deadlock.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            yield executor
+    elif backend == "dask":
+        try:
+            from distributed import Client, LocalCluster
+        except ImportError:
+            raise ImportError("The dask backend needs dask.distributed, install it with: pip install 'dask[distributed]'")
+        cluster = None
+        if address is None:
+            # Local stand-in for a cluster, one single threaded worker process per worker
+            cluster = LocalCluster(n_workers=workers, threads_per_worker=1, processes=True, dashboard_address=None)
+            client = Client(cluster)
+        else:
+            client = Client(address)
+        try:
+            yield client.get_executor()
+        finally:
+            client.close()
+            if cluster is not None:
+                cluster.close()
+    else:
+        raise Exception(f"The executor backend can only be one of: {', '.join(executor_backends)}")
+
+def shares_process(executor):
+    '''
+    Whether the tasks of an executor run in this process, so the metrics they record do not have to be gathered.
+    '''
+    return (executor is None) or isinstance(executor, ThreadPoolExecutor)
+
+def partition_bounds(n_rows, partition_size):
+    '''
+    First and last (excluded) row of each partition of n_rows rows in partitions of partition_size rows.
+    '''
+    return [(start, min(start + partition_size, n_rows)) for start in range(0, n_rows, partition_size)]
+
+def map_partitions(executor, function, partitions, *arguments, tracker=None):
+    '''
+    Call function on every partition with the same extra arguments, through executor or in this process if it is None, and
+    return the results in the order of the partitions. The progress tracker (see src.progress) is advanced by the rows of each
+    partition as its result is gathered. Partitions not started yet are cancelled if one of them fails.
+    '''
+    results = []
+    if executor is None:
+        for partition in partitions:
+            results.append(function(partition, *arguments))
+            advance(tracker, len(partition))
+        return results
+
+    futures = [executor.submit(function, partition, *arguments) for partition in partitions]
+    try:
+        for partition, future in zip(partitions, futures):
+            results.append(future.result())
+            advance(tracker, len(partition))
+        return results
+    finally:
+        for future in futures:
+            future.cancel()
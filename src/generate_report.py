@@ -3,38 +3,762 @@ File containing the function that generates the html report.
 '''
 
 import os
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.io as pio
 import plotly.graph_objects as go
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
-from nltk.corpus import stopwords
-import nltk
-import umap
-import umap.plot
 import re
+import json
+import hashlib
 
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
 import base64
 from io import BytesIO
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from src.metrics import stage, add_time, cache_access, counters_snapshot, counter_changes, merge_counters
+from src.resources import stopwords_for
+from src.term_frequencies import word_frequencies
+from src.progress import progress, advance
 
+# plotly.express, sklearn, nltk, umap, wordcloud and matplotlib take seconds to import, so they are imported inside the
+# functions that use them and importing this module (or starting LinguaLoupe.py) stays fast.
 
-def install_stopwords():
+
+def figure_to_div(fig):
     '''
-    Check if user has nltk.corpus.stopwords install and, if not, install it.
+    Convert a plotly figure into a div. Plotly.js is not included since the report loads it only once in its header.
     '''
-    try:
-        stopwords.words('english')
-    except LookupError:
-        nltk.download("stopwords")
+    return pio.to_html(fig, full_html=False, include_plotlyjs=False)
+
+def model_fingerprint(model):
+    '''
+    Hash identifying a fitted BERTopic model by its topics, topic sizes, topic embeddings and c-TF-IDF matrix. It is the same
+    for a model and the same model saved with safetensors and loaded again.
+    '''
+    fingerprint = hashlib.sha1()
+    topic_sizes = sorted((int(k), int(v)) for k, v in model.topic_sizes_.items())
+    topic_words = sorted((int(k), [(str(w), round(float(s), 6)) for w, s in v]) for k, v in model.topic_representations_.items())
+    fingerprint.update(json.dumps([topic_sizes, topic_words]).encode("utf-8"))
+    # Saved models keep topic embeddings in float32
+    if model.topic_embeddings_ is not None:
+        fingerprint.update(np.ascontiguousarray(model.topic_embeddings_, dtype=np.float32).tobytes())
+    if model.c_tf_idf_ is not None:
+        fingerprint.update(np.ascontiguousarray(model.c_tf_idf_.data, dtype=np.float32).tobytes())
+        fingerprint.update(np.ascontiguousarray(model.c_tf_idf_.indices, dtype=np.int64).tobytes())
+    return fingerprint.hexdigest()
+
+def cached_figure(visualize, name, fingerprint=None, cache_directory=None):
+    '''
+    Return the figure created by visualize. If cache_directory is given, the figure is saved in it under the fingerprint of
+    the model so later reports of the same model load it instead of computing it again.
+    '''
+    if (cache_directory is None) or (fingerprint is None):
+        return visualize()
+
+    figure_path = os.path.join(cache_directory, fingerprint, name + ".json")
+    if os.path.exists(figure_path):
+        cache_access("viz_cache", True)
+        return pio.read_json(figure_path)
+
+    cache_access("viz_cache", False)
+
+    figure = visualize()
+    os.makedirs(os.path.dirname(figure_path), exist_ok=True)
+    # Writing to a temporary file first so an interrupted run does not leave a broken figure in the cache
+    pio.write_json(figure, figure_path + ".tmp")
+    os.replace(figure_path + ".tmp", figure_path)
+    return figure
+
+def plotlyjs_script(plotly_js="embed"):
+    '''
+    Script tag loading plotly.js, either embedded in the report so it can be opened offline ("embed") or from the plotly CDN ("cdn").
+    '''
+    from plotly.offline import get_plotlyjs, get_plotlyjs_version
+
+    if plotly_js == "embed":
+        return f'<script type="text/javascript">{get_plotlyjs()}</script>'
+    if plotly_js == "cdn":
+        return f'<script src="https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js" charset="utf-8"></script>'
+    raise Exception("plotly_js can only be 'embed' or 'cdn'.")
+
+# jQuery and DataTables, used by the tables of the report, are shipped in src/assets so they can be embedded like plotly.js
+assets_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+jquery_version = "3.6.0"
+datatables_version = "1.12.1"
+
+def datatables_scripts(plotly_js="embed"):
+    '''
+    Tags loading jQuery and the DataTables script and style, embedded in the report ("embed") or from their CDNs ("cdn"),
+    the same way as plotly.js.
+    '''
+    if plotly_js == "cdn":
+        return (f'<script src="https://code.jquery.com/jquery-{jquery_version}.min.js"></script>\n'
+                f'<link rel="stylesheet" type="text/css" href="https://cdn.datatables.net/{datatables_version}/css/jquery.dataTables.min.css">\n'
+                f'<script type="text/javascript" charset="utf8" src="https://cdn.datatables.net/{datatables_version}/js/jquery.dataTables.min.js"></script>')
+    if plotly_js != "embed":
+        raise Exception("plotly_js can only be 'embed' or 'cdn'.")
+
+    def read_asset(name):
+        with open(os.path.join(assets_directory, name), encoding="utf-8") as file:
+            return file.read()
+
+    # The ES module build of DataTables exports a function adding DataTables to a jQuery, it is called on the jQuery
+    # embedded just before so the tables can use $(...).DataTable() as with the CDN scripts
+    datatables = read_asset(f"jquery.dataTables-{datatables_version}.mjs").replace("export default function ($, root) {",
+                                                                                  "(function ($, root) {", 1)
+    return (f'<script type="text/javascript">{read_asset(f"jquery-{jquery_version}.min.js")}</script>\n'
+            f'<style>{read_asset(f"jquery.dataTables-{datatables_version}.min.css")}</style>\n'
+            f'<script type="text/javascript">{datatables})(window.jQuery, window);</script>')
+
+def write_report_sections(file_path, sections):
+    '''
+    Write the report to disk section by section. Sections is an iterable of (name, html, seconds to render) tuples, if it
+    is a generator only one section is held in memory at a time. Returns the size in bytes and render time of each section.
+    '''
+    section_stats = {}
+    with open(file_path, "w+", encoding="utf-8") as file:
+        for name, html_section, seconds in sections:
+            file.write(html_section)
+            file.write("\n")
+            section_stats[name] = {"bytes": len(html_section.encode("utf-8")), "seconds": seconds}
+            print(f"Report section {name}: {section_stats[name]['bytes'] / 1e6:.2f} MB, rendered in {seconds:.1f} s")
+    return section_stats
+
+def embed_texts_umap(texts, lang="english", umap_met="cosine", neighbours_umap=15, min_dist_umap=0.1, sample_size=None,
+                     batch_size=50000, random_state=42):
+    '''
+    Project texts into 2 dimensions using UMAP over their TF-IDF representation. If sample_size is given and there are more
+    texts than that, the vectorizer and UMAP are fitted on a random sample and the remaining texts are transformed in batches.
+    '''
+    import umap
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    n_texts = len(texts)
+
+    # Small collections are embedded the same way as always, fitting on every text.
+    if (sample_size is None) or (n_texts <= sample_size):
+        tfidf_vectorizer = TfidfVectorizer(min_df=5, stop_words=list(stopwords_for(lang)))
+        tfidf_word_doc_matrix = tfidf_vectorizer.fit_transform(texts)
+        tfidf_umap = umap.UMAP(n_components=2, metric=umap_met, min_dist=min_dist_umap, n_neighbors=neighbours_umap)
+        return tfidf_umap.fit_transform(tfidf_word_doc_matrix)
+
+    # Fitting vectorizer and umap on a sample of the texts
+    rng = np.random.default_rng(random_state)
+    sample_index = np.sort(rng.choice(n_texts, size=sample_size, replace=False))
+    tfidf_vectorizer = TfidfVectorizer(min_df=5, stop_words=list(stopwords_for(lang)))
+    tfidf_sample = tfidf_vectorizer.fit_transform(texts.iloc[sample_index])
+    tfidf_umap = umap.UMAP(n_components=2, metric=umap_met, min_dist=min_dist_umap, n_neighbors=neighbours_umap)
+
+    embedding = np.empty((n_texts, 2), dtype=np.float32)
+    embedding[sample_index] = tfidf_umap.fit_transform(tfidf_sample)
+
+    # Transforming the rest of the texts in batches so the tf-idf matrix of all texts is never held in memory.
+    rest_index = np.setdiff1d(np.arange(n_texts), sample_index, assume_unique=True)
+    for start in range(0, rest_index.shape[0], batch_size):
+        batch_index = rest_index[start:start + batch_size]
+        embedding[batch_index] = tfidf_umap.transform(tfidf_vectorizer.transform(texts.iloc[batch_index]))
+
+    return embedding
+
+def generate_trends(emotion_trends, topic_trends, emotion_colours, rolling_windows=1, n_topics=10, window=None):
+    '''
+    Generate the html of the trends of the emotions and of the most frequent global topics over time, from the tables returned
+    by src.trends.trend_statistics. If rolling_windows is greater than 1 the emotion trends are shown over rolling periods of
+    that many time windows of the pandas frequency window.
+    '''
+    import plotly.express as px
+    from src.trends import rolling_trends
+
+    title_format = {'font': {'size': 24, 'family': 'Arial', 'color': 'black'}, 'x': 0.5}
+    if rolling_windows > 1:
+        emotion_trends = rolling_trends(emotion_trends, rolling_windows, window)
+    period = f" (last {rolling_windows} windows)" if rolling_windows > 1 else ""
+
+    figures = []
+    for column, label in (("texts", "Texts"), ("share", "Share of texts"), ("score_mean", "Mean score")):
+        fig = px.line(emotion_trends, x="window_start", y=column, color="emotion", color_discrete_map=emotion_colours, markers=True,
+                      labels={"window_start": "Window", column: label, "emotion": "Emotion"})
+        fig.update_layout(title={'text': f'<b>{label} per emotion{period}</b>', **title_format})
+        figures.append(figure_to_div(fig))
+
+    # Most frequent topics of the whole period, without outliers
+    topic_column = topic_trends.columns[1]
+    topic_totals = topic_trends[topic_trends[topic_column] != -1].groupby(topic_column)["texts"].sum().nlargest(n_topics)
+    top_topic_trends = topic_trends[topic_trends[topic_column].isin(topic_totals.index)].copy()
+    top_topic_trends[topic_column] = top_topic_trends[topic_column].astype(str)
+    fig = px.line(top_topic_trends, x="window_start", y="texts", color=topic_column, markers=True,
+                  category_orders={topic_column: [str(t) for t in topic_totals.index]},
+                  labels={"window_start": "Window", "texts": "Texts", topic_column: "Topic"})
+    fig.update_layout(title={'text': f'<b>Texts of the {n_topics} most frequent topics</b>', **title_format})
+    figures.append(figure_to_div(fig))
+
+    return f'''
+        <h3 id="Trends">Trends</h3>
+        <p>Number of texts, share of the texts of each window and mean score of each emotion over time.</p>
+        {"".join(figures[:3])}
+        <p>Number of texts of the most frequent global topics over time.</p>
+        {figures[3]}
+'''
+
+def generate_umap_scattergl(embedding, review_dataframe, umap_summ_color, emotion_colours, max_points=None, random_state=42):
+    '''
+    Create a single WebGL scatter plot of the umap embedding, the coordinates are stored once and a dropdown switches
+    the variable the points are coloured by. If max_points is given, at most that many points are drawn.
+    '''
+    import plotly.express as px
+
+    n_points = embedding.shape[0]
+    point_index = np.arange(n_points)
+    if (max_points is not None) and (n_points > max_points):
+        rng = np.random.default_rng(random_state)
+        point_index = np.sort(rng.choice(n_points, size=max_points, replace=False))
+
+    palette = px.colors.qualitative.Plotly
+    restyle_buttons = []
+    # Colours, colour scale and hover text of each variable, the first one is shown when the report is opened
+    views = []
+    for variable in umap_summ_color:
+        values = review_dataframe[variable].iloc[point_index]
+        # Numeric columns are coloured with a continuous scale, any other column is treated as categorical.
+        if pd.api.types.is_numeric_dtype(values) and variable != "emotion":
+            marker_colours = values.to_numpy(dtype=np.float32)
+            show_scale = True
+        else:
+            values = values.astype(str)
+            categories = pd.unique(values)
+            colour_map = {c: emotion_colours.get(c, palette[i % len(palette)]) for i, c in enumerate(categories)}
+            marker_colours = values.map(colour_map).to_numpy()
+            show_scale = False
+        views.append((marker_colours, show_scale, values.astype(str).to_numpy()))
+        # Plotly.restyle takes a list with the values of each trace
+        restyle_buttons.append(dict(label=variable, method="restyle",
+                                    args=[{"marker.color": [marker_colours], "marker.showscale": show_scale,
+                                           "text": [views[-1][2]]}]))
+
+    umap_fig = go.Figure(go.Scattergl(x=embedding[point_index, 0].astype(np.float32), y=embedding[point_index, 1].astype(np.float32),
+                                      mode="markers", marker=dict(size=4, colorscale="Viridis"), hoverinfo="text"))
+    # Starting with the colours of the first variable
+    umap_fig.update_traces(marker_color=views[0][0], marker_showscale=views[0][1], text=views[0][2])
+    umap_fig.update_layout(title={
+        'text': '<b>UMAP</b>',
+        'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
+        'x': 0.5,  # Centered title
+    }, updatemenus=[dict(buttons=restyle_buttons, direction="down", x=0, xanchor="left", y=1.15, yanchor="top")])
+
+    if point_index.shape[0] < n_points:
+        umap_fig.add_annotation(text=f"Showing {point_index.shape[0]} of {n_points} texts", showarrow=False,
+                                xref="paper", yref="paper", x=1, y=1.1)
+    return umap_fig
+
+# Javascript used by sharded tables to load only the shards needed for the page being displayed. Each shard is a script
+# calling LinguaLoupeShard, this way shards can be loaded when the report is opened as a local file.
+sharded_tables_script = '''
+const llTables = {};
+const llPending = {};
+function LinguaLoupeShard(name, part, rows){
+    const key = name + "/" + part;
+    if (llPending[key]){
+        llPending[key](rows);
+    }
+}
+function llLoadShard(table, part){
+    const key = table.name + "/" + part;
+    if (table.cache.has(key)){
+        // Refreshing the position of the shard in the cache
+        const rows = table.cache.get(key);
+        table.cache.delete(key);
+        table.cache.set(key, rows);
+        return Promise.resolve(rows);
+    }
+    return new Promise(function(resolve, reject){
+        const script = document.createElement("script");
+        llPending[key] = function(rows){
+            delete llPending[key];
+            script.remove();
+            table.cache.set(key, rows);
+            // Only the most recently used shards are kept in memory
+            if (table.cache.size > 4){
+                table.cache.delete(table.cache.keys().next().value);
+            }
+            resolve(rows);
+        };
+        script.onerror = function(){
+            delete llPending[key];
+            reject(new Error("Could not load " + table.files[part]));
+        };
+        script.src = table.files[part];
+        document.head.appendChild(script);
+    });
+}
+async function llFetchRows(table, data){
+    let start = 0;
+    let end = table.n_rows;
+    if ((table.topic != "All") && (table.topic in table.ranges)){
+        [start, end] = table.ranges[table.topic];
+    }
+    const length = (data.length < 0) ? end - start : data.length;
+    const search = data.search.value.toLowerCase();
+    let rows = [];
+    if (search == ""){
+        // Without a search only the shards overlapping the requested page are loaded
+        const from = start + data.start;
+        const to = Math.min(end, from + length);
+        for (let part = Math.floor(from / table.shard_size); (from < to) && (part * table.shard_size < to); part++){
+            const offset = part * table.shard_size;
+            const shard = await llLoadShard(table, part);
+            rows = rows.concat(shard.slice(Math.max(from - offset, 0), to - offset));
+        }
+        return {recordsFiltered: end - start, data: rows};
+    }
+    // When searching, shards are scanned one at a time and only the rows of the requested page are kept
+    let matches = 0;
+    for (let part = Math.floor(start / table.shard_size); part * table.shard_size < end; part++){
+        const offset = part * table.shard_size;
+        const shard = await llLoadShard(table, part);
+        for (let i = Math.max(start - offset, 0); (i < shard.length) && (offset + i < end); i++){
+            if (shard[i].some(function(v){ return String(v).toLowerCase().includes(search); })){
+                if ((matches >= data.start) && (rows.length < length)){
+                    rows.push(shard[i]);
+                }
+                matches++;
+            }
+        }
+    }
+    return {recordsFiltered: matches, data: rows};
+}
+function llShardedTable(table_id, table){
+    table.cache = new Map();
+    table.topic = "All";
+    llTables[table_id] = table;
+    return $("#" + table_id).DataTable({
+        serverSide: true,
+        ordering: false,
+        searchDelay: 500,
+        pageLength: 5,
+        lengthMenu: [5, 10, 15, 20, 25, 30, 35, 40, 45, 50],
+        columns: table.columns.map(function(c){ return {title: c, render: $.fn.dataTable.render.text()}; }),
+        ajax: function(data, callback, settings){
+            llFetchRows(table, data).then(function(result){
+                callback({draw: data.draw, recordsTotal: table.n_rows, recordsFiltered: result.recordsFiltered, data: result.data});
+            });
+        }
+    });
+}
+function llFilterTopic(table_id, topic){
+    llTables[table_id].topic = topic;
+    $("#" + table_id).DataTable().draw();
+}
+'''
+
+def write_table_shards(df, path, name, shard_size=5000, topic_column=None):
+    '''
+    Write the rows of a dataframe into shards of shard_size rows in path/report_data/name, the report loads each shard only
+    when it is displayed. If topic_column is given, rows are sorted by it so each topic is a contiguous range of rows.
+    Returns the index of the table.
+    '''
+    table_directory = os.path.join(path, "report_data", name)
+    os.makedirs(table_directory, exist_ok=True)
+
+    if topic_column is not None:
+        df = df.sort_values(topic_column, kind="stable")
+
+    files = []
+    for part, start in enumerate(range(0, df.shape[0], shard_size)):
+        rows = df.iloc[start:start + shard_size].to_json(orient="values", date_format="iso", default_handler=str)
+        file_name = f"part-{part:05d}.js"
+        with open(os.path.join(table_directory, file_name), "w+", encoding="utf-8") as file:
+            file.write(f"LinguaLoupeShard({json.dumps(name)}, {part}, {rows});\n")
+        files.append(f"report_data/{name}/{file_name}")
+
+    # Row range of each topic
+    ranges = {}
+    if topic_column is not None:
+        topics, first_rows, counts = np.unique(df[topic_column].astype(str).to_numpy(), return_index=True, return_counts=True)
+        ranges = {t: [int(f), int(f + c)] for t, f, c in zip(topics, first_rows, counts)}
+
+    return {"name": name, "columns": [str(c) for c in df.columns], "n_rows": int(df.shape[0]),
+            "shard_size": shard_size, "files": files, "ranges": ranges}
+
+def generate_sharded_table(df, path, name, topics=None, topic_column="topic", shard_size=5000):
+    '''
+    Write a sharded table and return the html with the table and a dropdown to filter it by topic.
+    '''
+    table_index = write_table_shards(df, path, name, shard_size=shard_size, topic_column=topic_column if topics is not None else None)
+    table_id = "table_" + re.sub(r"\W", "_", name)
+
+    dropdown_topic_menu = ""
+    if topics is not None:
+        dropdown_topic_menu = f'<label for="topics_filter_{table_id}">Topics:</label> <select id="topics_filter_{table_id}" onchange="llFilterTopic(\'{table_id}\', this.value)"><option value="All">All</option>'
+        for t in topics:
+            dropdown_topic_menu += f'<option value="{t}">{t}</option>'
+        dropdown_topic_menu += "</select>"
+
+    # Escaping closing tags so a text can not close the script
+    table_index_json = json.dumps(table_index).replace("</", "<\\/")
+    return f'''
+            {dropdown_topic_menu}
+            <table id="{table_id}" class="display" style="width: 100%;"></table>
+            <script>
+            $(document).ready(function () {{ llShardedTable("{table_id}", {table_index_json}); }});
+            </script>
+'''
+
+# Colours of each emotion
+
+emotion_colours = {
+    "POSITIVE": "#639754",
+    "NEUTRAL": "#BDBABB",
+    "NEGATIVE": "#D61F1F",
+    "NEGATIVE-POSITIVE": "#FFD301",
+    "NEGATIVE-NEUTRAL": "#8B0000",
+    "NEUTRAL-POSITIVE": "#8B9A8B"
+}
+
+def generate_overview(review_texts, Global_topic_Model, lang="english", viz_cache=None):
+    '''
+    Generate the html of the global topics overview: word cloud, topic counts and BERTopic visualizations.
+    '''
+    import plotly.express as px
+    import matplotlib.pyplot as plt
+    from wordcloud import WordCloud
+
+    # Create a Word Cloud of all texts from the frequencies of their words (without urls), counted by chunks of texts
+    with stage("report.word_frequencies", rows=len(review_texts)):
+        frequencies = word_frequencies(review_texts, stopwords=stopwords_for(lang))
+    wordcloud = WordCloud(background_color="white").generate_from_frequencies(frequencies)
+    
+    fig, ax = plt.subplots(figsize = (15, 8))
+    ax.imshow(wordcloud, interpolation='bilinear')
+    ax.axis("off")
+
+    tmpfile = BytesIO()
+    fig.savefig(tmpfile, format='png')
+    plt.close(fig)
+    html_str_wordcloud = base64.b64encode(tmpfile.getvalue()).decode('utf-8')
+
+    # UMAP
+    if Global_topic_Model[1].shape[0] < 2:
+        return f"<div><p>Could not find global topics.</p></div>"
+    
+    model = Global_topic_Model[0]
+    # BERTopic visualizations are reused from viz_cache when the same model was already reported
+    fingerprint = model_fingerprint(model) if viz_cache is not None else None
+
+    if Global_topic_Model[1].shape[0] < 2:
+        umap_div = '<p style="color: red;">Not enougth topics to generate UMAP.</p>'
+        hierarchical_div = '<p style="color: red;">Not enougth topics to perform hierarchical clustering.</p>'
+    else:
+        try:
+            umap_em = cached_figure(model.visualize_topics, "topics", fingerprint, viz_cache)
+            umap_div = figure_to_div(umap_em)
+        except Exception as e:
+            umap_div = f'<p style="color: red;">Umap could not be generated: {e}.</p>'
+        hierarchical_em = cached_figure(model.visualize_hierarchy, "hierarchy", fingerprint, viz_cache)
+        hierarchical_div = figure_to_div(hierarchical_em)
+    # Heatmap
+    heatmap_em = cached_figure(model.visualize_heatmap, "heatmap", fingerprint, viz_cache)
+    heatmap_div = figure_to_div(heatmap_em)
+    # Barchart of words
+    barplot_em = cached_figure(lambda: model.visualize_barchart(top_n_topics=len(model.get_topics())), "barchart", fingerprint, viz_cache)
+    barplot_em.update_layout(title={
+        'text': '<b>Topic Word Scores</b>',
+        'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
+        'x': 0.5,  # Centered title
+    })
+    #barplot_em.update_traces(marker_color=emotion_colours[em])
+    barplot_div = figure_to_div(barplot_em)
+
+    # topic frequencies
+    topics_freqs_dataframe = Global_topic_Model[1]
+    topics_freqs_dataframe["Topic"] = topics_freqs_dataframe["Topic"].astype(str)
+    topic_counts_barplot = px.bar(topics_freqs_dataframe, x="Topic", y="Count", title="Topic Counts")
+    topic_counts_barplot.update_layout(title={
+        'text': '<b>Topic Counts</b>',
+        'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
+        'x': 0.5,  # Centered title
+    }, showlegend=False)
+    #topic_counts_barplot.update_traces(marker_color=emotion_colours[em])
+    barplot_topics_freq_div = figure_to_div(topic_counts_barplot)  
+
+    res = f'''
+    <h3 id="Wordcloud">Word cloud</h3>
+    <p>Most frequent words across all reviews</p>
+    <img src='data:image/png;base64,{html_str_wordcloud}'>
+    <h4 id="TopicFreqs">Global Topic Counts</h4>
+    <p>Barplot displaying how many times a topic appears.</p>
+    {barplot_topics_freq_div}
+    <h4 id="Intertopic">Intertopic distance map</h4>
+    <p>A Umap visualization generated in a way very similar to <a href="https://github.com/cpsievert/LDAvis">LDAvis</a>.</p>
+    {umap_div}
+    <h4 id="Hclust">Hierarchcial clustering</h4>
+    <p>A graph displaying the potential hierarchy of topics.</p>
+    {hierarchical_div}
+    <h4 id="WordScore">Topic Word Score</h4>
+    <p>c-TF-IDF scores of each topic, you can visualize the most meaningfull words for each of the topics.</p>
+    <button id="but_id_topics_show" onclick="HideButton(this.value, this.id)" value="topics_barplots_tf">Show Topics</button>
+    <div id="topics_barplots_tf" style="display: none;">
+        {barplot_div}
+    </div>
+    <h4 id="Sim">Similarity Matrix</h4>
+    <p>A heatmap showing how similar the topics are between them.</p>
+    {heatmap_div}
+    '''
+    return res
+
+def generate_html_for_emotion(em, em_df, topic_model_results, lang="english", path="", table_mode="inline", table_shard_size=5000,
+                              viz_cache=None):
+    '''
+    Generate the html section of an emotion, em_df contains the texts classified as em and topic_model_results the
+    BERTopic model and topic frequencies of those texts.
+    '''
+    import plotly.express as px
+    import matplotlib.pyplot as plt
+    from sklearn.feature_extraction.text import CountVectorizer
+    from wordcloud import WordCloud
+
+    # Create a Word Cloud of all texts associated with that emotion from the frequencies of their words, counted by chunks of texts
+    with stage("report.word_frequencies", rows=em_df.shape[0]):
+        frequencies = word_frequencies(em_df["text"], stopwords=stopwords_for(lang))
+    wordcloud = WordCloud(background_color="white").generate_from_frequencies(frequencies)
+    
+    fig, ax = plt.subplots(figsize = (15, 8))
+    ax.imshow(wordcloud, interpolation='bilinear')
+    ax.axis("off")
+
+    tmpfile = BytesIO()
+    fig.savefig(tmpfile, format='png')
+    plt.close(fig)
+    html_str_wordcloud = base64.b64encode(tmpfile.getvalue()).decode('utf-8')
+
+    #html_str_wordcloud = mpld3.fig_to_html(fig)
+
+    # Trigrams
+    cv = CountVectorizer(ngram_range=(3, 3), max_features=5000, min_df=5)
+    bigrams = cv.fit_transform(em_df["text"])
+    count_values = bigrams.toarray().sum(axis=0)
+    ngram_freq = pd.DataFrame(sorted([(count_values[i], k) for k, i in cv.vocabulary_.items()], reverse = True))
+    ngram_freq.columns = ["Count", "Trigram"]
+    barplot_trigrams = px.bar(ngram_freq.head(10),x="Count", y="Trigram",
+                              category_orders={"Trigram": ngram_freq["Trigram"].to_list()},
+                              title="Top 10 Trigrams")
+    barplot_trigrams.update_layout(title={
+        'text': '<b>Top 10 Trigrams</b>',
+        'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
+        'x': 0.5,  # Centered title
+    }, showlegend=False)
+    barplot_trigrams.update_traces(marker_color=emotion_colours[em])
+    bigram_plot_div = figure_to_div(barplot_trigrams)
+
+
+    if topic_model_results[1].shape[0] < 2:
+        return f"<div><p>Could not find topics for {em}</p></div>"
+    
+    model = topic_model_results[0]
+    # BERTopic visualizations are reused from viz_cache when the same model was already reported
+    fingerprint = model_fingerprint(model) if viz_cache is not None else None
+    # UMAP
+    if topic_model_results[1].shape[0] < 2:
+        umap_div = '<p style="color: red;">Not enougth topics to generate UMAP.</p>'
+        hierarchical_div = '<p style="color: red;">Not enougth topics to perform hierarchical clustering.</p>'
+    else:
+        try:
+            umap_em = cached_figure(model.visualize_topics, "topics", fingerprint, viz_cache)
+            umap_div = figure_to_div(umap_em)
+        except Exception as e:
+            umap_div = f'<p style="color: red;">Umap could not be generated: {e}.</p>'
+        hierarchical_em = cached_figure(model.visualize_hierarchy, "hierarchy", fingerprint, viz_cache)
+        hierarchical_div = figure_to_div(hierarchical_em)
+    # Heatmap
+    heatmap_em = cached_figure(model.visualize_heatmap, "heatmap", fingerprint, viz_cache)
+    heatmap_div = figure_to_div(heatmap_em)
+    # Barchart of words
+    barplot_em = cached_figure(lambda: model.visualize_barchart(top_n_topics=len(model.get_topics())), "barchart", fingerprint, viz_cache)
+    barplot_em.update_layout(title={
+        'text': '<b>Topic Word Scores</b>',
+        'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
+        'x': 0.5,  # Centered title
+    })
+    barplot_em.update_traces(marker_color=emotion_colours[em])
+    barplot_div = figure_to_div(barplot_em)
+    # Global topic frequencies
+    
+    # global_probability_topic
+    
+    global_topics_freqs_dataframe = (
+        em_df[em_df["global_topic"] > 0]["global_topic"].value_counts().reset_index()
+    )
+
+    global_topics_freqs_dataframe.columns = ["global_topic", "count"]
+
+    global_topics_freqs_dataframe["Global Topic"] = global_topics_freqs_dataframe["global_topic"].astype(str)
+
+    global_topic_counts_barplot = px.bar(
+        global_topics_freqs_dataframe,
+        x="Global Topic",
+        y="count",
+        title="Global Topic Counts"
+    )
+
+    #global_topics_freqs_dataframe["Topic"] = topics_freqs_dataframe["Topic"].astype(str)
+    #global_topic_counts_barplot = px.bar(global_topics_freqs_dataframe, x="global_topics_freqs_dataframe", y="count", title="Topic Counts")
+    global_topic_counts_barplot.update_layout(title={
+        'text': '<b>Global Topic Counts</b>',
+        'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
+        'x': 0.5,  # Centered title
+    }, showlegend=False)
+
+    global_topic_counts_barplot.update_traces(marker_color=emotion_colours[em])
+    global_barplot_topics_freq_div = figure_to_div(global_topic_counts_barplot)
+    
+    
+    # topic frequencies
+    topics_freqs_dataframe = topic_model_results[1]
+    topics_freqs_dataframe["Topic"] = topics_freqs_dataframe["Topic"].astype(str)
+    topic_counts_barplot = px.bar(topics_freqs_dataframe, x="Topic", y="Count", title="Topic Counts")
+    topic_counts_barplot.update_layout(title={
+        'text': '<b>Topic Counts</b>',
+        'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
+        'x': 0.5,  # Centered title
+    }, showlegend=False)
+    topic_counts_barplot.update_traces(marker_color=emotion_colours[em])
+    barplot_topics_freq_div = figure_to_div(topic_counts_barplot)
+    if table_mode == "sharded":
+        # Texts are written to shards next to the report and loaded page by page.
+        table_section = generate_sharded_table(em_df, path, em, topics=topics_freqs_dataframe["Topic"], shard_size=table_shard_size)
+    else:
+        # Making an interacteable table to show the diferent text included in the review
+        table_emotion = em_df.to_html(index=False, classes="display", table_id=f"table_{em}")
+        # Position of the topic column, tables loaded from saved results may have their columns in another order
+        topic_column = list(em_df.columns).index("topic")
+        # Creating dropdown to filter table by topic
+        dropdown_topic_menu = f'<label for="topics_filter_{em}">Topics:</label> <select name="topics_filter_{em}" id="topics_filter_{em}" onchange="Filter_Topic_{em}()"><option value="All">All</option>'
+        for t in topics_freqs_dataframe["Topic"]:
+            dropdown_topic_menu += f'<option value="{t}">{t}</option>'
+        dropdown_topic_menu += "</select>"
+        # javascript for the emotion
+        style_sel_input = '''
+{
+          language: {
+                lengthMenu:
+                    'Display <select style="background-color: white; color: black; border-color: #2A4B7C; border-style: solid; border-width: medium; font-family: sans-serif; margin-bottom: 1%;">' +
+                    '<option value="5">5</option>' +
+                    '<option value="10">10</option>' +
+                    '<option value="15">15</option>' +
+                    '<option value="20">20</option>' +
+                    '<option value="25">25</option>' +
+                    '<option value="30">30</option>' +
+                    '<option value="35">35</option>' +
+                    '<option value="40">40</option>' +
+                    '<option value="45">45</option>' +
+                    '<option value="50">50</option>' +
+                    '</select> records'
+            },
+        pageLength : 5
+        }
+'''
+        jav_script = "$(document).ready( function () {"
+        jav_script += f"table{em} = $('#table_{em}')"
+        jav_script += f".DataTable({style_sel_input});"
+        jav_script += "});"
+        # Function to filter table entries by topic
+        fun_filter = "{"
+        fun_filter += f'let f = document.getElementById("topics_filter_{em}").value;'
+        fun_filter += "if (f == 'All'){"
+        fun_filter += f"table{em}"
+        fun_filter += f'.column({topic_column}).search("", true, false).draw();'
+        fun_filter += '}else{'
+        fun_filter += f"table{em}"
+        fun_filter += f'.column({topic_column})' + '.search(`^${f}` + "$", true, false).draw();}}'
+        table_section = f'''
+        {dropdown_topic_menu}
+        {table_emotion}
+        <script>
+        let table{em};
+        {jav_script}
+        function Filter_Topic_{em}(){fun_filter}
+        </script>
+'''
+    # resulting div
+    res = f'''
+    <div>
+        <h3 id="Semtinment{em}">{em}</h3>
+        <h4>Word Cloud</h4>
+        <p>Word Cloud of all text associated with this emotion.</p>
+        <img src='data:image/png;base64,{html_str_wordcloud}'>
+        <h4>Top 10 most frequent Trigrams</h4>
+        {bigram_plot_div}
+        <h4 id="TopicFreqsGlobal{em}">Global Topic Counts {em}</h4>
+        <p>Barplot displaying how many times a global topic appears for this emmotion.</p>
+        {global_barplot_topics_freq_div}
+        <h4 id="TopicFreqs{em}">Topic Counts {em}</h4>
+        <p>Barplot displaying how many times a topic appears for this emotion in a topic classification of only {em} texts.</p>
+        {barplot_topics_freq_div}
+        <h4 id="Intertopic{em}">Intertopic distance map</h4>
+        <p>A Umap visualization generated in a way very similar to <a href="https://github.com/cpsievert/LDAvis">LDAvis</a>.</p>
+        {umap_div}
+        <h4 id="Hclust{em}">Hierarchcial clustering</h4>
+        <p>A graph displaying the potential hierarchy of topics.</p>
+        {hierarchical_div}
+        <h4 id="WordScore{em}">Topic Word Score</h4>
+        <p>c-TF-IDF scores of each topic, you can visualize the most meaningfull words for each of the topics.</p>
+        <button id="{em}_positive_but_id_topics_show" onclick="HideButton(this.value, this.id)" value="{em}_topics_barplots_tf">Show Topics</button>
+        <div id="{em}_topics_barplots_tf" style="display: none;">
+            {barplot_div}
+        </div>
+        <h4 id="Sim{em}">Similarity Matrix</h4>
+        <p>A heatmap showing how similar the topics are between them.</p>
+        {heatmap_div}
+        <h4 id="table{em}">{em} texts</h4>
+        <p>The texts that were considered to belong to: {em}</p>
+        {table_section}
+    </div>
+    '''
+    return res
 
+def render_section(section_function, *arguments):
+    '''
+    Call a function generating a section of the report and return its html together with the seconds it took and the
+    counters (like cache hits) that changed, so they can be collected when the section is rendered in another process.
+    '''
+    counters = counters_snapshot()
+    start = time.perf_counter()
+    html_section = section_function(*arguments)
+    return html_section, time.perf_counter() - start, counter_changes(counters)
 
 def generate_report(title, review_dataframe, topic_models, Global_topic_Model,lang="english", path = "", umap_summ_color = ["emotion"],
-                    umap_met="cosine", neighbours_umap = 15, min_dist_umap = 0.1):
+                    umap_met="cosine", neighbours_umap = 15, min_dist_umap = 0.1, scalable_umap = False,
+                    umap_sample_size = 50000, umap_max_points = 100000, plotly_js = "embed",
+                    table_mode = "inline", table_shard_size = 5000, report_workers = 1, viz_cache = None, trends = None,
+                    rolling_windows = 1, trend_window = None, emotion_positions = None):
     '''
-    Generate html report for an exploratory sentiment and topic analysis.
+    Generate html report for an exploratory sentiment and topic analysis. If trends (the emotion and topic trends returned by
+    src.trends.trend_statistics with the time window trend_window) are given, their charts are added to the summary.
+    emotion_positions are the positions of the texts of each emotion in review_dataframe, as returned by
+    src.get_topics.review_topics; they are found in a single pass over the emotions if not given.
     '''
+    import plotly.express as px
+
+    if emotion_positions is None:
+        emotion_positions = review_dataframe.groupby("emotion", observed=True, sort=False).indices
+
+    # Arguments of the functions generating the overview and the section of each emotion.
+    def section_arguments():
+        yield "overview", generate_overview, (review_dataframe["text"], Global_topic_Model, lang, viz_cache)
+        for k in topic_models.keys():
+            yield k, generate_html_for_emotion, (k, review_dataframe.iloc[emotion_positions[k]], topic_models[k],
+                                                  lang, path, table_mode, table_shard_size, viz_cache)
+
+    # If more than one worker is used, sections are rendered in other processes while the summary is generated here.
+    executor = None
+    rendered_sections = []
+    if report_workers > 1:
+        # Processes are spawned since forking after torch and numba have started their thread pools can deadlock.
+        executor = ProcessPoolExecutor(max_workers=report_workers, mp_context=multiprocessing.get_context("spawn"))
+        rendered_sections = [(name, executor.submit(render_section, function, *arguments))
+                             for name, function, arguments in section_arguments()]
+
+    summary_start = time.perf_counter()
 
     # CSS
     css_template = '''
@@ -200,14 +924,11 @@ button:hover{
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <!-- Include jQuery (required by DataTables) -->
-    <script src="https://code.jquery.com/jquery-3.6.0.min.js"></script>
-
-    <!-- Include DataTables CSS (for styling the table) -->
-    <link rel="stylesheet" type="text/css" href="https://cdn.datatables.net/1.11.5/css/jquery.dataTables.css">
+    <!-- Include jQuery (required by DataTables), DataTables CSS (for styling the table) and DataTables JS -->
+    {datatables_scripts(plotly_js)}
 
-    <!-- Include DataTables JS -->
-    <script type="text/javascript" charset="utf8" src="https://cdn.datatables.net/1.11.5/js/jquery.dataTables.js"></script>
+    <!-- Include plotly.js once for all figures -->
+    {plotlyjs_script(plotly_js)}
     <title>LinguaLoupe: {title}</title>
     <style>
     {css_template}
@@ -217,6 +938,7 @@ button:hover{
         {onLoad_html}
         function HideButton(id_element, id_but){hide_button_function}
         function DisplayRightUmap(id_element){display_umap_function}
+        {sharded_tables_script if table_mode == "sharded" else ""}
     </script>
 </head>
 <body>
@@ -226,6 +948,7 @@ button:hover{
       <hr>
       <label style="font-weight: bold;">Go to:</label>
       <li><a href="#Summary">Summary</a></li>
+      {'<li><a href="#Trends">Trends</a></li>' if trends is not None else ""}
       {list_index_emotions}
     </ul>
     <div class="navBarBack">
@@ -235,317 +958,24 @@ button:hover{
         <h1>{title}</h1>
 '''
 
-    # Colours of each emotion
-
-    emotion_colours = {
-        "POSITIVE": "#639754",
-        "NEUTRAL": "#BDBABB",
-        "NEGATIVE": "#D61F1F",
-        "NEGATIVE-POSITIVE": "#FFD301",
-        "NEGATIVE-NEUTRAL": "#8B0000",
-        "NEUTRAL-POSITIVE": "#8B9A8B"
-    }
-
-    def generate_overview():
-        # Create a Word Cloud of all texts associated with that emotion, regex removes urls
-        all_texts_single_string = " ".join(re.sub(r"http\S+|www\.\S+", "", review) for review in review_dataframe["text"])
-        stopwords_word_cloud = stopwords.words(lang)
-        wordcloud = WordCloud(stopwords=stopwords_word_cloud, background_color="white").generate(all_texts_single_string)
-        
-        fig, ax = plt.subplots(figsize = (15, 8))
-        ax.imshow(wordcloud, interpolation='bilinear')
-        ax.axis("off")
-
-        tmpfile = BytesIO()
-        fig.savefig(tmpfile, format='png')
-        html_str_wordcloud = base64.b64encode(tmpfile.getvalue()).decode('utf-8')
-
-        # UMAP
-        if Global_topic_Model[1].shape[0] < 2:
-            return f"<div><p>Could not find global topics.</p></div>"
-        
-        model = Global_topic_Model[0]
-
-        if Global_topic_Model[1].shape[0] < 2:
-            umap_div = '<p style="color: red;">Not enougth topics to generate UMAP.</p>'
-            hierarchical_div = '<p style="color: red;">Not enougth topics to perform hierarchical clustering.</p>'
-        else:
-            try:
-                umap_em = model.visualize_topics()
-                umap_div = pio.to_html(umap_em, full_html=False, include_plotlyjs="cdn")
-            except Exception as e:
-                umap_div = f'<p style="color: red;">Umap could not be generated: {e}.</p>'
-            hierarchical_em = model.visualize_hierarchy()
-            hierarchical_div = pio.to_html(hierarchical_em, full_html=False, include_plotlyjs="cdn")
-        # Heatmap
-        heatmap_em = model.visualize_heatmap()
-        heatmap_div = pio.to_html(heatmap_em, full_html=False, include_plotlyjs="cdn")
-        # Barchart of words
-        barplot_em = model.visualize_barchart(top_n_topics=len(model.get_topics()))
-        barplot_em.update_layout(title={
-            'text': '<b>Topic Word Scores</b>',
-            'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
-            'x': 0.5,  # Centered title
-        })
-        #barplot_em.update_traces(marker_color=emotion_colours[em])
-        barplot_div = pio.to_html(barplot_em, full_html=False, include_plotlyjs="cdn")
-
-        # topic frequencies
-        topics_freqs_dataframe = Global_topic_Model[1]
-        topics_freqs_dataframe["Topic"] = topics_freqs_dataframe["Topic"].astype(str)
-        topic_counts_barplot = px.bar(topics_freqs_dataframe, x="Topic", y="Count", title="Topic Counts")
-        topic_counts_barplot.update_layout(title={
-            'text': '<b>Topic Counts</b>',
-            'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
-            'x': 0.5,  # Centered title
-        }, showlegend=False)
-        #topic_counts_barplot.update_traces(marker_color=emotion_colours[em])
-        barplot_topics_freq_div = pio.to_html(topic_counts_barplot, full_html=False, include_plotlyjs="cdn")  
-
-        res = f'''
-        <h3 id="Wordcloud">Word cloud</h3>
-        <p>Most frequent words across all reviews</p>
-        <img src='data:image/png;base64,{html_str_wordcloud}'>
-        <h4 id="TopicFreqs">Global Topic Counts</h4>
-        <p>Barplot displaying how many times a topic appears.</p>
-        {barplot_topics_freq_div}
-        <h4 id="Intertopic">Intertopic distance map</h4>
-        <p>A Umap visualization generated in a way very similar to <a href="https://github.com/cpsievert/LDAvis">LDAvis</a>.</p>
-        {umap_div}
-        <h4 id="Hclust">Hierarchcial clustering</h4>
-        <p>A graph displaying the potential hierarchy of topics.</p>
-        {hierarchical_div}
-        <h4 id="WordScore">Topic Word Score</h4>
-        <p>c-TF-IDF scores of each topic, you can visualize the most meaningfull words for each of the topics.</p>
-        <button id="but_id_topics_show" onclick="HideButton(this.value, this.id)" value="topics_barplots_tf">Show Topics</button>
-        <div id="topics_barplots_tf" style="display: none;">
-            {barplot_div}
-        </div>
-        <h4 id="Sim">Similarity Matrix</h4>
-        <p>A heatmap showing how similar the topics are between them.</p>
-        {heatmap_div}
-        '''
-        return res
-
-    def generate_html_for_emotion(em):
-        # Dataframe emotions
-        em_df = review_dataframe[review_dataframe["emotion"] == em]
-
-        # Create a Word Cloud of all texts associated with that emotion
-        all_texts_single_string = " ".join(re.sub(r"http\S+|www\.\S+", "", review) for review in em_df["text"])
-        stopwords_word_cloud = stopwords.words(lang)
-        wordcloud = WordCloud(stopwords=stopwords_word_cloud, background_color="white").generate(all_texts_single_string)
-        
-        fig, ax = plt.subplots(figsize = (15, 8))
-        ax.imshow(wordcloud, interpolation='bilinear')
-        ax.axis("off")
-
-        tmpfile = BytesIO()
-        fig.savefig(tmpfile, format='png')
-        html_str_wordcloud = base64.b64encode(tmpfile.getvalue()).decode('utf-8')
-
-        #html_str_wordcloud = mpld3.fig_to_html(fig)
-
-        # Trigrams
-        cv = CountVectorizer(ngram_range=(3, 3), max_features=5000, min_df=5)
-        bigrams = cv.fit_transform(em_df["text"])
-        count_values = bigrams.toarray().sum(axis=0)
-        ngram_freq = pd.DataFrame(sorted([(count_values[i], k) for k, i in cv.vocabulary_.items()], reverse = True))
-        ngram_freq.columns = ["Count", "Trigram"]
-        barplot_trigrams = px.bar(ngram_freq.head(10),x="Count", y="Trigram",
-                                  category_orders={"Trigram": ngram_freq["Trigram"].to_list()},
-                                  title="Top 10 Trigrams")
-        barplot_trigrams.update_layout(title={
-            'text': '<b>Top 10 Trigrams</b>',
-            'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
-            'x': 0.5,  # Centered title
-        }, showlegend=False)
-        barplot_trigrams.update_traces(marker_color=emotion_colours[em])
-        bigram_plot_div = pio.to_html(barplot_trigrams,
-                                      full_html=False, include_plotlyjs="cdn")
-
-
-        if topic_models[em][1].shape[0] < 2:
-            return f"<div><p>Could not find topics for {em}</p></div>"
-        
-        model = topic_models[em][0]
-        # UMAP
-        if topic_models[em][1].shape[0] < 2:
-            umap_div = '<p style="color: red;">Not enougth topics to generate UMAP.</p>'
-            hierarchical_div = '<p style="color: red;">Not enougth topics to perform hierarchical clustering.</p>'
-        else:
-            try:
-                umap_em = model.visualize_topics()
-                umap_div = pio.to_html(umap_em, full_html=False, include_plotlyjs="cdn")
-            except Exception as e:
-                umap_div = f'<p style="color: red;">Umap could not be generated: {e}.</p>'
-            hierarchical_em = model.visualize_hierarchy()
-            hierarchical_div = pio.to_html(hierarchical_em, full_html=False, include_plotlyjs="cdn")
-        # Heatmap
-        heatmap_em = model.visualize_heatmap()
-        heatmap_div = pio.to_html(heatmap_em, full_html=False, include_plotlyjs="cdn")
-        # Barchart of words
-        barplot_em = model.visualize_barchart(top_n_topics=len(model.get_topics()))
-        barplot_em.update_layout(title={
-            'text': '<b>Topic Word Scores</b>',
-            'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
-            'x': 0.5,  # Centered title
-        })
-        barplot_em.update_traces(marker_color=emotion_colours[em])
-        barplot_div = pio.to_html(barplot_em, full_html=False, include_plotlyjs="cdn")
-        # Global topic frequencies
-        
-        # global_probability_topic
-        
-        global_topics_freqs_dataframe = (
-            em_df[em_df["global_topic"] > 0]["global_topic"].value_counts().reset_index()
-        )
-
-        global_topics_freqs_dataframe.columns = ["global_topic", "count"]
-
-        global_topics_freqs_dataframe["Global Topic"] = global_topics_freqs_dataframe["global_topic"].astype(str)
-
-        global_topic_counts_barplot = px.bar(
-            global_topics_freqs_dataframe,
-            x="Global Topic",
-            y="count",
-            title="Global Topic Counts"
-        )
-
-        #global_topics_freqs_dataframe["Topic"] = topics_freqs_dataframe["Topic"].astype(str)
-        #global_topic_counts_barplot = px.bar(global_topics_freqs_dataframe, x="global_topics_freqs_dataframe", y="count", title="Topic Counts")
-        global_topic_counts_barplot.update_layout(title={
-            'text': '<b>Global Topic Counts</b>',
-            'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
-            'x': 0.5,  # Centered title
-        }, showlegend=False)
-
-        global_topic_counts_barplot.update_traces(marker_color=emotion_colours[em])
-        global_barplot_topics_freq_div = pio.to_html(global_topic_counts_barplot, full_html=False, include_plotlyjs="cdn")
-        
-        
-        # topic frequencies
-        topics_freqs_dataframe = topic_models[em][1]
-        topics_freqs_dataframe["Topic"] = topics_freqs_dataframe["Topic"].astype(str)
-        topic_counts_barplot = px.bar(topics_freqs_dataframe, x="Topic", y="Count", title="Topic Counts")
-        topic_counts_barplot.update_layout(title={
-            'text': '<b>Topic Counts</b>',
-            'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
-            'x': 0.5,  # Centered title
-        }, showlegend=False)
-        topic_counts_barplot.update_traces(marker_color=emotion_colours[em])
-        barplot_topics_freq_div = pio.to_html(topic_counts_barplot, full_html=False, include_plotlyjs="cdn")
-        # Showing reviews with each emotion
-        column_data = [em_df[col].tolist() for col in em_df.columns]
-        fig = go.Figure(data=[go.Table(
-                    header=dict(values=list(em_df.columns),
-                                fill_color='paleturquoise',
-                                align='left'),
-                    cells=dict(values=column_data,
-                            fill_color='lavender',
-                            align='left'))
-                ])
-        table_div = pio.to_html(fig, full_html=False, include_plotlyjs="cdn")
-        # Making an interacteable table to show the diferent text included in the review
-        table_emotion = em_df.to_html(index=False, classes="display", table_id=f"table_{em}")
-        # Creating dropdown to filter table by topic
-        dropdown_topic_menu = f'<label for="topics_filter_{em}">Topics:</label> <select name="topics_filter_{em}" id="topics_filter_{em}" onchange="Filter_Topic_{em}()"><option value="All">All</option>'
-        for t in topics_freqs_dataframe["Topic"]:
-            dropdown_topic_menu += f'<option value="{t}">{t}</option>'
-        dropdown_topic_menu += "</select>"
-        # javascript for the emotion
-        style_sel_input = '''
-{
-              language: {
-                    lengthMenu:
-                        'Display <select style="background-color: white; color: black; border-color: #2A4B7C; border-style: solid; border-width: medium; font-family: sans-serif; margin-bottom: 1%;">' +
-                        '<option value="5">5</option>' +
-                        '<option value="10">10</option>' +
-                        '<option value="15">15</option>' +
-                        '<option value="20">20</option>' +
-                        '<option value="25">25</option>' +
-                        '<option value="30">30</option>' +
-                        '<option value="35">35</option>' +
-                        '<option value="40">40</option>' +
-                        '<option value="45">45</option>' +
-                        '<option value="50">50</option>' +
-                        '</select> records'
-                },
-            pageLength : 5
-            }
-'''
-        jav_script = "$(document).ready( function () {"
-        jav_script += f"table{em} = $('#table_{em}')"
-        jav_script += f".DataTable({style_sel_input});"
-        jav_script += "});"
-        # Function to filter table entries by topic
-        fun_filter = "{"
-        fun_filter += f'let f = document.getElementById("topics_filter_{em}").value;'
-        fun_filter += "if (f == 'All'){"
-        fun_filter += f"table{em}"
-        fun_filter += '.column(-2).search("", true, false).draw();'
-        fun_filter += '}else{'
-        fun_filter += f"table{em}"
-        fun_filter += '.column(-2).search(`^${f}` + "$", true, false).draw();}}'
-        # resulting div
-        res = f'''
-        <div>
-            <h3 id="Semtinment{em}">{em}</h3>
-            <h4>Word Cloud</h4>
-            <p>Word Cloud of all text associated with this emotion.</p>
-            <img src='data:image/png;base64,{html_str_wordcloud}'>
-            <h4>Top 10 most frequent Trigrams</h4>
-            {bigram_plot_div}
-            <h4 id="TopicFreqsGlobal{em}">Global Topic Counts {em}</h4>
-            <p>Barplot displaying how many times a global topic appears for this emmotion.</p>
-            {global_barplot_topics_freq_div}
-            <h4 id="TopicFreqs{em}">Topic Counts {em}</h4>
-            <p>Barplot displaying how many times a topic appears for this emotion in a topic classification of only {em} texts.</p>
-            {barplot_topics_freq_div}
-            <h4 id="Intertopic{em}">Intertopic distance map</h4>
-            <p>A Umap visualization generated in a way very similar to <a href="https://github.com/cpsievert/LDAvis">LDAvis</a>.</p>
-            {umap_div}
-            <h4 id="Hclust{em}">Hierarchcial clustering</h4>
-            <p>A graph displaying the potential hierarchy of topics.</p>
-            {hierarchical_div}
-            <h4 id="WordScore{em}">Topic Word Score</h4>
-            <p>c-TF-IDF scores of each topic, you can visualize the most meaningfull words for each of the topics.</p>
-            <button id="{em}_positive_but_id_topics_show" onclick="HideButton(this.value, this.id)" value="{em}_topics_barplots_tf">Show Topics</button>
-            <div id="{em}_topics_barplots_tf" style="display: none;">
-                {barplot_div}
-            </div>
-            <h4 id="Sim{em}">Similarity Matrix</h4>
-            <p>A heatmap showing how similar the topics are between them.</p>
-            {heatmap_div}
-            <h4 id="table{em}">{em} texts</h4>
-            <p>The texts that were considered to belong to: {em}</p>
-            {dropdown_topic_menu}
-            {table_emotion}
-            <script>
-            let table{em};
-            {jav_script}
-            function Filter_Topic_{em}(){fun_filter}
-            </script>
-        </div>
-        '''
-        return res
-
-
     # Histogram
-    histogram_emotions = px.histogram(review_dataframe, x = "emotion", color="emotion", color_discrete_map=emotion_colours,
-                                      labels={"emotion": "Emotion"}, title="Emotions")
+    # Counts are computed here so the plot stores one value per emotion instead of the emotion of every text.
+    emotion_counts = review_dataframe["emotion"].value_counts().reset_index()
+    emotion_counts.columns = ["emotion", "count"]
+    histogram_emotions = px.bar(emotion_counts, x = "emotion", y = "count", color="emotion", color_discrete_map=emotion_colours,
+                                labels={"emotion": "Emotion"}, title="Emotions")
     
     histogram_emotions.update_layout(showlegend=False, title={
         'text': '<b>Emotions</b>',
         'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
         'x': 0.5,  # Centered title
     })
-    div_histogram = pio.to_html(histogram_emotions, full_html=False, include_plotlyjs="cdn")
+    div_histogram = figure_to_div(histogram_emotions)
 
     # Boxplot review length
     df_emotion_length = pd.DataFrame()
     df_emotion_length["emotion"] = review_dataframe["emotion"]
-    df_emotion_length["text_word_length"] = review_dataframe["text"].apply(lambda x: len(x.split()))
+    df_emotion_length["text_word_length"] = review_dataframe["text"].str.split().str.len().astype("int32")
     
     boxplot_review_length = px.box(df_emotion_length, x="emotion", y="text_word_length", color="emotion", color_discrete_map=emotion_colours,
                                    labels={"emotion": "Emotion", "text_word_length": "Amount of words"}, title="Word Count")
@@ -554,51 +984,79 @@ button:hover{
         'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
         'x': 0.5,  # Centered title
     })
-    boxplot_review_length_div = pio.to_html(boxplot_review_length, full_html=False, include_plotlyjs="cdn")
+    boxplot_review_length_div = figure_to_div(boxplot_review_length)
+
+    # Emotions and topics over time
+    trends_section = ""
+    if trends is not None:
+        with stage("report.trends", rows=trends[0].shape[0]):
+            trends_section = generate_trends(trends[0], trends[1], emotion_colours, rolling_windows=rolling_windows,
+                                             window=trend_window)
 
     # Dimensionality reduction visualisation UMAP
 
-    tfidf_vectorizer = TfidfVectorizer(min_df=5, stop_words=stopwords.words(lang))
-    tfidf_word_doc_matrix = tfidf_vectorizer.fit_transform(review_dataframe["text"])
-    tfidf_umap = umap.UMAP(n_components=2,metric=umap_met, min_dist=min_dist_umap, n_neighbors=neighbours_umap)
-    tfidf_embedding = tfidf_umap.fit_transform(tfidf_word_doc_matrix)
+    if scalable_umap == True:
+        with stage("report.summary_umap", rows=review_dataframe.shape[0]):
+            tfidf_embedding = embed_texts_umap(review_dataframe["text"], lang=lang, umap_met=umap_met, neighbours_umap=neighbours_umap,
+                                               min_dist_umap=min_dist_umap, sample_size=umap_sample_size)
+        umap_fig = generate_umap_scattergl(tfidf_embedding, review_dataframe, umap_summ_color, emotion_colours, max_points=umap_max_points)
+        # The variable is chosen inside the figure, so there is no need for a dropdown outside of it.
+        select_umaps_dropdown = ""
+        umaps_Divs = f'''
+        <div id="umap_{umap_summ_color[0]}_id" class="Umap_General">
+        {figure_to_div(umap_fig)}
+        </div>
+'''
+    else:
+        with stage("report.summary_umap", rows=review_dataframe.shape[0]):
+            tfidf_embedding = embed_texts_umap(review_dataframe["text"], lang=lang, umap_met=umap_met, neighbours_umap=neighbours_umap,
+                                               min_dist_umap=min_dist_umap)
     
-    # Colour umap by different columns
+        # Colour umap by different columns
 
-    # select to decide which umap to show
+        # select to decide which umap to show
 
-    select_umaps_dropdown = 'Color by: <select onchange="DisplayRightUmap(this.value)">'
+        select_umaps_dropdown = 'Color by: <select onchange="DisplayRightUmap(this.value)">'
 
-    umaps_Divs = ""
+        umaps_Divs = ""
 
-    for variable in umap_summ_color:
-        # Create scatter plot from umap coloring by variable
-        umap_fig_em = px.scatter(tfidf_embedding[:,0], tfidf_embedding[:,1], color=review_dataframe[variable], color_discrete_map=emotion_colours,
-                             title=variable)
+        for variable in umap_summ_color:
+            # Create scatter plot from umap coloring by variable
+            umap_fig_em = px.scatter(tfidf_embedding[:,0], tfidf_embedding[:,1], color=review_dataframe[variable], color_discrete_map=emotion_colours,
+                                 title=variable)
     
-        umap_fig_em.update_layout(title = {
-            'text': '<b>UMAP</b>',
-            'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
-            'x': 0.5,  # Centered title
-        })
+            umap_fig_em.update_layout(title = {
+                'text': '<b>UMAP</b>',
+                'font': {'size': 24, 'family': 'Arial', 'color': 'black'},  # Size and font
+                'x': 0.5,  # Centered title
+            })
         
-        # Create div that will contain the umap
-        umap_fig_em_div = pio.to_html(umap_fig_em, full_html=False, include_plotlyjs="cdn")
+            # Create div that will contain the umap
+            umap_fig_em_div = figure_to_div(umap_fig_em)
 
-        id_umap = f"umap_{variable}_id"
-        select_umaps_dropdown += f'<option value="{id_umap}">{variable}</option>'
+            id_umap = f"umap_{variable}_id"
+            select_umaps_dropdown += f'<option value="{id_umap}">{variable}</option>'
 
 
-        div_umap = f'''
+            div_umap = f'''
         <div id="{id_umap}" class="Umap_General">
         {umap_fig_em_div}
         </div>
 '''
         
-        umaps_Divs += div_umap
+            umaps_Divs += div_umap
         
-    # Close select
-    select_umaps_dropdown += "</select>"
+        # Close select
+        select_umaps_dropdown += "</select>"
+
+    # Table with every text, only in sharded mode since inlining all texts would make the report too large.
+    global_table_section = ""
+    if table_mode == "sharded":
+        global_table_section = f'''
+        <h3 id="TableAll">All texts</h3>
+        <p>Every text analyzed, it can be filtered by global topic.</p>
+        {generate_sharded_table(review_dataframe, path, "ALL", topics=Global_topic_Model[1]["Topic"], topic_column="global_topic", shard_size=table_shard_size)}
+'''
 
     # Segment of html that shows general information without the umap.
 
@@ -611,24 +1069,15 @@ button:hover{
         <h3 id="WordCount">Amount of words per emotion</h3>
         <p>Boxplot showing the amount of words each text has, text have been divided by emotion.</p>
         {boxplot_review_length_div}
+        {trends_section}
         <h3 id="UmapEmotions">Umap reviews</h3>
         <p>A UMAP to see how similar the text of each emotion are.</p>
         {select_umaps_dropdown}
         {umaps_Divs}
+        {global_table_section}
         <br><br><br>
-        {generate_overview()}
 '''
 
-    # Adding umaps to general section of html and closing the div
-    html_summary += "</div>"
-
-    emotion_sections = []
-
-    # Topics plots
-    for k in topic_models.keys():
-        div_emotion = generate_html_for_emotion(k)
-        emotion_sections.append(div_emotion)
-
     html_end = '''
 </main>
     </div>
@@ -640,9 +1089,38 @@ button:hover{
 </html>
 '''
 
-    html_final = "\n".join([html_template, html_summary, "<h2>Sentiment Analysis</h2>","\n".join(emotion_sections), html_end])
-    
-    with open(os.path.join(path, "report.html"), "w+") as file:
-        file.write(html_final)
+    summary_seconds = time.perf_counter() - summary_start
+    add_time("report.summary", summary_seconds, rows=review_dataframe.shape[0])
 
-    return html_final
\ No newline at end of file
+    def report_sections():
+        '''
+        Yield each section of the report, with the seconds it took to render, as soon as it is available so it can be written
+        to disk straight away and in order.
+        '''
+        yield "header", html_template, 0
+        yield "summary", html_summary, summary_seconds
+        if executor is None:
+            sections = ((name, render_section(function, *arguments)) for name, function, arguments in section_arguments())
+        else:
+            sections = ((name, future.result()) for name, future in rendered_sections)
+        # The overview and the section of each emotion
+        with progress("report_sections", total=1 + len(topic_models), unit="sections") as tracker:
+            for name, (html_section, seconds, counters) in sections:
+                add_time(f"report.sections.{name}", seconds)
+                advance(tracker)
+                # Counters of sections rendered in this process are already recorded
+                if executor is not None:
+                    merge_counters(counters)
+                if name == "overview":
+                    # Adding the overview to the general section of html and closing the div
+                    yield name, html_section + "</div>", seconds
+                    yield "sentiment_header", "<h2>Sentiment Analysis</h2>", 0
+                else:
+                    yield name, html_section, seconds
+        yield "footer", html_end, 0
+
+    try:
+        return write_report_sections(os.path.join(path, "report.html"), report_sections())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
@@ -2,41 +2,117 @@
 Functions for topic analysis.
 '''
 
-from bertopic import BERTopic
-from bertopic.representation import KeyBERTInspired
+import numpy as np
 import pandas as pd
 import warnings
-from umap import UMAP
+import os
+import json
+import threading
+from datetime import datetime, timezone
+from src.metrics import stage, timed_methods
+from src.executors import partition_bounds, map_partitions
+from src.progress import progress, advance
+# BERTopic, sentence_transformers and umap are imported by the functions that load the models since they are slow to import.
 
-def load_BERT(lang = "english", min_topic_size=10, n_neighbors=15, n_components=5, low_memory = True):
+# Emotions texts can be classified as, in the order they are divided into topics.
+emotion_order = ["POSITIVE", "NEUTRAL", "NEGATIVE", "NEGATIVE-POSITIVE", "NEGATIVE-NEUTRAL", "NEUTRAL-POSITIVE", "NEGATIVE-NEUTRAL-POSITIVE"]
+
+# Version of the layout of the models folder described by manifest.json, increased whenever it changes
+models_format_version = 1
+
+def load_BERT(lang = "english", min_topic_size=10, n_neighbors=15, n_components=5, low_memory = True, embedding_model = None):
     '''
-    Creates a BERTtopic model using topic representation KeyBERTInspired.
+    Creates a BERTtopic model using topic representation KeyBERTInspired. If embedding_model is None, BERTopic loads the default
+    embedding model for the language.
     '''
+    from bertopic import BERTopic
+    from bertopic.representation import KeyBERTInspired
+    from umap import UMAP
+
     # Defining umap model for BERTopic
     umap_model = UMAP(n_neighbors=n_neighbors, n_components=n_components, metric='cosine', low_memory=low_memory, init='random')
 
     # Creating BERTopic model
     representation_model = KeyBERTInspired()
-    return BERTopic(language=lang, verbose=True, representation_model=representation_model, min_topic_size=min_topic_size, umap_model=umap_model)
+    return BERTopic(language=lang, verbose=True, representation_model=representation_model, min_topic_size=min_topic_size, umap_model=umap_model,
+                    embedding_model=embedding_model)
 
-def get_topics(model, df, reviews_columns):
+def load_embedding_model(lang = "english"):
+    '''
+    Load the sentence transformer used by BERTopic for a language, so it is loaded only once for all topic models.
     '''
-    Uses a BERTtopic model to find topics in a dataframe with texts.
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(embedding_model_name(lang))
+
+# Embedding models loaded by the workers embedding partitions, kept so every model is loaded once per worker
+_worker_embedding_models = {}
+_worker_embedding_models_lock = threading.Lock()
+
+def embed_partition(texts, lang = "english"):
+    '''
+    Embed a partition of texts in a worker of an executor, which loads the embedding model of the language the first time.
+    '''
+    with _worker_embedding_models_lock:
+        if lang not in _worker_embedding_models:
+            _worker_embedding_models[lang] = load_embedding_model(lang)
+        embedding_model = _worker_embedding_models[lang]
+    return np.asarray(embedding_model.encode(texts.to_list()), dtype=np.float32)
+
+def embed_texts(texts, embedding_model, lang = "english", executor = None, partition_size = 50000, tracker = None,
+                chunk_size = 10000):
+    '''
+    Embed a series of texts with embedding_model by chunks of chunk_size texts or, if an executor is given (see
+    src.executors.open_executor), by partitions of partition_size texts embedded by its workers with the embedding model of the
+    language. The progress tracker (see src.progress) is advanced after each chunk or partition.
+    '''
+    if executor is None:
+        # Chunks are written into a single array instead of being concatenated, which would need twice the memory
+        embeddings = None
+        for start in range(0, texts.shape[0], chunk_size):
+            chunk = embedding_model.encode(texts.iloc[start:start + chunk_size].to_list())
+            if embeddings is None:
+                embeddings = np.empty((texts.shape[0],) + chunk.shape[1:], dtype=chunk.dtype)
+            embeddings[start:start + chunk.shape[0]] = chunk
+            advance(tracker, chunk.shape[0])
+        return embeddings if embeddings is not None else embedding_model.encode([])
+    partitions = [texts.iloc[start:end] for start, end in partition_bounds(texts.shape[0], partition_size)]
+    embeddings = map_partitions(executor, embed_partition, partitions, lang, tracker=tracker)
+    # Models loaded by threads of this process are not needed anymore
+    with _worker_embedding_models_lock:
+        _worker_embedding_models.clear()
+    return np.concatenate(embeddings) if len(embeddings) > 0 else np.zeros((0, 0), dtype=np.float32)
+
+def get_topics(model, df, reviews_columns, embedding_model = None, embeddings = None):
+    '''
+    Uses a BERTtopic model to find topics in a dataframe with texts. If embedding_model is given, the embeddings are computed
+    before fitting the model so their time is measured apart from the rest of BERTopic's steps, unless they are already given.
     '''
     docs = df[reviews_columns].to_list()
-    return model.fit_transform(docs)
+    if (embeddings is None) and (embedding_model is not None):
+        with stage("topic_modelling.embeddings", rows=len(docs)):
+            embeddings = embedding_model.encode(docs)
+
+    # Timing dimensionality reduction, clustering and topic representation (c-TF-IDF and KeyBERTInspired)
+    methods = {"_reduce_dimensionality": "topic_modelling.umap", "_cluster_embeddings": "topic_modelling.hdbscan",
+               "_extract_topics": "topic_modelling.representation"}
+    with timed_methods(model, methods):
+        return model.fit_transform(docs, embeddings=embeddings)
 
-def topic_modelling(df, review_columns, min_topic_size=10, language="english", n_neighbors=15, n_components=5, low_memory= True):
+def topic_modelling(df, review_columns, min_topic_size=10, language="english", n_neighbors=15, n_components=5, low_memory= True,
+                    embedding_model = None, embeddings = None):
     '''
-    Classifies reviews in different topics.
+    Classifies reviews in different topics. Embeddings of the texts can be given so they are not computed again.
     '''
     # Loading model and dividing in topics
-    topic_model = load_BERT(min_topic_size=min_topic_size, lang=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory)
-    topic, probs = get_topics(topic_model, df, review_columns)
+    topic_model = load_BERT(min_topic_size=min_topic_size, lang=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory,
+                            embedding_model=embedding_model)
+    with stage("topic_modelling", rows=df.shape[0]):
+        topic, probs = get_topics(topic_model, df, review_columns, embedding_model=embedding_model, embeddings=embeddings)
 
     # Adding the topic number and the probability of belonging to se topic to each review.
-    df["topic"] = topic
-    df["probability_topic"] = probs
+    df["topic"] = np.asarray(topic, dtype=np.int32)
+    df["probability_topic"] = np.asarray(probs, dtype=np.float32) if probs is not None else np.float32("nan")
 
     # Geting the 10 most frequent topics.
     top_topics = topic_model.get_topic_freq()
@@ -46,14 +122,16 @@ def topic_modelling(df, review_columns, min_topic_size=10, language="english", n
     # half the topic size
     umap_failed = False
     try:
-        topic_model.visualize_topics()
+        with stage("topic_modelling.visualization_check"):
+            topic_model.visualize_topics()
     except Exception as e:
         umap_failed = True
     if (top_topics.shape[0] == 0) or (umap_failed == True):
         reduced_topic_size = int(min_topic_size/2)
         if reduced_topic_size >= 2:
             warnings.warn(f"No topics identified for the dataframe, triying again reducing by half the min_topic_size({reduced_topic_size})")
-            return topic_modelling(df, review_columns, reduced_topic_size, language, n_neighbors, n_components, low_memory)
+            return topic_modelling(df, review_columns, reduced_topic_size, language, n_neighbors, n_components, low_memory, embedding_model,
+                                   embeddings)
         warnings.warn("Could not find topics for the dataframe")
     # Getting most important words for each topic
     main_words = []
@@ -80,90 +158,191 @@ def topic_modelling(df, review_columns, min_topic_size=10, language="english", n
 
     return topic_model, top_topics
 
-def review_topics(df, review_column = "text",emotion_column = "emotion", min_topic_size=10, language="english", n_neighbors=15, n_components=5, low_memory= True):
+def review_topics(df, review_column = "text",emotion_column = "emotion", min_topic_size=10, language="english", n_neighbors=15, n_components=5, low_memory= True,
+                  executor = None, partition_size = 50000):
     '''
-    Divide positive, neutral and negative texts into topics.
+    Divide positive, neutral and negative texts into topics. The topics are added to df, which is returned as the last element
+    of the results together with the topic model and top topics of each emotion and the positions of the texts of each emotion.
+    Texts are embedded once, by partitions of partition_size texts in the workers of executor if it is given, and the same
+    embeddings are used by the global topic model and the topic model of each emotion.
     '''
-    # Defining variables where results will be kept
-    positive_results = []
-    neutral_results = []
-    negative_results = []
-    neg_net_results = []
-    neg_pos_results = []
-    net_pos_results = []
-    mixed_results = []
-    all_results = []
+    # Topic models and top topics of each emotion, and positions of the texts of each emotion in df
+    resulting_df = [{}, {}]
 
-    # List that will be used to concatenate all reviews with their respective topics into a dataframe
+    # The same embedding model is used by every topic model
+    with stage("embedding_model_loading"):
+        embedding_model = load_embedding_model(language)
 
-    concat_df = []
-    resulting_df = [{}, {}]
+    with stage("topic_modelling.embeddings", rows=df.shape[0]), progress("embeddings", total=df.shape[0]) as tracker:
+        embeddings = embed_texts(df[review_column], embedding_model, lang=language, executor=executor, partition_size=partition_size,
+                                 tracker=tracker)
+
+    # Every text is clustered twice, globally and within its emotion
+    with progress("topic_modelling", total=2 * df.shape[0]) as tracker:
+        # Classifiying all texts into topics globally first
+        Global_Topics = topic_modelling(df, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory,
+                                        embedding_model=embedding_model, embeddings=embeddings)
+        advance(tracker, df.shape[0])
+
+        df.rename(columns={'topic': 'global_topic', 'probability_topic': 'global_probability_topic'}, inplace=True)
+
+        # The topics of the texts of each emotion are written at their positions in arrays with a value for every text, so the
+        # texts of each emotion are not copied into dataframes of their own and concatenated again afterwards
+        topic = np.full(df.shape[0], -1, dtype=np.int32)
+        probability_topic = np.full(df.shape[0], np.nan, dtype=np.float32)
+        emotions = pd.Categorical(df[emotion_column])
+
+        # Classify the texts of each emotion into topics, including texts that could be of more than one emotion.
+        for em in emotion_order:
+            if em not in emotions.categories:
+                continue
+            positions = np.flatnonzero(emotions.codes == emotions.categories.get_loc(em))
+            if positions.shape[0] == 0:
+                continue
+            # Only the column with the texts is taken
+            df_emotion = df[review_column].iloc[positions].to_frame()
+            resulting_df[0][em] = topic_modelling(df_emotion, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory,
+                                                  embedding_model=embedding_model, embeddings=embeddings[positions])
+            resulting_df[1][em] = positions
+            topic[positions] = df_emotion["topic"].to_numpy()
+            probability_topic[positions] = df_emotion["probability_topic"].to_numpy()
+            advance(tracker, positions.shape[0])
+
+    df["topic"] = topic
+    df["probability_topic"] = probability_topic
+
+    resulting_df.append(df)
+
+    return [Global_Topics, resulting_df]
+
+def embedding_model_name(lang="english"):
+    '''
+    Name of the sentence transformer BERTopic uses by default for a language.
+    '''
+    if lang == "english":
+        return "sentence-transformers/all-MiniLM-L6-v2"
+    return "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+def save_topic_models(global_topic_model, topic_models, output_directory, lang="english", parameters={}, sentiment_model=None,
+                      output_format=None):
+    '''
+    Save the global topic model and the topic model of each emotion in output_directory/models with safetensors.
+    The embedding model is not saved, only its name so it can be loaded again. A manifest.json describes the models, the
+    parameters they were fitted with, the sentiment model that classified the texts into emotions and the format the tables of
+    the run were saved in.
+    '''
+    models_directory = os.path.join(output_directory, "models")
+    named_models = [("Global", global_topic_model)] + [(k, topic_models[k][0]) for k in topic_models.keys()]
+    manifest = {
+        "format_version": models_format_version,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "language": lang,
+        "embedding_model": embedding_model_name(lang),
+        "sentiment_model": sentiment_model,
+        "parameters": parameters,
+        "output_format": output_format,
+        "models": {},
+    }
+    for name, model in named_models:
+        model.save(os.path.join(models_directory, name), serialization="safetensors", save_ctfidf=True,
+                   save_embedding_model=embedding_model_name(lang))
+        manifest["models"][name] = {
+            "directory": name,
+            "topics": len([t for t in model.topic_sizes_.keys() if t != -1]),
+            "documents": int(sum(model.topic_sizes_.values())),
+        }
+    with open(os.path.join(models_directory, "manifest.json"), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4)
+    return models_directory
+
+def read_models_manifest(models_directory):
+    '''
+    Read the manifest.json of a models folder. Folders saved before there were manifests are described from the configuration
+    of each model.
+    '''
+    manifest_path = os.path.join(models_directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest["format_version"] > models_format_version:
+            raise Exception(f"The models in {models_directory} were saved with a newer version of LinguaLoupe "
+                            f"(format {manifest['format_version']}), only format {models_format_version} or older can be loaded.")
+        return manifest
+
+    with open(os.path.join(models_directory, "Global", "config.json"), encoding="utf-8") as file:
+        config = json.load(file)
+    names = ["Global"] + [em for em in emotion_order if os.path.isdir(os.path.join(models_directory, em))]
+    return {"format_version": 0, "language": None, "embedding_model": config.get("embedding_model"), "sentiment_model": None,
+            "parameters": {}, "output_format": None, "models": {name: {"directory": name} for name in names}}
+
+def load_topic_centroids(models_directory):
+    '''
+    Load the embedding of every topic of the models saved by save_topic_models, without loading the models themselves. Returns
+    the manifest and a dictionary with the topic numbers and the normalized topic embeddings of each model.
+    '''
+    from safetensors.numpy import load_file
+
+    manifest = read_models_manifest(models_directory)
+    centroids = {}
+    for name, description in manifest["models"].items():
+        model_directory = os.path.join(models_directory, description["directory"])
+        embeddings = load_file(os.path.join(model_directory, "topic_embeddings.safetensors"))["topic_embeddings"].astype(np.float32)
+        with open(os.path.join(model_directory, "topics.json"), encoding="utf-8") as file:
+            # The first embedding is the one of the outliers (-1) if there are outliers
+            outliers = json.load(file)["_outliers"]
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        centroids[name] = (np.arange(embeddings.shape[0], dtype=np.int32) - outliers, embeddings)
+    return manifest, centroids
+
+def nearest_topics(embeddings, centroids):
+    '''
+    Topic whose embedding is most similar (cosine similarity) to each normalized embedding, and their similarity.
+    '''
+    topic_ids, topic_embeddings = centroids
+    similarities = embeddings @ topic_embeddings.T
+    best = similarities.argmax(axis=1)
+    return topic_ids[best], similarities[np.arange(best.shape[0]), best]
+
+def assign_topics(texts, emotions, centroids, embedding_model, batch_size=10000):
+    '''
+    Assign new texts to the topics of the global model and of the model of their emotion, with the centroids returned by
+    load_topic_centroids. Like BERTopic does for models saved with safetensors, each text is assigned the topic whose embedding is
+    the most similar to its own, but the texts are embedded once and compared with every topic in batches of batch_size with a
+    single matrix product. Returns a dataframe with the global_topic, global_similarity, topic and similarity of each text, topic
+    is -1 for texts whose emotion has no model.
+    '''
+    texts = list(texts)
+    emotions = np.asarray(emotions, dtype=object)
+    result = {
+        "global_topic": np.full(len(texts), -1, dtype=np.int32),
+        "global_similarity": np.zeros(len(texts), dtype=np.float32),
+        "topic": np.full(len(texts), -1, dtype=np.int32),
+        "similarity": np.zeros(len(texts), dtype=np.float32),
+    }
+    for start in range(0, len(texts), batch_size):
+        end = min(start + batch_size, len(texts))
+        with stage("topic_assignment.embeddings", rows=end - start):
+            embeddings = np.asarray(embedding_model.encode(texts[start:end]), dtype=np.float32)
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        with stage("topic_assignment.similarity", rows=end - start):
+            result["global_topic"][start:end], result["global_similarity"][start:end] = nearest_topics(embeddings, centroids["Global"])
+            batch_emotions = emotions[start:end]
+            for em in emotion_order:
+                positions = np.flatnonzero(batch_emotions == em)
+                if (em not in centroids) or (positions.shape[0] == 0):
+                    continue
+                result["topic"][start + positions], result["similarity"][start + positions] = nearest_topics(embeddings[positions], centroids[em])
+    return pd.DataFrame(result)
+
+def load_topic_models(models_directory):
+    '''
+    Load the models saved by save_topic_models. Returns the global topic model and a dictionary with the model of each emotion.
+    '''
+    from bertopic import BERTopic
 
-    # Classifiying all texts into topics globally first
-    Global_Topics = topic_modelling(df, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory)
-
-    df.rename(columns={'topic': 'global_topic', 'probability_topic': 'global_probability_topic'}, inplace=True)
-
-    # Classify positive reviews into topics.
-    df_positive = df[df[emotion_column] == "POSITIVE"]
-    if df_positive.shape[0] > 0:
-        positive_results = topic_modelling(df_positive, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory)
-        concat_df.append(df_positive)
-        resulting_df[0]["POSITIVE"] = positive_results
-        resulting_df[1]["POSITIVE"] = df_positive
-
-    # Classify neutral reviews into topics
-    df_neutral = df[df[emotion_column] == "NEUTRAL"]
-    if df_neutral.shape[0] > 0:
-        neutral_results = topic_modelling(df_neutral, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory)
-        concat_df.append(df_neutral)
-        resulting_df[0]["NEUTRAL"] = neutral_results
-        resulting_df[1]["NEUTRAL"] = df_neutral
-
-    # Classify negative reviews into topics
-    df_negative = df[df[emotion_column] == "NEGATIVE"]
-    if df_negative.shape[0] > 0:
-        negative_results = topic_modelling(df_negative, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory)
-        concat_df.append(df_negative)
-        resulting_df[0]["NEGATIVE"] = negative_results
-        resulting_df[1]["NEGATIVE"] = df_negative
-
-    # Classify reviews that could be either negative or positive
-    df_neg_pos = df[df[emotion_column] == "NEGATIVE-POSITIVE"]
-    if df_neg_pos.shape[0] > 0:
-        neg_pos_results = topic_modelling(df_neg_pos, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory)
-        concat_df.append(df_neg_pos)
-        resulting_df[0]["NEGATIVE-POSITIVE"] = neg_pos_results
-        resulting_df[1]["NEGATIVE-POSITIVE"] = df_neg_pos
-
-    # Classify reviews that could be either negative or neutral
-    df_neg_net = df[df[emotion_column] == "NEGATIVE-NEUTRAL"]
-    if df_neg_net.shape[0] > 0:
-        neg_net_results = topic_modelling(df_neg_net, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory)
-        concat_df.append(df_neg_net)
-        resulting_df[0]["NEGATIVE-NEUTRAL"] = neg_net_results
-        resulting_df[1]["NEGATIVE-NEUTRAL"] = df_neg_net
-
-    # Classify reviews that could be either neutral or positive
-    df_net_pos = df[df[emotion_column] == "NEUTRAL-POSITIVE"]
-    if df_net_pos.shape[0] > 0:
-        net_pos_results = topic_modelling(df_net_pos, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory)
-        concat_df.append(df_net_pos)
-        resulting_df[0]["NEUTRAL-POSITIVE"] = net_pos_results
-        resulting_df[1]["NEUTRAL-POSITIVE"] = df_net_pos
-    
-    # In case there is a review that has been asigned all three emotions. Examin its topics.
-    df_all = df[df[emotion_column] == "NEGATIVE-NEUTRAL-POSITIVE"]
-    if df_all.shape[0] > 0:
-        all_results = topic_modelling(df_all, review_column, min_topic_size=min_topic_size, language=language, n_neighbors=n_neighbors, n_components=n_components, low_memory=low_memory)
-        concat_df.append(df_all)
-        resulting_df[0]["NEGATIVE-NEUTRAL-POSITIVE"] = all_results
-        resulting_df[1]["NEGATIVE-NEUTRAL-POSITIVE"] = df_all
-
-    # Concatenating all data frames
-
-    df_complete = pd.concat(concat_df, ignore_index=True)
-
-    resulting_df.append(df_complete)
-
-    return [Global_Topics, resulting_df]
\ No newline at end of file
+    global_topic_model = BERTopic.load(os.path.join(models_directory, "Global"))
+    topic_models = {}
+    for em in emotion_order:
+        if os.path.isdir(os.path.join(models_directory, em)):
+            topic_models[em] = BERTopic.load(os.path.join(models_directory, em))
+    return global_topic_model, topic_models
@@ -0,0 +1,72 @@
+'''
+Language identification of the texts, used when the language is "auto" to classify each text with the sentiment model of its
+language. Languages are told apart by how many of the first words of a text are nltk stopwords of each language, which is
+enough to route texts to a model and takes a fraction of the time of classifying them.
+'''
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# Languages texts can be detected as, the languages of the models in sentiment.py and of bert-base-multilingual-uncased-sentiment
+detectable_languages = ["english", "spanish", "portuguese", "french", "german", "italian", "dutch"]
+
+# Language used for the topic models, the embeddings and the stopwords of collections of texts in more than one language
+mixed_language = "multilingual"
+
+word_pattern = re.compile(r"[^\W\d_]+")
+
+def stopword_languages(languages=detectable_languages):
+    '''
+    Dictionary with the positions (in languages) of the languages each stopword belongs to.
+    '''
+    # Imported here since src.resources imports the languages of this module
+    from src.resources import stopword_set
+
+    word_languages = {}
+    for i, language in enumerate(languages):
+        for word in stopword_set(language):
+            word_languages.setdefault(word, []).append(i)
+    return {w: tuple(l) for w, l in word_languages.items()}
+
+def detect_languages(texts, languages=detectable_languages, default="english", n_words=50):
+    '''
+    Detect the language of each text of a series among languages, counting how many of its first n_words words are stopwords
+    of each of them. Texts without any stopword are assigned the default language. Returns a categorical with the language of
+    each text.
+    '''
+    word_languages = stopword_languages(languages)
+    default_code = languages.index(default)
+    codes = np.full(len(texts), default_code, dtype=np.int8)
+    for i, text in enumerate(texts):
+        hits = [0] * len(languages)
+        # Only the beginning of long texts is read, words are rarely longer than 15 characters
+        for word in word_pattern.findall(text[:n_words * 15].lower())[:n_words]:
+            for l in word_languages.get(word, ()):
+                hits[l] += 1
+        # Ties go to the language listed first, texts without stopwords keep the default
+        best = max(hits)
+        if best > 0:
+            codes[i] = hits.index(best)
+    return pd.Categorical.from_codes(codes, categories=languages)
+
+def collection_language(languages):
+    '''
+    Language of a collection of texts given the language of each of them: the language itself if there is only one, or
+    mixed_language otherwise.
+    '''
+    found = pd.unique(np.asarray(languages, dtype=object))
+    found = [l for l in found if isinstance(l, str)]
+    if len(found) == 1:
+        return found[0]
+    return mixed_language
+
+def stopword_language(language, text_languages=[]):
+    '''
+    Language, or list of languages, whose nltk stopwords are removed from the texts of the report. Collections in more than one
+    language use the stopwords of every language found in them.
+    '''
+    if language != mixed_language:
+        return language
+    return sorted(l for l in pd.unique(np.asarray(text_languages, dtype=object)) if isinstance(l, str))
@@ -0,0 +1,227 @@
+'''
+Instrumentation of the pipeline. Stages are timed together with the rows they process and the memory used, counters keep
+track of events like cache hits, and everything is written to metrics.json in the output directory. If profiling is enabled,
+a cProfile dump of every stage is saved too (it can be opened with pstats, snakeviz or converted for speedscope).
+'''
+
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Metrics of the current run
+_stages = {}
+_counters = {}
+_profilers = {}
+# Sample of the duration of the calls to each stage, used to compute latency percentiles
+_durations = {}
+_durations_size = 10000
+_random = random.Random(0)
+_state = {"start": time.perf_counter(), "profile_directory": None, "profiling": False}
+_lock = threading.Lock()
+
+def start_metrics(profile_directory=None):
+    '''
+    Forget the metrics of previous runs. If profile_directory is given, a cProfile dump of each stage is saved in it.
+    '''
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _profilers.clear()
+        _durations.clear()
+        _state["start"] = time.perf_counter()
+        _state["profile_directory"] = profile_directory
+        _state["profiling"] = False
+
+def rss_mb():
+    '''
+    Resident memory of the process in MB.
+    '''
+    return psutil.Process().memory_info().rss / 2**20
+
+def peak_rss_mb():
+    '''
+    Peak resident memory of the process in MB since it started.
+    '''
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes in macOS and in KB elsewhere
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+    return getattr(psutil.Process().memory_info(), "peak_wset", psutil.Process().memory_info().rss) / 2**20
+
+def add_time(name, seconds, rows=0):
+    '''
+    Add the seconds and rows of a call to a stage. Used in hot loops, where measuring memory every call would be too slow.
+    '''
+    with _lock:
+        stats = _stages.setdefault(name, {"seconds": 0.0, "calls": 0, "rows": 0})
+        stats["seconds"] += seconds
+        stats["calls"] += 1
+        stats["rows"] += rows
+        # Reservoir sampling so the sample of durations has a fixed size however many calls there are
+        durations = _durations.setdefault(name, [])
+        if len(durations) < _durations_size:
+            durations.append(seconds)
+        else:
+            position = _random.randrange(stats["calls"])
+            if position < _durations_size:
+                durations[position] = seconds
+    return stats
+
+def percentile(values, q):
+    '''
+    Percentile q (between 0 and 100) of a list of values, interpolating linearly between the closest ranks.
+    '''
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+@contextmanager
+def stage(name, rows=0):
+    '''
+    Time a stage of the pipeline, recording the rows processed and the resident memory before and after it. Stages can be
+    called more than once (their metrics are added up) and nested, nested stages are included in the time of their parent.
+    Yields a dictionary whose "rows" can be set inside the stage when they are not known beforehand.
+    '''
+    rss_start = rss_mb()
+
+    # Only one profiler can be active at a time, nested stages are profiled as part of their parent
+    profiler = None
+    if (_state["profile_directory"] is not None) and (_state["profiling"] == False):
+        profiler = _profilers.setdefault(name, cProfile.Profile())
+        try:
+            profiler.enable()
+            _state["profiling"] = True
+        except ValueError:
+            # Another profiler (not started by a stage) is already running
+            profiler = None
+
+    measured = {"rows": rows}
+    start = time.perf_counter()
+    try:
+        yield measured
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            _state["profiling"] = False
+        stats = add_time(name, seconds, measured["rows"])
+        with _lock:
+            stats.setdefault("rss_start_mb", rss_start)
+            stats["rss_end_mb"] = rss_mb()
+            stats["peak_rss_mb"] = peak_rss_mb()
+
+def count(name, value=1):
+    '''
+    Add value to a counter.
+    '''
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def cache_access(name, hit):
+    '''
+    Count a hit or a miss of a cache, their rate is computed in metrics.json.
+    '''
+    count(f"{name}.{'hits' if hit else 'misses'}")
+
+def counters_snapshot():
+    '''
+    Copy of the counters, used to know which counters changed in a worker process.
+    '''
+    with _lock:
+        return dict(_counters)
+
+def counter_changes(snapshot):
+    '''
+    Amount each counter has increased since snapshot.
+    '''
+    with _lock:
+        return {k: v - snapshot.get(k, 0) for k, v in _counters.items() if v != snapshot.get(k, 0)}
+
+def merge_counters(changes):
+    '''
+    Add the counters changed in a worker process to the counters of this process.
+    '''
+    for k, v in changes.items():
+        count(k, v)
+
+@contextmanager
+def timed_methods(obj, methods):
+    '''
+    Time every call to the methods of obj while in the context, methods is a dictionary of method name to stage name.
+    The original methods are restored afterwards so obj can still be pickled.
+    '''
+    for method, name in methods.items():
+        original = getattr(obj, method, None)
+        if original is None:
+            continue
+
+        def timed(*args, _original=original, _name=name, **kwargs):
+            with stage(_name):
+                return _original(*args, **kwargs)
+
+        setattr(obj, method, timed)
+    try:
+        yield obj
+    finally:
+        for method in methods.keys():
+            obj.__dict__.pop(method, None)
+
+def write_metrics(output_directory, extra={}):
+    '''
+    Write the metrics of the run to output_directory/metrics.json, adding the entries of extra, and save the profile of each
+    stage if profiling is enabled. If extra has the number of rows, the peak memory per row is added too. Returns the metrics.
+    '''
+    with _lock:
+        stages = {}
+        for name, stats in _stages.items():
+            stages[name] = dict(stats)
+            if (stats["rows"] > 0) and (stats["seconds"] > 0):
+                stages[name]["rows_per_second"] = stats["rows"] / stats["seconds"]
+            if stats["calls"] > 1:
+                stages[name]["latency_ms"] = {f"p{q}": percentile(_durations[name], q) * 1000 for q in (50, 90, 99)}
+
+        cache_hit_rates = {}
+        for name in _counters.keys():
+            if name.endswith(".hits") or name.endswith(".misses"):
+                cache = name.rsplit(".", 1)[0]
+                hits = _counters.get(cache + ".hits", 0)
+                misses = _counters.get(cache + ".misses", 0)
+                cache_hit_rates[cache] = hits / (hits + misses)
+
+        metrics = {
+            "total_seconds": time.perf_counter() - _state["start"],
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": stages,
+            "counters": dict(_counters),
+            "cache_hit_rates": cache_hit_rates,
+        }
+    metrics.update(extra)
+    # Peak memory per text, to compare runs on collections of texts of different sizes
+    if metrics.get("rows", 0) > 0:
+        metrics["peak_rss_kb_per_row"] = metrics["peak_rss_mb"] * 1024 / metrics["rows"]
+
+    os.makedirs(output_directory, exist_ok=True)
+    with open(os.path.join(output_directory, "metrics.json"), "w", encoding="utf-8") as file:
+        json.dump(metrics, file, indent=4, default=str)
+
+    if _state["profile_directory"] is not None:
+        os.makedirs(_state["profile_directory"], exist_ok=True)
+        for name, profiler in _profilers.items():
+            profiler.dump_stats(os.path.join(_state["profile_directory"], re.sub(r"[^\w.-]", "_", name) + ".prof"))
+
+    return metrics
@@ -0,0 +1,253 @@
+'''
+Checks run before the pipeline loads the text data or any model. Only the header or schema of the text data and a sample of
+its rows are read to find misspelled or missing columns, columns with the wrong type and filters that can not be applied, and
+to estimate how many texts there are and how long the pipeline will take.
+'''
+
+import json
+import math
+import os
+import warnings
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from src.read_data import (text_data_files, text_data_columns, text_data_sample, columnar_formats, dtype_kind, apply_row_filters,
+                           arrow_filter_expression)
+
+# Columns created by the pipeline, they can be used in summaries and umaps without being in the text data
+pipeline_columns = ["emotion", "topic", "global_topic"]
+
+# Column created by the pipeline when the text data is not a single file (see src.read_data.read_text_data)
+source_file_column = "source_file"
+
+# Column created by the pipeline when the language of each text is detected
+language_column = "language"
+
+# Columns of Texts the pipeline writes itself, columns to keep can not have these names
+reserved_columns = ["text", "emotion", "emotion_score"]
+
+# Rough seconds per chunk classified and per text divided into topics on a CPU, used to estimate the runtime when there are no
+# metrics of a previous run in the output directory
+default_seconds_per_chunk = 0.03
+default_seconds_per_topic_text = 0.01
+default_seconds_loading = 30
+
+def estimate_rows(data_path, row_filters=[], sample_bytes=2**20):
+    '''
+    Estimate the number of rows of the text data. The rows of parquet, feather and arrow files that match the row filters are
+    counted with pyarrow, which uses the metadata of the files when it can. The rows of uncompressed csv, tsv and jsonl files
+    are estimated, before filtering, from the size of the files and the average size of the rows in the first sample_bytes of
+    the first file. Returns the number of rows (None if it can not be estimated) and whether it is exact.
+    '''
+    files = text_data_files(data_path)
+    file = Path(files[0])
+    suffix = file.suffixes[0] if len(file.suffixes) > 0 else ""
+
+    if suffix in columnar_formats:
+        if os.path.isdir(data_path):
+            dataset = ds.dataset(data_path, format=columnar_formats[suffix], partitioning="hive")
+        else:
+            dataset = ds.dataset(files, format=columnar_formats[suffix])
+        return dataset.count_rows(filter=arrow_filter_expression(dataset.schema, row_filters)), True
+
+    # Compressed, json and excel files can not be estimated from their size
+    if (suffix not in (".csv", ".tsv", ".jsonl")) or (len(file.suffixes) > 1):
+        return None, False
+
+    with open(files[0], "rb") as f:
+        sample = f.read(sample_bytes)
+        whole_file = len(f.read(1)) == 0
+    lines = sample.count(b"\n") + (0 if sample.endswith(b"\n") else 1)
+    header = 1 if suffix != ".jsonl" else 0
+    # Filters are not applied to text files, so their rows are never exact when there are filters
+    if whole_file and (len(files) == 1) and (len(row_filters) == 0):
+        return lines - header, True
+    bytes_per_row = len(sample) / max(lines - header, 1)
+    return int(sum(os.path.getsize(f) for f in files) / bytes_per_row), False
+
+def previous_seconds_per_row(output_directory):
+    '''
+    Seconds per text of a previous run, read from the metrics.json it left in the output directory. Returns None if there is none.
+    '''
+    metrics_path = os.path.join(output_directory, "metrics.json")
+    if not os.path.exists(metrics_path):
+        return None
+    try:
+        with open(metrics_path, encoding="utf-8") as file:
+            metrics = json.load(file)
+        stages = metrics["stages"]
+        # Report only runs do not classify texts, so they can not be used to estimate a whole run
+        if ("classification" not in stages) or (metrics.get("rows", 0) == 0):
+            return None
+        return (metrics["total_seconds"] - stages.get("model_loading", {}).get("seconds", 0)) / metrics["rows"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def estimate_seconds(rows, sample_texts, chunk_size=512, output_directory=None):
+    '''
+    Estimate the seconds the pipeline will take on rows texts. If a previous run left its metrics in output_directory its time
+    per text is used, otherwise the number of chunks each text is divided in is estimated from the length of the sample texts
+    (about 4 characters per token) and multiplied by default_seconds_per_chunk.
+    '''
+    seconds_per_row = previous_seconds_per_row(output_directory) if output_directory is not None else None
+    if seconds_per_row is not None:
+        return default_seconds_loading + rows * seconds_per_row
+
+    lengths = sample_texts.dropna().astype(str).str.len()
+    if len(lengths) == 0:
+        chunks_per_text = 1
+    else:
+        # Texts longer than 512 tokens are classified in chunks of chunk_size characters
+        chunks = lengths.map(lambda l: 1 if (l / 4 <= 512) or (chunk_size is None) else math.ceil(l / chunk_size))
+        chunks_per_text = chunks.mean()
+    # Texts are divided into topics twice, globally and within their emotion
+    return default_seconds_loading + rows * float(chunks_per_text * default_seconds_per_chunk + 2 * default_seconds_per_topic_text)
+
+def format_seconds(seconds):
+    '''
+    Seconds as a short human readable duration, e.g. "2 h 5 min".
+    '''
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{int(seconds // 3600)} h {int(seconds % 3600 / 60)} min"
+
+def check_kept_columns(cols_keep_text, count_text_group=[], mean_text_cols=[], sum_text_cols=[], summary_breakdowns=[], umap_colour=[],
+                       language="english", time_column=None, has_source_file=True):
+    '''
+    Check the columns used in summaries, breakdowns, umaps and trends are kept, since only the columns to keep reach those steps.
+    source_file can only be used if has_source_file is True, when the text data is not a single file. Returns a list of errors.
+    '''
+    errors = []
+    created_columns = pipeline_columns + [language_column] if language == "auto" else pipeline_columns
+    if has_source_file:
+        created_columns = created_columns + [source_file_column]
+    written_columns = reserved_columns + [language_column] if language == "auto" else reserved_columns
+    breakdown_columns = [c.split("@")[0] for breakdown in summary_breakdowns for c in breakdown]
+    trend_columns = [time_column] if time_column is not None else []
+    for c in dict.fromkeys(count_text_group + mean_text_cols + sum_text_cols + breakdown_columns + umap_colour + trend_columns):
+        if (c == source_file_column) and (c not in created_columns) and (c not in cols_keep_text):
+            errors.append(f"{c} is only created when TEXT_DATA is more than one file, a directory, a glob pattern or a manifest")
+        elif (c not in created_columns) and (c not in cols_keep_text):
+            errors.append(f"{c} not in Columns_to_Keep_Text")
+    for c in cols_keep_text:
+        if c in written_columns:
+            errors.append(f"{c} can not be kept since the pipeline creates a column with the same name")
+    return errors
+
+def preflight(text_data, text_col, cols_keep_text=[], count_text_group=[], mean_text_cols=[], sum_text_cols=[],
+              summary_breakdowns=[], umap_colour=[], row_filters=[], csv_sep=",", chunk_size=512, output_directory=None,
+              sample_size=1000, language="english", time_column=None, window="D"):
+    '''
+    Check every column the pipeline will use reading only the header or schema of the text data and its first sample_size rows:
+    the columns must exist, the text column must contain text, the columns to mean and sum must be numeric, breakdowns by time
+    buckets and trends must use date columns and filter values must have the type of their column. Returns a dictionary with the errors and
+    warnings found, the columns of the text data, the estimated number of rows (after filtering) and the estimated seconds.
+    '''
+    try:
+        # Same condition read_text_data uses to add the source_file column
+        has_source_file = not ((text_data_files(text_data) == [text_data]) and os.path.isfile(text_data))
+    except Exception:
+        # The error is reported when reading the columns of the text data
+        has_source_file = True
+    result = {"errors": check_kept_columns(cols_keep_text, count_text_group, mean_text_cols, sum_text_cols, summary_breakdowns, umap_colour,
+                                           language=language, time_column=time_column, has_source_file=has_source_file),
+              "warnings": [], "columns": [], "rows": None, "rows_exact": False, "seconds": None}
+
+    try:
+        columns = text_data_columns(text_data, csv_sep)
+    except Exception as e:
+        result["errors"].append(str(e))
+        return result
+    result["columns"] = columns
+
+    used_columns = list(dict.fromkeys([text_col] + cols_keep_text + [f[0] for f in row_filters]))
+    missing_columns = [c for c in used_columns if c not in columns]
+    if len(missing_columns) > 0:
+        result["errors"].append(f"The following columns are not in {text_data}: {', '.join(missing_columns)}")
+        return result
+
+    try:
+        sample = text_data_sample(text_data, used_columns, csv_sep=csv_sep, n_rows=sample_size)
+    except Exception as e:
+        result["errors"].append(f"Could not read {text_data}: {e}")
+        return result
+
+    # Types of the columns, columns whose sample is empty can not be checked
+    if dtype_kind(sample[text_col]) not in (None, "text"):
+        result["errors"].append(f"The text column {text_col} contains {dtype_kind(sample[text_col])} data instead of text")
+    for c in dict.fromkeys(mean_text_cols + sum_text_cols):
+        if (c in sample.columns) and (dtype_kind(sample[c]) not in (None, "numeric", "boolean")):
+            result["errors"].append(f"{c} can not be averaged or summed since it contains {dtype_kind(sample[c])} data")
+    # Time buckets of the breakdowns and time windows of the trends
+    time_buckets = [c for breakdown in summary_breakdowns for c in breakdown if "@" in c]
+    if time_column is not None:
+        time_buckets.append(f"{time_column}@{window}")
+    for c in time_buckets:
+        date_column, frequency = c.split("@", 1)
+        try:
+            # Same conversion summarize_breakdowns and trend_statistics do
+            pd.Series(pd.to_datetime(["2024-01-01"])).dt.to_period(frequency)
+        except (ValueError, TypeError):
+            result["errors"].append(f"{frequency} in {c} is not a pandas frequency")
+        if (date_column in sample.columns) and (sample[date_column].notna().any()):
+            with warnings.catch_warnings():
+                # Warning about the format of the dates being inferred
+                warnings.simplefilter("ignore")
+                dates = pd.to_datetime(sample[date_column], errors="coerce")
+            if dates.isna().all():
+                result["errors"].append(f"{date_column} can not be grouped by time buckets since it does not contain dates")
+    for c in umap_colour:
+        if (c in sample.columns) and (dtype_kind(sample[c]) not in ("numeric", None)) and (sample[c].nunique() > 50):
+            result["warnings"].append(f"The umap coloured by {c} will have more than 50 colours")
+
+    # Filters are applied to the sample to find values of the wrong type
+    sample_texts = sample[text_col]
+    if len(row_filters) > 0:
+        try:
+            filtered_sample = apply_row_filters(sample, row_filters)
+        except Exception as e:
+            result["errors"].append(f"The filters can not be applied to the text data: {e}")
+            return result
+        if filtered_sample.shape[0] > 0:
+            sample_texts = filtered_sample[text_col]
+    if len(result["errors"]) > 0:
+        return result
+
+    try:
+        rows, exact = estimate_rows(text_data, row_filters)
+    except Exception as e:
+        result["errors"].append(str(e))
+        return result
+    if rows is not None:
+        # Rows of text files are counted before filtering, the filters are assumed to keep the same fraction of rows as in the sample
+        if (len(row_filters) > 0) and not exact:
+            rows = rows * filtered_sample.shape[0] / max(sample.shape[0], 1)
+            exact = False
+            if filtered_sample.shape[0] == 0:
+                result["warnings"].append(f"None of the first {sample.shape[0]} rows match the filters, the number of texts can not be estimated")
+                return result
+        result["rows"] = int(rows)
+        result["rows_exact"] = exact
+        result["seconds"] = estimate_seconds(result["rows"], sample_texts, chunk_size=chunk_size, output_directory=output_directory)
+
+    return result
+
+def print_preflight(result, text_data):
+    '''
+    Print the errors, warnings and estimates found by preflight.
+    '''
+    for error in result["errors"]:
+        print(error)
+    for warning in result["warnings"]:
+        print(f"Warning: {warning}")
+    if len(result["errors"]) > 0:
+        return
+    if result["rows"] is None:
+        print(f"Could not estimate the number of texts in {text_data}")
+        return
+    rows = f"{result['rows']:,}" if result["rows_exact"] else f"about {result['rows']:,}"
+    print(f"{rows} texts to analyze, estimated time {format_seconds(result['seconds'])}")
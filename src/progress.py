@@ -0,0 +1,132 @@
+'''
+Progress of the long running stages of the pipeline (html cleaning, classification, embeddings, topic modelling and report
+sections). Each stage counts the rows, or sections, it has done and every interval seconds a line with the rows done, rows/sec
+and the estimated time left is printed and, if a progress file is given, appended to it as a json line that a scheduler can
+poll. Updating the progress only adds to a counter and reads the clock, so it can be called for every block of texts.
+'''
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from src.preflight import format_seconds
+
+# Progress is not reported until start_progress is called, so functions of the pipeline used on their own stay quiet
+_state = {"file": None, "interval": 10.0, "terminal": False}
+_lock = threading.Lock()
+
+def start_progress(progress_file=None, interval=10.0, terminal=True):
+    '''
+    Report the progress of the stages every interval seconds, printing it if terminal is True and writing it as json lines
+    to progress_file if it is given. The progress file is emptied, so it only has the lines of this run.
+    '''
+    with _lock:
+        _state["file"] = progress_file
+        _state["interval"] = interval
+        _state["terminal"] = terminal
+    if progress_file is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(progress_file)), exist_ok=True)
+        open(progress_file, "w").close()
+    write_line({"stage": "pipeline", "status": "started"})
+
+def finish_progress():
+    '''
+    Write the line marking the end of the run to the progress file and stop reporting progress.
+    '''
+    write_line({"stage": "pipeline", "status": "done"})
+    with _lock:
+        _state["file"] = None
+        _state["terminal"] = False
+
+def write_line(record):
+    '''
+    Append a record, with the time it was written, to the progress file if there is one.
+    '''
+    with _lock:
+        if _state["file"] is None:
+            return
+        with open(_state["file"], "a") as f:
+            f.write(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), **record}) + "\n")
+
+def progress_record(tracker, status):
+    '''
+    Rows done, total, rows/sec, elapsed and estimated seconds left of the stage followed by tracker.
+    '''
+    elapsed = time.perf_counter() - tracker["start"]
+    rate = tracker["done"] / elapsed if elapsed > 0 else 0.0
+    eta = None
+    if (tracker["total"] is not None) and (rate > 0):
+        eta = max(tracker["total"] - tracker["done"], 0) / rate
+    return {"stage": tracker["name"], "status": status, "done": tracker["done"], "total": tracker["total"],
+            "unit": tracker["unit"], "per_second": round(rate, 2), "elapsed_seconds": round(elapsed, 1),
+            "eta_seconds": None if eta is None else round(eta, 1)}
+
+def report(tracker, status="running"):
+    '''
+    Print the progress of a stage and write it to the progress file.
+    '''
+    record = progress_record(tracker, status)
+    if _state["terminal"]:
+        unit = tracker["unit"]
+        if status == "running":
+            total = f"/{record['total']:,}" if record["total"] is not None else ""
+            share = f" ({100 * record['done'] / record['total']:.1f}%)" if record["total"] else ""
+            left = f", {format_seconds(record['eta_seconds'])} left" if record["eta_seconds"] is not None else ""
+            print(f"{tracker['name']}: {record['done']:,}{total} {unit}{share}, {record['per_second']:,.1f} {unit}/s{left}", flush=True)
+        elif tracker["reported"]:
+            # Stages that took less than an interval are not reported in the terminal
+            print(f"{tracker['name']}: {record['done']:,} {unit} {status} in {format_seconds(record['elapsed_seconds'])} "
+                  f"({record['per_second']:,.1f} {unit}/s)", flush=True)
+    write_line(record)
+    tracker["reported"] = True
+
+@contextmanager
+def progress(name, total=None, unit="rows"):
+    '''
+    Follow the progress of a stage of total rows (or another unit), updated with advance. The stage is reported when it
+    starts and ends, and while it runs every interval seconds.
+    '''
+    now = time.perf_counter()
+    tracker = {"name": name, "total": total, "unit": unit, "done": 0, "start": now, "last": now, "reported": False}
+    write_line(progress_record(tracker, "started"))
+    try:
+        yield tracker
+    except BaseException:
+        report(tracker, "failed")
+        raise
+    report(tracker, "done")
+
+def advance(tracker, n=1):
+    '''
+    Add n rows done to a stage followed by tracker (nothing is done if it is None), and report it if an interval has passed
+    since it was last reported. Stages can be advanced from several threads.
+    '''
+    if tracker is None:
+        return
+    due = False
+    with _lock:
+        tracker["done"] += n
+        now = time.perf_counter()
+        if ((_state["file"] is not None) or _state["terminal"]) and (now - tracker["last"] >= _state["interval"]):
+            tracker["last"] = now
+            due = True
+    if due:
+        report(tracker)
+
+def apply_with_progress(series, function, tracker=None, chunk_size=10000):
+    '''
+    Series.apply by chunks of chunk_size rows, advancing tracker after each of them.
+    '''
+    if series.shape[0] <= chunk_size:
+        result = series.apply(function)
+        advance(tracker, series.shape[0])
+        return result
+    results = []
+    for start in range(0, series.shape[0], chunk_size):
+        results.append(series.iloc[start:start + chunk_size].apply(function))
+        advance(tracker, results[-1].shape[0])
+    return pd.concat(results)
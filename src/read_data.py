@@ -0,0 +1,318 @@
+'''
+Functions to read the collection of texts to analyze, which can be split in many files. Parquet, Feather and Arrow IPC files
+(or directories with partitioned datasets) are read with pyarrow, so only the columns needed are loaded and row filters are
+applied while reading.
+'''
+
+import glob
+import operator
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Operators that can be used in row filters, "in" takes a comma separated list of values
+filter_operators = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+# Supported formats that are not read with pyarrow
+text_formats = [".jsonl", ".json", ".csv", ".xlsx", ".tsv"]
+
+columnar_formats = {
+    ".parquet": "parquet",
+    ".feather": "ipc",
+    ".arrow": "ipc",
+    ".ipc": "ipc",
+}
+
+supported_formats = text_formats + list(columnar_formats.keys())
+
+def parse_row_filter(row_filter):
+    '''
+    Convert a filter like "created_at>=2024-01-01", "stars<3" or "language in en,es" into a (column, operator, value) tuple.
+    '''
+    match = re.match(r"^\s*(.+?)\s*(==|!=|>=|<=|>|<|\sin\s)\s*(.+?)\s*$", row_filter)
+    if match is None:
+        raise Exception(f"Could not understand the filter '{row_filter}', it must be COLUMN OPERATOR VALUE with one of the operators: "
+                        + ", ".join(list(filter_operators.keys()) + ["in"]))
+    column, op, value = match.groups()
+    op = op.strip()
+    if op == "in":
+        value = [v.strip() for v in value.split(",")]
+    return (column, op, value)
+
+def arrow_value(value, field_type):
+    '''
+    Convert a value written in a filter to the type of the column it is compared with.
+    '''
+    if pa.types.is_dictionary(field_type):
+        field_type = field_type.value_type
+    if pa.types.is_timestamp(field_type):
+        timestamp = pd.Timestamp(value)
+        if (field_type.tz is not None) and (timestamp.tzinfo is None):
+            timestamp = timestamp.tz_localize(field_type.tz)
+        return pa.scalar(timestamp, type=field_type)
+    return pa.scalar(value).cast(field_type)
+
+def arrow_filter_expression(schema, row_filters):
+    '''
+    Combine the row filters into a single pyarrow expression so they are evaluated while reading the dataset.
+    '''
+    expression = None
+    for column, op, value in row_filters:
+        if column not in schema.names:
+            raise Exception(f"The column {column} used in a filter is not in the text data.")
+        field_type = schema.field(column).type
+        if op == "in":
+            condition = ds.field(column).isin(pa.array([arrow_value(v, field_type).as_py() for v in value]))
+        else:
+            condition = filter_operators[op](ds.field(column), arrow_value(value, field_type))
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def apply_row_filters(data, row_filters):
+    '''
+    Apply the row filters to a dataframe read by pandas.
+    '''
+    if len(row_filters) == 0:
+        return data
+    mask = pd.Series(True, index=data.index)
+    for column, op, value in row_filters:
+        if column not in data.columns:
+            raise Exception(f"The column {column} used in a filter is not in the text data.")
+        values = data[column]
+        if op == "in":
+            mask &= values.astype(str).isin(value)
+            continue
+        if pd.api.types.is_datetime64_any_dtype(values):
+            value = pd.Timestamp(value)
+            if (values.dt.tz is not None) and (value.tzinfo is None):
+                value = value.tz_localize(values.dt.tz)
+        elif pd.api.types.is_numeric_dtype(values):
+            value = pd.to_numeric(value)
+        mask &= filter_operators[op](values, value)
+    return data[mask.fillna(False)]
+
+def text_data_files(data_path):
+    '''
+    Get the files of the text data. data_path can be a file, a glob pattern (e.g. "exports/2024-*.jsonl", ** matches any
+    number of directories), a directory (all the files with a supported format inside it are used) or a manifest, a .manifest
+    or .txt file with one path or glob pattern per line (relative paths start from the directory of the manifest). Files
+    matched by several lines of a manifest are only read once, in the order of the first line matching them.
+    '''
+    if any(c in data_path for c in "*?["):
+        files = [f for f in glob.glob(data_path, recursive=True) if os.path.isfile(f)]
+    elif os.path.isdir(data_path):
+        files = [os.path.join(root, f) for root, _, names in os.walk(data_path) for f in names
+                 if not f.startswith((".", "_")) and len(Path(f).suffixes) > 0 and Path(f).suffixes[0] in supported_formats]
+    elif Path(data_path).suffix in (".manifest", ".txt"):
+        files = []
+        with open(data_path) as manifest:
+            for line in manifest:
+                line = line.strip()
+                if (line == "") or line.startswith("#"):
+                    continue
+                files += text_data_files(os.path.join(os.path.dirname(data_path), line))
+        return list(dict.fromkeys(os.path.normpath(f) for f in files))
+    else:
+        return [data_path]
+
+    if len(files) == 0:
+        raise Exception(f"No text data files found in {data_path}")
+    return sorted(files)
+
+def read_text_file(file_path, columns, csv_sep=",", row_filters=[]):
+    '''
+    Read the columns of a jsonl, json, csv, xlsx or tsv file and keep the rows that match the row filters.
+    '''
+    file = Path(file_path)
+    # Columns used in filters have to be read too, they are removed after filtering
+    usecols = lambda c: c in columns or c in [f[0] for f in row_filters]
+
+    # Reading data
+    match file.suffixes[0] if len(file.suffixes) > 0 else "":
+        case ".jsonl":
+            data = pd.read_json(file_path, lines=True, compression="infer")
+        case ".json":
+            data = pd.read_json(file_path, lines=False, compression="infer")
+        case ".csv":
+            data = pd.read_csv(file_path, compression="infer", sep=csv_sep, usecols=usecols)
+        case ".xlsx":
+            if len(file.suffixes) > 1:
+                if file.suffixes[-1] != ".zip":
+                    raise Exception("Excel files can only be .zip compressed or uncompressed.")
+            data = pd.read_excel(file_path)
+        case ".tsv":
+            data = pd.read_csv(file_path, compression="infer", sep="\t", usecols=usecols)
+        case _:
+            raise Exception("Only the following file formats are allowed: " + ", ".join(s[1:] for s in supported_formats))
+
+    missing = [c for c in columns if c not in data.columns]
+    if len(missing) > 0:
+        raise Exception(f"The following columns are not in {file_path}: {', '.join(missing)}")
+
+    return apply_row_filters(data, row_filters)[columns]
+
+def text_data_columns(data_path, csv_sep=","):
+    '''
+    Names of the columns of the text data, reading only the schema or the header of its first file (json files, which have
+    no header, are read completely).
+    '''
+    files = text_data_files(data_path)
+    file = Path(files[0])
+    suffix = file.suffixes[0] if len(file.suffixes) > 0 else ""
+
+    if suffix in columnar_formats:
+        if os.path.isdir(data_path):
+            return ds.dataset(data_path, format=columnar_formats[suffix], partitioning="hive").schema.names
+        return ds.dataset(files[0], format=columnar_formats[suffix]).schema.names
+
+    match suffix:
+        case ".jsonl":
+            return pd.read_json(files[0], lines=True, compression="infer", nrows=1).columns.to_list()
+        case ".json":
+            return pd.read_json(files[0], lines=False, compression="infer").columns.to_list()
+        case ".csv":
+            return pd.read_csv(files[0], compression="infer", sep=csv_sep, nrows=0).columns.to_list()
+        case ".xlsx":
+            return pd.read_excel(files[0], nrows=0).columns.to_list()
+        case ".tsv":
+            return pd.read_csv(files[0], compression="infer", sep="\t", nrows=0).columns.to_list()
+    raise Exception("Only the following file formats are allowed: " + ", ".join(s[1:] for s in supported_formats))
+
+def text_data_sample(data_path, columns, csv_sep=",", n_rows=1000):
+    '''
+    Read the first n_rows rows of the columns of the text data, from its first file for jsonl, json, csv, xlsx and tsv files
+    (json files are read completely).
+    '''
+    files = text_data_files(data_path)
+    file = Path(files[0])
+    suffix = file.suffixes[0] if len(file.suffixes) > 0 else ""
+
+    if suffix in columnar_formats:
+        if os.path.isdir(data_path):
+            dataset = ds.dataset(data_path, format=columnar_formats[suffix], partitioning="hive")
+        else:
+            dataset = ds.dataset(files, format=columnar_formats[suffix])
+        return dataset.head(n_rows, columns=[c for c in columns if c in dataset.schema.names]).to_pandas()
+
+    usecols = lambda c: c in columns
+    match suffix:
+        case ".jsonl":
+            data = pd.read_json(files[0], lines=True, compression="infer", nrows=n_rows)
+        case ".json":
+            data = pd.read_json(files[0], lines=False, compression="infer").head(n_rows)
+        case ".csv":
+            data = pd.read_csv(files[0], compression="infer", sep=csv_sep, usecols=usecols, nrows=n_rows)
+        case ".xlsx":
+            data = pd.read_excel(files[0], nrows=n_rows)
+        case ".tsv":
+            data = pd.read_csv(files[0], compression="infer", sep="\t", usecols=usecols, nrows=n_rows)
+        case _:
+            raise Exception("Only the following file formats are allowed: " + ", ".join(s[1:] for s in supported_formats))
+    return data[[c for c in data.columns if c in columns]]
+
+def read_fragment(fragment, schema, partition_columns, columns, expression):
+    '''
+    Read the columns of a file of a pyarrow dataset checking they have the same types as in the rest of the dataset.
+    '''
+    for c in columns:
+        if c in partition_columns:
+            continue
+        if c not in fragment.physical_schema.names:
+            raise Exception(f"The column {c} is not in {fragment.path}")
+        if not fragment.physical_schema.field(c).type.equals(schema.field(c).type):
+            raise Exception(f"The column {c} is {fragment.physical_schema.field(c).type} in {fragment.path} "
+                            f"but {schema.field(c).type} in the rest of the text data.")
+    return fragment.to_table(schema=schema, columns=columns, filter=expression)
+
+def dtype_kind(series):
+    '''
+    Kind of data in a column used to check the files of the text data are consistent, integers and floats are compatible.
+    '''
+    if series.isna().all():
+        return None
+    if pd.api.types.is_bool_dtype(series):
+        return "boolean"
+    if pd.api.types.is_numeric_dtype(series):
+        return "numeric"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    return "text"
+
+def check_consistent_columns(shards, files):
+    '''
+    Raise an exception if a column has different kinds of data in the files of the text data.
+    '''
+    kinds = {}
+    for shard, file_path in zip(shards, files):
+        for c in shard.columns:
+            kind = dtype_kind(shard[c])
+            if kind is None:
+                continue
+            if c not in kinds:
+                kinds[c] = (kind, file_path)
+            elif kinds[c][0] != kind:
+                raise Exception(f"The column {c} contains {kind} data in {file_path} but {kinds[c][0]} data in {kinds[c][1]}.")
+
+def read_text_data(data_path, text_column, columns_to_keep=[], csv_sep=",", row_filters=[], workers=8):
+    '''
+    Read the text column and the columns to keep of the text data (see text_data_files). Files can be jsonl, json, csv, xlsx, tsv,
+    parquet, feather or arrow files, directories of parquet or arrow files can be hive partitioned. Row filters are
+    (column, operator, value) tuples, in parquet, feather and arrow files they are pushed down to the reader so the row groups and
+    partitions that do not match are skipped. When there is more than one file they are read in parallel by WORKERS threads and
+    the path of the file each row comes from is kept in the source_file column.
+    '''
+    columns = list(dict.fromkeys([text_column] + columns_to_keep))
+    files = text_data_files(data_path)
+    formats = {columnar_formats.get(Path(f).suffixes[0] if len(Path(f).suffixes) > 0 else "") for f in files}
+    single_file = (files == [data_path]) and os.path.isfile(data_path)
+
+    # Columnar formats, only the columns needed are read
+    if formats in ({"parquet"}, {"ipc"}):
+        if os.path.isdir(data_path):
+            dataset = ds.dataset(data_path, format=formats.pop(), partitioning="hive")
+        else:
+            dataset = ds.dataset(files, format=formats.pop())
+        missing = [c for c in columns if c not in dataset.schema.names]
+        if len(missing) > 0:
+            raise Exception(f"The following columns are not in the text data: {', '.join(missing)}")
+        expression = arrow_filter_expression(dataset.schema, row_filters)
+        partition_columns = dataset.partitioning.schema.names if dataset.partitioning is not None else []
+
+        # Files whose partition does not match the filters are not read
+        fragments = list(dataset.get_fragments(filter=expression))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            tables = list(executor.map(lambda f: read_fragment(f, dataset.schema, partition_columns, columns, expression), fragments))
+
+        # Zero-copy concatenation of the tables of every file
+        data = pa.concat_tables(tables).to_pandas() if len(tables) > 0 else dataset.schema.empty_table().select(columns).to_pandas()
+        files = [f.path for f in fragments]
+        lengths = [t.num_rows for t in tables]
+    elif len(formats) > 1:
+        raise Exception("Parquet and arrow files can not be mixed with each other or with other formats in the text data.")
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            shards = list(executor.map(lambda f: read_text_file(f, columns, csv_sep=csv_sep, row_filters=row_filters), files))
+        check_consistent_columns(shards, files)
+        data = pd.concat(shards, ignore_index=True)
+        lengths = [len(s) for s in shards]
+
+    if single_file:
+        return data
+
+    # Provenance of every row, stored as a categorical so each path is only kept once in memory
+    data["source_file"] = pd.Categorical.from_codes(np.repeat(np.arange(len(files)), lengths), categories=files)
+
+    return data
@@ -0,0 +1,124 @@
+'''
+NLTK data and Hugging Face models used by the pipeline. Stopwords are read from disk once per process and kept as frozensets,
+and an offline bundle (a directory with the NLTK data and the snapshots of the models) lets the pipeline run on machines
+without internet access. The bundle is filled ahead of time on a machine with internet access with:
+
+    python -m src.resources prefetch -bundle offline_bundle -lang english -lang spanish -mo social_media
+
+and used with the --offline_bundle argument of LinguaLoupe.py, or by calling use_offline_bundle before loading any model.
+'''
+
+import argparse
+import os
+import sys
+from functools import lru_cache
+
+from src.sentiment import classification_model_name, tokenizer_model_name
+from src.language import detectable_languages, mixed_language
+from src.get_topics import embedding_model_name
+# nltk, transformers and huggingface_hub are imported by the functions that use them since they are slow to import.
+
+def bundle_paths(bundle_directory):
+    '''
+    Directories of the NLTK data and of the Hugging Face cache inside an offline bundle.
+    '''
+    return os.path.join(bundle_directory, "nltk_data"), os.path.join(bundle_directory, "huggingface")
+
+def use_offline_bundle(bundle_directory):
+    '''
+    Read the NLTK data and the models from an offline bundle filled by prefetch, without connecting to the Hugging Face Hub.
+    It has to be called before transformers, sentence_transformers or huggingface_hub are imported, since they read the
+    location of their cache when they are imported.
+    '''
+    if not os.path.isdir(bundle_directory):
+        raise FileNotFoundError(f"The offline bundle {bundle_directory} does not exist, create it with: python -m src.resources prefetch -bundle {bundle_directory}")
+    nltk_directory, huggingface_directory = bundle_paths(bundle_directory)
+    # nltk.data.path is built from NLTK_DATA when nltk is imported, so the bundle is found however nltk is imported later
+    os.environ["NLTK_DATA"] = os.pathsep.join([nltk_directory] + [p for p in os.environ.get("NLTK_DATA", "").split(os.pathsep) if p != ""])
+    if "nltk.data" in sys.modules:
+        sys.modules["nltk.data"].path.insert(0, nltk_directory)
+    os.environ["HF_HOME"] = huggingface_directory
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    stopword_set.cache_clear()
+
+def offline():
+    '''
+    Whether the Hugging Face Hub and the NLTK downloader must not be used.
+    '''
+    return os.environ.get("HF_HUB_OFFLINE", "0") not in ("0", "", "false", "False")
+
+def install_stopwords():
+    '''
+    Check if user has nltk.corpus.stopwords installed and, if not, install it. Only the location of the corpus is looked up,
+    the stopwords are read when they are first used.
+    '''
+    import nltk
+
+    try:
+        nltk.data.find("corpora/stopwords")
+    except LookupError:
+        if offline():
+            raise LookupError("The nltk stopwords are not installed and the pipeline is offline, add them to the offline bundle with: python -m src.resources prefetch")
+        nltk.download("stopwords", quiet=True)
+
+@lru_cache(maxsize=None)
+def stopword_set(languages):
+    '''
+    Frozenset with the nltk stopwords of a language, or of several languages given as a tuple, read from disk only the first
+    time they are asked for in each process.
+    '''
+    from nltk.corpus import stopwords
+
+    return frozenset(stopwords.words(languages if isinstance(languages, str) else list(languages)))
+
+def stopwords_for(lang):
+    '''
+    Stopwords of the language, or list of languages, of the report.
+    '''
+    return stopword_set(lang if isinstance(lang, str) else tuple(lang))
+
+def model_names(languages=["english"], model_types=["social_media"]):
+    '''
+    Names of the Hugging Face models the pipeline loads for some languages and model types: the sentiment models, the tokenizers
+    used to count tokens and the embedding models of the topic models. "auto" stands for every detectable language.
+    '''
+    if "auto" in languages:
+        languages = list(dict.fromkeys([l for l in languages if l != "auto"] + detectable_languages + [mixed_language]))
+    names = []
+    for language in languages:
+        for model_type in model_types:
+            names += [classification_model_name(language, model_type), tokenizer_model_name(language, model_type)]
+        names.append(embedding_model_name(language))
+    return list(dict.fromkeys(names))
+
+def prefetch(bundle_directory, languages=["english"], model_types=["social_media"]):
+    '''
+    Download the nltk stopwords and the snapshots of the models used for some languages and model types into an offline bundle.
+    Returns the names of the models downloaded.
+    '''
+    import nltk
+    from huggingface_hub import snapshot_download
+
+    nltk_directory, huggingface_directory = bundle_paths(bundle_directory)
+    os.makedirs(nltk_directory, exist_ok=True)
+    if not nltk.download("stopwords", download_dir=nltk_directory, quiet=True):
+        raise RuntimeError("Could not download the nltk stopwords")
+
+    names = model_names(languages, model_types)
+    for name in names:
+        print(f"Downloading {name}...")
+        # Same layout as the cache of HF_HOME, so the models are found by name once HF_HOME points to the bundle
+        snapshot_download(name, cache_dir=os.path.join(huggingface_directory, "hub"))
+    return names
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["prefetch"], help="prefetch: download the nltk data and models into BUNDLE.")
+    parser.add_argument("-bundle", "--bundle", type=str, default="offline_bundle", help="Directory of the offline bundle, offline_bundle by default.")
+    parser.add_argument("-lang", "--language", action="append", default=[], help="Language whose models are downloaded ('english', 'spanish', ... or 'auto' for every language LANGUAGE 'auto' can detect), english by default. This parameter can be specified more than once.")
+    parser.add_argument("-mo", "--model_type", action="append", default=[], help="Model type whose sentiment models are downloaded ('social_media' or 'general'), social_media by default. This parameter can be specified more than once.")
+    args = parser.parse_args()
+
+    names = prefetch(args.bundle, languages=args.language or ["english"], model_types=args.model_type or ["social_media"])
+    print(f"Saved the nltk stopwords and {len(names)} models in {args.bundle}")
@@ -1,50 +1,274 @@
 '''
 This script contains the function necessary to process texts and classify them based on wether they are positive, neutral or negative.
 '''
-import os
-from pathlib import Path
 
-from transformers import AutoTokenizer
-import statistics
+import numpy as np
 import pandas as pd
-from src.sentiment import load_classification_model, classify_text_sentiment, classify_text_no_english
+from src.sentiment import load_classification_model, classify_texts, sentiment_labels, classification_model_name, tokenizer_model_name, set_torch_threads
+from src.language import detect_languages, detectable_languages
+from src.read_data import read_text_data, apply_row_filters
+from src.metrics import stage, add_time, count, counters_snapshot, counter_changes, merge_counters
+from src.executors import partition_bounds, map_partitions, shares_process
+from src.progress import progress, advance, apply_with_progress
+from src.cascade import cascade_classify
+from src.get_topics import emotion_order
+import time
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 from bs4 import BeautifulSoup
 
 def clean_html(text):
     return BeautifulSoup(text, "html.parser").get_text()
 
+def load_tokenizer(language = "english", m_type = "social_media"):
+    '''
+    Load the tokenizer of the sentiment classification model, transformers is imported here since it is slow to import.
+    '''
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(tokenizer_model_name(language, m_type), use_fast=True)
+
+def load_sentiment_models(language = "english", m_type = "social_media"):
+    '''
+    Load the sentiment classification model of a language and model type and its tokenizer.
+    '''
+    with stage("model_loading"):
+        return load_classification_model(language=language, model_type=m_type), load_tokenizer(language, m_type)
+
+# Models loaded by the workers classifying partitions, kept so every model is loaded once per worker
+_worker_models = {}
+_worker_models_lock = threading.Lock()
+
+def worker_sentiment_models(language = "english", m_type = "social_media"):
+    '''
+    Sentiment model and tokenizer of a language and model type, loaded the first time a worker asks for them.
+    '''
+    with _worker_models_lock:
+        if (language, m_type) not in _worker_models:
+            _worker_models[(language, m_type)] = load_sentiment_models(language, m_type)
+        return _worker_models[(language, m_type)]
+
+def emotion_categorical(emotions):
+    '''
+    Categorical of an array of emotions, with the emotions found in the same order as in the categorical returned by vote_chunks.
+    '''
+    found = set(emotions)
+    categories = [e for e in emotion_order if e in found] + sorted(found.difference(emotion_order))
+    return pd.Categorical(emotions, categories=categories)
+
+def chunk_label_names():
+    '''
+    Emotion chosen for every combination of labels drawn in the vote of the chunks of a text. Combinations are bit masks of
+    the positions of the labels in sentiment_labels, e.g. 5 (NEGATIVE and POSITIVE) is NEGATIVE-POSITIVE. MIXED is read as
+    NEGATIVE-POSITIVE.
+    '''
+    names = []
+    for mask in range(1 << len(sentiment_labels)):
+        drawn = [l for i, l in enumerate(sentiment_labels) if (mask >> i) & 1]
+        names.append("NEGATIVE-POSITIVE" if "MIXED" in drawn else "-".join(drawn))
+    return names
+
+def vote_chunks(doc_ids, label_ids, scores, n_docs):
+    '''
+    Choose the emotion of each text from the classifications of its chunks, given as flat arrays with the text, label id
+    and score of every chunk. The label chosen the most wins, draws are joined (e.g. NEGATIVE-POSITIVE) and the score is the mean
+    score of the chunks of the chosen label (the mean of the scores of the labels drawn in case of a draw). Returns the emotions
+    as a categorical, with the emotions found in the order of emotion_order, and an array with the scores.
+    '''
+    n_labels = len(sentiment_labels)
+    # Votes and sum of scores of every label of every text, in a single pass over all chunks
+    keys = doc_ids.astype(np.int64) * n_labels + label_ids
+    votes = np.bincount(keys, minlength=n_docs * n_labels).reshape(n_docs, n_labels)
+    score_sums = np.bincount(keys, weights=scores, minlength=n_docs * n_labels).reshape(n_docs, n_labels)
+
+    chosen = votes == votes.max(axis=1, keepdims=True)
+    mean_scores = np.divide(score_sums, votes, out=np.zeros_like(score_sums), where=votes > 0)
+    doc_scores = ((mean_scores * chosen).sum(axis=1) / chosen.sum(axis=1)).astype(np.float32)
+
+    # Each combination of chosen labels is converted into the code of its emotion
+    masks = (chosen * (1 << np.arange(n_labels))).sum(axis=1)
+    names = chunk_label_names()
+    categories = [e for e in emotion_order if e in names] + sorted(set(names).difference(emotion_order))
+    codes = np.array([categories.index(n) for n in names], dtype=np.int8)[masks]
+    emotions = pd.Categorical.from_codes(codes, categories=categories).remove_unused_categories()
+    return emotions, doc_scores
+
+def classify_emotions(texts, model, tokenizer, language = "english", m_type = "social_media", divide_in_chunks = 512,
+                      batch_size = 32, block_size = 4096, tracker = None):
+    '''
+    Classify a series of texts into emotions with a model and tokenizer already loaded. Texts are tokenized and classified in
+    blocks of block_size texts, which the model processes in batches of batch_size, and the progress tracker (see
+    src.progress) is advanced after each block. Returns the emotions as a categorical and an array with their scores.
+    '''
+    def classify_block(texts, first_doc):
+        '''
+        Classify a block of texts. Texts longer than 512 tokens are divided in chunks of divide_in_chunks characters and every
+        chunk is classified. Returns flat arrays with the text (counting from first_doc), label id and score of each chunk.
+        '''
+        start = time.perf_counter()
+        n_tokens = [len(ids) for ids in tokenizer(texts)["input_ids"]]
+        add_time("classification.tokenization", time.perf_counter() - start, rows=len(texts))
+
+        doc_ids = []
+        chunks = []
+        for i, text in enumerate(texts):
+            if (n_tokens[i] > 512) and (divide_in_chunks is not None):
+                c = 0
+                for j in range(0, len(text), divide_in_chunks):
+                    if (j + divide_in_chunks) < (len(text) - 1):
+                        chunks.append(text[j:j + divide_in_chunks])
+                        c += 1
+                # Texts too short to fill a chunk are classified whole
+                if c == 0:
+                    chunks.append(text)
+                    c = 1
+                doc_ids += [first_doc + i] * c
+                count("texts_divided_in_chunks")
+                count("chunks_classified", c)
+            else:
+                chunks.append(text)
+                doc_ids.append(first_doc + i)
+
+        start = time.perf_counter()
+        label_ids, scores = classify_texts(chunks, model, language=language, model_type=m_type, batch_size=batch_size)
+        add_time("classification.model", time.perf_counter() - start, rows=len(chunks))
+        return np.array(doc_ids, dtype=np.int64), label_ids, scores
+
+    # Texts are classified by blocks, the results of every chunk are kept in flat arrays and combined afterwards
+    results = []
+    for first_doc in range(0, texts.shape[0], block_size):
+        results.append(classify_block(texts.iloc[first_doc:first_doc + block_size].to_list(), first_doc))
+        advance(tracker, min(block_size, texts.shape[0] - first_doc))
+    if len(results) > 0:
+        doc_ids, label_ids, scores = (np.concatenate(r) for r in zip(*results))
+    else:
+        doc_ids, label_ids, scores = np.array([], dtype=np.int64), np.array([], dtype=np.int8), np.array([], dtype=np.float32)
+
+    if doc_ids.shape[0] > texts.shape[0]:
+        warnings.warn(f"Found texts with more than 512 tokens, they have been divided into chunks of {divide_in_chunks} characters. "
+                      "After classifiying each chunk the predominant emotion has been selected.")
+
+    return vote_chunks(doc_ids, label_ids, scores, texts.shape[0])
+
+def classify_emotions_by_language(texts, languages, m_type = "social_media", divide_in_chunks = 512, batch_size = 32,
+                                  block_size = 4096, load_models = load_sentiment_models, tracker = None):
+    '''
+    Classify a series of texts into emotions with the sentiment model of the language of each text, given as a categorical.
+    Texts are grouped by the model of their language (languages without a model of their own share the multilingual one), each
+    group is classified in its own batches in a thread of its own and the results are merged back in the order of the texts.
+    The model and tokenizer of each group are loaded with load_models, and every group advances the same progress tracker.
+    Returns the emotions as a categorical and an array with their scores.
+    '''
+    languages = pd.Categorical(languages)
+    groups = {}
+    for code, language in enumerate(languages.categories):
+        positions = np.flatnonzero(languages.codes == code)
+        if positions.shape[0] == 0:
+            continue
+        count(f"texts_in_{language}", positions.shape[0])
+        # The first language of each model is the one it is loaded and used with
+        group = groups.setdefault(classification_model_name(language, m_type), {"language": language, "positions": []})
+        group["positions"].append(positions)
+
+    def classify_group(group):
+        positions = np.sort(np.concatenate(group["positions"]))
+        model, tokenizer = load_models(group["language"], m_type)
+        emotions, scores = classify_emotions(texts.iloc[positions], model, tokenizer, language=group["language"], m_type=m_type,
+                                             divide_in_chunks=divide_in_chunks, batch_size=batch_size, block_size=block_size,
+                                             tracker=tracker)
+        return positions, emotions, scores
+
+    emotions = np.empty(texts.shape[0], dtype=object)
+    scores = np.zeros(texts.shape[0], dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=max(len(groups), 1)) as executor:
+        for positions, group_emotions, group_scores in executor.map(classify_group, groups.values()):
+            emotions[positions] = np.asarray(group_emotions, dtype=object)
+            scores[positions] = group_scores
+
+    return emotion_categorical(emotions), scores
+
+def classify_partition(texts, language = "english", m_type = "social_media", divide_in_chunks = 512, batch_size = 32,
+                       block_size = 4096, threads = None):
+    '''
+    Classify a partition of the texts in a worker of an executor, which loads the models the first time it needs them and runs
+    them with threads torch threads. If language is "auto" the language of each text is detected first. Returns the emotions and
+    the languages of the texts (None unless language is "auto") as arrays, the scores and the counters changed, so they can be
+    gathered from other processes.
+    '''
+    counters = counters_snapshot()
+    set_torch_threads(threads)
+    languages = None
+    if language == "auto":
+        languages = detect_languages(texts)
+        emotions, scores = classify_emotions_by_language(texts, languages, m_type=m_type, divide_in_chunks=divide_in_chunks,
+                                                         batch_size=batch_size, block_size=block_size,
+                                                         load_models=worker_sentiment_models)
+        languages = np.asarray(languages, dtype=object)
+    else:
+        model, tokenizer = worker_sentiment_models(language, m_type)
+        emotions, scores = classify_emotions(texts, model, tokenizer, language=language, m_type=m_type,
+                                             divide_in_chunks=divide_in_chunks, batch_size=batch_size, block_size=block_size)
+    return np.asarray(emotions, dtype=object), languages, scores, counter_changes(counters)
+
+def classify_partitions(texts, executor, language = "english", m_type = "social_media", divide_in_chunks = 512, batch_size = 32,
+                        block_size = 4096, partition_size = 50000, threads = None, tracker = None):
+    '''
+    Classify a series of texts into emotions by partitions of partition_size texts mapped over an executor (see
+    src.executors.open_executor), advancing the progress tracker as each partition is gathered. Returns the emotions as a
+    categorical, an array with their scores and, if language is "auto", the language of each text as a categorical (None
+    otherwise).
+    '''
+    partitions = [texts.iloc[start:end] for start, end in partition_bounds(texts.shape[0], partition_size)]
+    results = map_partitions(executor, classify_partition, partitions, language, m_type, divide_in_chunks, batch_size, block_size,
+                             threads, tracker=tracker)
+    # Models loaded by threads of this process are not needed anymore
+    with _worker_models_lock:
+        _worker_models.clear()
+
+    if len(results) == 0:
+        return emotion_categorical(np.array([], dtype=object)), np.array([], dtype=np.float32), None
+    if not shares_process(executor):
+        for r in results:
+            merge_counters(r[3])
+    emotions = emotion_categorical(np.concatenate([r[0] for r in results]))
+    scores = np.concatenate([r[2] for r in results])
+    languages = None
+    if language == "auto":
+        languages = pd.Categorical(np.concatenate([r[1] for r in results]), categories=detectable_languages)
+    return emotions, scores, languages
+
 def process_reviews(data_path, text_column, csv_sep = ",",
                     min_rows_to_parallelize = 10000, cancel_parallelisation = False, columns_to_keep = [],
                     convert_to_string = False, divide_in_chunks = 512, language = "english", m_type="social_media",
-                    clean_html_text = True):
+                    clean_html_text = True, row_filters = [], read_workers = 8, batch_size = 32, block_size = 4096,
+                    executor = None, partition_size = 50000, threads = None, cascade_threshold = None, cascade_train_size = 5000):
     '''
-    A function in charge of classifiying texts into positive, negative, or neutral.
+    A function in charge of classifiying texts into positive, negative, or neutral. Row filters are (column, operator, value)
+    tuples used to select the texts to classify. data_path can also be a glob pattern, a directory or a manifest, their files are
+    read by read_workers threads and the file each text comes from is kept in the source_file column. Texts are tokenized and
+    classified in blocks of block_size texts, which the model processes in batches of batch_size with threads torch threads
+    (the default of torch if None). If language is "auto" the language of each text is detected, kept in the language column,
+    and each text is classified with the model of its language. If an executor is given (see src.executors.open_executor),
+    texts are classified by partitions of partition_size texts in its workers. If cascade_threshold is given, a linear model
+    trained on the emotions of cascade_train_size texts labels the texts it is that confident about and only the rest are
+    classified by the sentiment models (see src.cascade). The statistics of the cascade are kept in the "cascade" entry of the
+    attrs of the dataframe returned.
     '''
-     # Checking if data is in dataframe format or instead is a path to a file or url
+    # Checking if data is in dataframe format or instead is a path to a file or directory
     if isinstance(data_path, str):
-        # Geting file sufix to determine how to import data to python
-        file = Path(data_path)
-        # Reading data
-        match file.suffixes[0]:
-            case ".jsonl":
-                data = pd.read_json(data_path, lines=True, compression="infer")
-            case ".json":
-                data = pd.read_json(data_path, lines=False, compression="infer")
-            case ".csv":
-                data = pd.read_csv(data_path, compression="infer", sep=csv_sep)
-            case ".xlsx":
-                if len(file.suffixes) > 1:
-                    if file.suffixes[-1] != ".zip":
-                        raise Exception("Excel files can only be .zip compressed or uncompressed.")
-                data = pd.read_excel(data_path)
-            case ".tsv":
-                data = pd.read_csv(data_path, compression="infer", sep="\t")
-            case _:
-                raise Exception("Only the following file formats are allowed: jsonl, json, csv, xlsx, tsv")
+        # Only the text column and the columns to keep are read, filters are applied while reading when possible
+        with stage("reading") as reading:
+            data = read_text_data(data_path, text_column, columns_to_keep=columns_to_keep, csv_sep=csv_sep, row_filters=row_filters,
+                                  workers=read_workers)
+            reading["rows"] = data.shape[0]
+        # Keeping the provenance of texts read from more than one file
+        if ("source_file" in data.columns) and ("source_file" not in columns_to_keep):
+            columns_to_keep = columns_to_keep + ["source_file"]
     elif isinstance(data_path, pd.DataFrame):
-        data = data_path.copy()
+        # Only the columns used are taken from the dataframe, so it is not modified and the rest of its columns are not copied
+        data = apply_row_filters(data_path, row_filters)[list(dict.fromkeys([text_column] + columns_to_keep))]
     else:
         raise TypeError("data_path can only be a string or a pandas dataframe")
 
@@ -57,106 +281,66 @@ def process_reviews(data_path, text_column, csv_sep = ",",
         
     # Cleaning html from text column unless specified otherwise
     if clean_html_text == True:
-        data[text_column] = data[text_column].apply(clean_html)
+        with stage("html_cleaning", rows=data.shape[0]), progress("html_cleaning", total=data.shape[0]) as tracker:
+            data[text_column] = apply_with_progress(data[text_column], clean_html, tracker)
 
     # Removing texts that do not contain at least one alphabetic character, or are NA.
+    rows_before_filter = data.shape[0]
     data = data[data[text_column].str.contains(r"[A-Za-z]", na=False)]
+    count("rows_without_text", rows_before_filter - data.shape[0])
 
-    # loading model
-    model = load_classification_model(language=language, model_type=m_type)
-
-    # Loading appropiate tokenizer just to check if the length of the text to classify exceeds 512.
-    if language == "english":
-        if m_type == "social_media":
-            tokenizer = AutoTokenizer.from_pretrained("cardiffnlp/twitter-roberta-base-sentiment", use_fast=True)
-        else:
-            tokenizer = AutoTokenizer.from_pretrained("siebert/sentiment-roberta-large-english", use_fast=True)
-    else:
-        tokenizer = AutoTokenizer.from_pretrained("pysentimiento/robertuito-sentiment-analysis", use_fast=True)
-        
+    # Texts are kept in a single arrow buffer instead of one python object per text
+    data[text_column] = data[text_column].astype("string[pyarrow]")
 
-    # Decide wether to use text classification based on pysentimiento or Roberta.
+    texts = data[text_column]
+    languages = None
+    # Languages are detected by the workers of the executor, unless the cascade needs the language of every text first
+    if (language == "auto") and ((executor is None) or (cascade_threshold is not None)):
+        with stage("language_detection", rows=data.shape[0]):
+            languages = detect_languages(texts)
+    if (executor is None) and (language != "auto"):
+        # Loading model and the appropiate tokenizer just to check if the length of the text to classify exceeds 512.
+        model, tokenizer = load_sentiment_models(language, m_type)
+    set_torch_threads(threads)
 
-    def classify(text_to_classify):
+    def classify(positions = None, tracker = None):
         '''
-        Classify text into POSITIVE, NEGATIVE, or NEUTRAL using either pysentimiento or cardiffnlp/twitter-roberta-base-sentiment
+        Classify the texts at some positions (every text if None) with the sentiment models. Returns their emotions, their
+        scores and, if they are detected by the workers of the executor, their languages (None otherwise).
         '''
+        subset = texts if positions is None else texts.iloc[positions]
+        if executor is not None:
+            return classify_partitions(subset, executor, language=language, m_type=m_type, divide_in_chunks=divide_in_chunks,
+                                       batch_size=batch_size, block_size=block_size, partition_size=partition_size, threads=threads,
+                                       tracker=tracker)
+        if language == "auto":
+            # Classify the texts of each language into emotions with the model of their language
+            subset_languages = languages if positions is None else languages[positions]
+            return *classify_emotions_by_language(subset, subset_languages, m_type=m_type, divide_in_chunks=divide_in_chunks,
+                                                  batch_size=batch_size, block_size=block_size, tracker=tracker), None
+        return *classify_emotions(subset, model, tokenizer, language=language, m_type=m_type, divide_in_chunks=divide_in_chunks,
+                                  batch_size=batch_size, block_size=block_size, tracker=tracker), None
 
-        if language == "english":
-            return classify_text_sentiment(text_to_classify, model, model_type=m_type)
-        
-        return classify_text_no_english(text_to_classify, model, language, model_type=m_type)
+    # Classify texts into emotions
+    cascade_statistics = None
+    with stage("classification", rows=data.shape[0]), progress("classification", total=data.shape[0]) as tracker:
+        if cascade_threshold is None:
+            emotions, emotion_scores, found_languages = classify(tracker=tracker)
+            languages = found_languages if languages is None else languages
+        else:
+            emotions, emotion_scores, cascade_statistics = cascade_classify(texts, lambda positions, tracker: classify(positions, tracker)[:2],
+                                                                            threshold=cascade_threshold, train_size=cascade_train_size,
+                                                                            tracker=tracker)
+            emotions = emotion_categorical(emotions)
 
-    def classify_sentiments(text):
-        '''
-        Function that performs Sentiment classification.
-        '''
-        
-        # If the size of the text is bigger than what ROBERTA can take,
-        # split it.
-        tokenized_text = tokenizer(text)["input_ids"]
-        t_size = len(tokenized_text)
-        if (t_size > 512) and (divide_in_chunks is not None):
-            labels_to_numbers = {
-                "NEGATIVE": 0,
-                "NEUTRAL": 1,
-                "POSITIVE": 2,
-                "MIXED": 3
-            }
-            # To know which classification has been selected the most, a list with 3 zeros has been created, each
-            # corresponding to a sentiment (negative, neutral and positive). Everytime a classification is made,
-            # 1 is added to the corresponding indes. Once all classifications have been made, it is just a mater of selecting the biggest
-            # number
-            sents = [0, 0, 0, 0]
-            scores = [[], [], [], []]
-            c = 0
-            for i in range(0, len(text), divide_in_chunks):
-                if (i + divide_in_chunks) < (len(text) - 1):
-                    classification = classify(text[i:i + divide_in_chunks])
-                    index_list = labels_to_numbers[classification["label"]]
-                    sents[index_list] += 1
-                    scores[index_list].append(classification["score"])
-                    c += 1
-            if c > 1:
-                warnings.warn(f"Found a text with more than 512 tokens ({t_size} tokens), the text will be divided into chunks of {divide_in_chunks}. After classifiying each chunk the predominant emotion will be selected.")
-            # Finding predominant emotion
-            max_sentiment = max(sents)
-            chosen_sentiments = []
-            for i in range(0, len(sents)):
-                if sents[i] == max_sentiment:
-                    chosen_sentiments.append(i)
-            # Computing and returning result, the reason why it is a list of list and not a single list
-            # is in case of draws between emotions.
-            result_sents = []
-            result_scores = []
-            for i in chosen_sentiments:
-                result_sents.append(list(labels_to_numbers.keys())[i])
-                result_scores.append(statistics.mean(scores[i]))
-            if "MIXED" not in result_sents:
-                return ['-'.join(result_sents), result_scores]
-            return ["NEGATIVE-POSITIVE", result_scores]
-        # If the text has less than 512 tokens, just classify the whole text with Roberta.
-        # The scores are returned in a list for consistency with the results of text with
-        # a high ammount of tokens.
-        sentiment = classify(text)
-        return [sentiment["label"], [sentiment["score"]]]
-
-    # Classify texts into emotions.
-    data["review_emotion"] = data[text_column].apply(classify_sentiments)
-
-    # Dividing review emotion into two columns, one with the label assifgned by classify_text_sentiment and the
-    # other with the score assigned to the classification.
-
-    data["emotion"] = data["review_emotion"].str[0]
-    data["emotion_score"] = data["review_emotion"].str[1]
-
-    # Removing column review_emotion since it is redundant.
-    data.drop("review_emotion", axis=1, inplace=True)
-
-    # Renaming text column so it its name can be used in other functions of the pipeline
-    data = data.rename(columns = {text_column: "text"})
-
-    # Selecting only columns of interest
-    data = data[["text","emotion", "emotion_score"] + columns_to_keep]
-
-    return data
\ No newline at end of file
+    # Selecting only columns of interest, the text column is renamed so its name can be used in other functions of the pipeline.
+    # The arrays of the columns are used as they are instead of copying them.
+    columns = {"text": data[text_column].array, "emotion": emotions, "emotion_score": emotion_scores}
+    if language == "auto":
+        columns["language"] = languages
+    for c in columns_to_keep:
+        columns[c] = data[c].array
+    reviews = pd.DataFrame(columns, copy=False)
+    if cascade_statistics is not None:
+        reviews.attrs["cascade"] = cascade_statistics
+    return reviews
\ No newline at end of file
@@ -2,72 +2,247 @@
 Script containing a function for running the whole LinguaLoupe pipeline.
 '''
 
-from src.reviews import process_reviews
-from src.get_topics import review_topics
-from src.collect_information import summerize_information
+from src.reviews import process_reviews, load_sentiment_models
+from src.get_topics import review_topics, save_topic_models, load_topic_models, read_models_manifest
+from src.collect_information import summerize_information, summarize_breakdowns
 from src.generate_report import generate_report
+from src.save_results import save_table, load_table
+from src.metrics import start_metrics, stage, write_metrics
+from src.progress import start_progress, finish_progress
+from src.sentiment import classification_model_name
+from src.language import collection_language, stopword_language
+from src.trends import trend_statistics, save_trends, read_trends
+from src.executors import open_executor
+from src.autotune import tuned_settings
+from src.read_data import text_data_sample
 import pandas as pd
 import os
 
+def emotion_topic_labels(emotion, topic):
+    '''
+    Label each text with its emotion and topic (e.g. POSITIVE_3) as a categorical, so each label is only created once instead
+    of once per text.
+    '''
+    pairs = pd.DataFrame({"emotion": emotion.astype("category").cat.codes, "topic": topic}, copy=False)
+    codes, unique_pairs = pd.MultiIndex.from_frame(pairs).factorize()
+    categories = emotion.astype("category").cat.categories
+    labels = [f"{categories[e]}_{t}" for e, t in unique_pairs]
+    return pd.Categorical.from_codes(codes, categories=labels)
+
 def run_sentiment_pipeline(text_data, title, text_col, cols_keep_text,
                            count_text_group, mean_text_cols, sum_text_cols,
                            output_directory, csv_sep, min_rows_par, cancel_par, ch_size, m_topic_size, lang, umap_colour = ["emotion"],
                            umap_metric="cosine", umap_neighbours = 15, umap_minimum_distance = 0.1, model_type = "social_media",
                            n_neighbours_BERTopic = 15, umap_n_components_BERTopic = 5, low_memory_BERTopic = True,
-                           clean_html = True):
+                           clean_html = True, scalable_umap = False, umap_sample_size = 50000, umap_max_points = 100000,
+                           plotly_js = "embed", table_mode = "inline", table_shard_size = 5000,
+                           report_workers = 1, summary_breakdowns = [], output_format = "csv", output_compression = None,
+                           row_filters = [], read_workers = 8, profile = False, time_column = None, window = "D",
+                           rolling_windows = 1, executor_backend = None, workers = None, scheduler_address = None,
+                           partition_size = 50000, batch_size = 32, threads = None, autotune = False, memory_budget = None,
+                           autotune_cache = None, show_progress = True, progress_file = None, progress_interval = 10.0,
+                           cascade_threshold = None, cascade_train_size = 5000):
     '''
-    Run LinguaLoupe pipeline
+    Run LinguaLoupe pipeline. The time, rows per second and memory of each stage are written to metrics.json in the output
+    directory, if profile is True a cProfile dump of each stage is saved in output_directory/profiles too. If lang is "auto" the
+    language of each text is detected and the topic models and the report use the language found, or a multilingual embedding
+    model and the stopwords of every language found if there is more than one. If time_column is given, the emotions, scores
+    and global topics of the texts are counted per time window of that column, saved in Emotion_Trends and Topic_Trends and
+    shown as trends in the report. If executor_backend is given ("thread", "process" or "dask", see src.executors) the texts are
+    classified and embedded by partitions of partition_size texts in its workers, and gathered here to be saved as in any run.
+    The sentiment model classifies batches of batch_size texts with threads torch threads. If autotune is True, they (and the
+    workers of a process executor or a local dask cluster if workers is None) are calibrated on a sample of the texts within
+    memory_budget GB (see src.autotune), or read from autotune_cache if this machine and model have already been calibrated.
+    Every progress_interval seconds the rows done, rows/sec and time left of the stage running are printed if show_progress is
+    True and written to progress_file as json lines if it is given (see src.progress). If cascade_threshold is given, texts a
+    linear model trained on cascade_train_size texts classified by the sentiment model is that confident about are labelled by
+    it instead (see src.cascade), and its agreement with the sentiment model and the speedup are printed and saved in
+    metrics.json.
     '''
+    start_metrics(profile_directory=os.path.join(output_directory, "profiles") if profile else None)
+    start_progress(progress_file, interval=progress_interval, terminal=show_progress)
+
+    tuning = None
+    if autotune:
+        # Workers are only tuned when they are processes of this machine
+        parallel = (executor_backend == "process") or ((executor_backend == "dask") and (scheduler_address is None))
+        with stage("autotune"):
+            if isinstance(text_data, str):
+                sample = text_data_sample(text_data, [text_col], csv_sep=csv_sep, n_rows=1000)[text_col]
+            else:
+                sample = text_data[text_col].head(1000)
+            tuning = tuned_settings(sample.dropna(), load_sentiment_models, language=lang, m_type=model_type,
+                                    memory_budget=memory_budget, parallel=parallel, workers=workers, cache_path=autotune_cache)
+    if tuning is not None:
+        batch_size, threads = tuning["batch_size"], tuning["threads"]
+        if parallel:
+            workers = tuning["workers"]
+        print(f"Autotuned: batch size {batch_size}, {threads} threads" + (f", {workers} workers" if parallel else "") +
+              f" ({tuning['texts_per_second']} texts/sec)")
+
+    # The same executor classifies the texts and computes their embeddings, so its workers are started only once
+    with open_executor(executor_backend, workers=workers, address=scheduler_address) as executor:
+        # Classify sentiments into negative, positive and neutral.
+        print("Classifiying text into emotions...")
+        reviews = process_reviews(text_data,
+                                text_col, columns_to_keep=cols_keep_text, csv_sep=csv_sep,
+                                min_rows_to_parallelize=min_rows_par, cancel_parallelisation=cancel_par, divide_in_chunks=ch_size,
+                                convert_to_string=False, language=lang, m_type=model_type, clean_html_text=clean_html,
+                                row_filters=row_filters, read_workers=read_workers, executor=executor, partition_size=partition_size,
+                                batch_size=batch_size, threads=threads, cascade_threshold=cascade_threshold,
+                                cascade_train_size=cascade_train_size)
+        cascade_statistics = reviews.attrs.get("cascade")
+        if (cascade_statistics is not None) and (cascade_statistics["validation_agreement"] is not None):
+            print(f"Cascade: {100 * cascade_statistics['linear_share']:.1f}% of the texts labelled by the linear model, which agrees "
+                  f"with the sentiment model on {100 * cascade_statistics['validation_agreement']:.1f}% of the held out texts it is "
+                  f"confident about, {cascade_statistics['speedup']:.1f}x faster than the sentiment model alone")
+
+        # Count ammount of positive, negative and neutral texts
+        print(f"Ammount of POSITIVE Texts: {reviews[reviews["emotion"] == "POSITIVE"].shape[0]}")
+        print(f"Ammount of NEUTRAL Texts: {reviews[reviews["emotion"] == "NEUTRAL"].shape[0]}")
+        print(f"Ammount of NEGATIVE Texts: {reviews[reviews["emotion"] == "NEGATIVE"].shape[0]}")
+
+        # Language of the topic models and stopwords of the report when the language of each text has been detected
+        report_lang = lang
+        sentiment_model = classification_model_name(lang, model_type)
+        if lang == "auto":
+            languages_found = [l for l, n in reviews["language"].value_counts().items() if n > 0]
+            sentiment_model = {l: classification_model_name(l, model_type) for l in languages_found}
+            lang = collection_language(reviews["language"])
+            report_lang = stopword_language(lang, reviews["language"])
+            print(f"Languages found: {', '.join(languages_found)}")
+
+        # Perform topic modelling
+        print("Dividing text into topics...")
+        topics_step = review_topics(reviews, min_topic_size=m_topic_size, language=lang, n_neighbors=n_neighbours_BERTopic, n_components=umap_n_components_BERTopic, low_memory=low_memory_BERTopic,
+                                    executor=executor, partition_size=partition_size)
+        topics = topics_step[1]
+        global_topic_model = topics_step[0][0]
+        global_top_ten_topics = topics_step[0][1]
 
-    # Classify sentiments into negative, positive and neutral.
-    print("Classifiying text into emotions...")
-    reviews = process_reviews(text_data,
-                            text_col, columns_to_keep=cols_keep_text, csv_sep=csv_sep,
-                            min_rows_to_parallelize=min_rows_par, cancel_parallelisation=cancel_par, divide_in_chunks=ch_size,
-                            convert_to_string=False, language=lang, m_type=model_type, clean_html_text=clean_html)
-    
-    # Count ammount of positive, negative and neutral texts
-    print(f"Ammount of POSITIVE Texts: {reviews[reviews["emotion"] == "POSITIVE"].shape[0]}")
-    print(f"Ammount of NEUTRAL Texts: {reviews[reviews["emotion"] == "NEUTRAL"].shape[0]}")
-    print(f"Ammount of NEGATIVE Texts: {reviews[reviews["emotion"] == "NEGATIVE"].shape[0]}")
-    
-    # Perform topic modelling
-    print("Dividing text into topics...")
-    topics_step = review_topics(reviews, min_topic_size=m_topic_size, language=lang, n_neighbors=n_neighbours_BERTopic, n_components=umap_n_components_BERTopic, low_memory=low_memory_BERTopic)
-    topics = topics_step[1]
-    global_topic_model = topics_step[0][0]
-    global_top_ten_topics = topics_step[0][1]
-    
     # Summareize the information
     print("Creating csv files...")
-    summary_data = summerize_information(review_dataframe=topics[-1],
-                                    title=title, groups_to_count_reviews=count_text_group,
-                                    columns_to_mean_review=mean_text_cols,
-                                    columns_to_sum_reviews=sum_text_cols
-                                    )
+    with stage("summary", rows=topics[-1].shape[0]):
+        summary_data = summerize_information(review_dataframe=topics[-1],
+                                        title=title, groups_to_count_reviews=count_text_group,
+                                        columns_to_mean_review=mean_text_cols,
+                                        columns_to_sum_reviews=sum_text_cols
+                                        )
+
+        # Counts, means and sums for every combination of values of the breakdowns requested
+        if len(summary_breakdowns) > 0:
+            breakdown_data = summarize_breakdowns(topics[-1], summary_breakdowns, columns_to_mean_review=mean_text_cols,
+                                                  columns_to_sum_reviews=sum_text_cols)
+
+    # Emotions, scores and topics per time window
+    trends = None
+    if time_column is not None:
+        with stage("trends", rows=topics[-1].shape[0]):
+            trends = trend_statistics(topics[-1], time_column, window)
 
     # Save output
 
     if os.path.exists(output_directory) == False:
         os.mkdir(output_directory)
 
-    TopicsDataFrame = topics[-1].copy()
+    with stage("saving", rows=topics[-1].shape[0]):
+        # Shallow copy, only the topic column is replaced
+        TopicsDataFrame = topics[-1].copy(deep=False)
+
+        TopicsDataFrame["topic"] = emotion_topic_labels(TopicsDataFrame["emotion"], TopicsDataFrame["topic"])
 
-    TopicsDataFrame["topic"] = TopicsDataFrame["emotion"] + "_" +  TopicsDataFrame["topic"].astype(str)
+        # In columnar formats texts are partitioned by emotion
+        save_table(TopicsDataFrame, output_directory, "Texts", output_format=output_format, compression=output_compression,
+                   partition_cols=["emotion"])
 
-    TopicsDataFrame.to_csv(os.path.join(output_directory,"Texts.csv"), sep=";", index=False)
+        save_table(summary_data, output_directory, "Summary", output_format=output_format, compression=output_compression)
 
-    summary_data.to_csv(os.path.join(output_directory,"Summary.csv"), sep=";", index=False)
+        if len(summary_breakdowns) > 0:
+            save_table(breakdown_data, output_directory, "Summary_Breakdowns", output_format=output_format, compression=output_compression)
 
-    # Most frequent topics
-    for k in topics[0].keys():
-        topics[0][k][1].to_csv(os.path.join(output_directory, k + ".csv"), sep=";", index=False)
+        if trends is not None:
+            save_trends(trends, output_directory, output_format=output_format, compression=output_compression)
 
-    # Global most frequent topics
-    global_top_ten_topics.to_csv(os.path.join(output_directory, "Most_Frequent_Global_Topics.csv"), sep=";", index=False)
+        # Most frequent topics
+        for k in topics[0].keys():
+            save_table(topics[0][k][1], output_directory, k, output_format=output_format, compression=output_compression)
+
+        # Global most frequent topics
+        save_table(global_top_ten_topics, output_directory, "Most_Frequent_Global_Topics", output_format=output_format, compression=output_compression)
+
+        # Saving topic models so the report can be generated again without running the whole pipeline
+        save_topic_models(global_topic_model, topics[0], output_directory, lang=lang,
+                          parameters={"min_topic_size": m_topic_size, "umap_n_neighbours": n_neighbours_BERTopic,
+                                      "umap_n_components": umap_n_components_BERTopic, "low_memory": low_memory_BERTopic,
+                                      "trend_window": window if time_column is not None else None},
+                          sentiment_model=sentiment_model, output_format=output_format)
 
     print("Generating html report...")
-    
-    return generate_report(title=title, review_dataframe=topics[-1], topic_models=topics[0], Global_topic_Model=[global_topic_model, global_top_ten_topics],
-                           path=output_directory, umap_summ_color=umap_colour, umap_met=umap_metric,
-                           neighbours_umap=umap_neighbours, min_dist_umap=umap_minimum_distance, lang=lang)
\ No newline at end of file
+
+    with stage("report", rows=topics[-1].shape[0]):
+        section_stats = generate_report(title=title, review_dataframe=topics[-1], topic_models=topics[0], Global_topic_Model=[global_topic_model, global_top_ten_topics],
+                                        path=output_directory, umap_summ_color=umap_colour, umap_met=umap_metric,
+                                        neighbours_umap=umap_neighbours, min_dist_umap=umap_minimum_distance, lang=report_lang,
+                                        scalable_umap=scalable_umap, umap_sample_size=umap_sample_size, umap_max_points=umap_max_points,
+                                        plotly_js=plotly_js, table_mode=table_mode, table_shard_size=table_shard_size,
+                                        report_workers=report_workers, viz_cache=os.path.join(output_directory, "viz_cache"),
+                                        trends=trends, rolling_windows=rolling_windows, trend_window=window,
+                                        emotion_positions=topics[1])
+
+    write_metrics(output_directory, extra={"rows": topics[-1].shape[0], "report_sections": section_stats, "autotune": tuning,
+                                           "cascade": cascade_statistics})
+    finish_progress()
+
+    return section_stats
+
+def run_report_only(title, output_directory, lang, umap_colour = ["emotion"], umap_metric="cosine", umap_neighbours = 15,
+                    umap_minimum_distance = 0.1, scalable_umap = False, umap_sample_size = 50000, umap_max_points = 100000,
+                    plotly_js = "embed", table_mode = "inline", table_shard_size = 5000, report_workers = 1, profile = False,
+                    rolling_windows = 1, show_progress = True, progress_file = None, progress_interval = 10.0):
+    '''
+    Generate the html report again from the tables and topic models saved by a previous run of the pipeline in
+    output_directory, without classifying the texts or dividing them into topics. Its metrics are written to metrics.json.
+    If lang is "auto" the stopwords of the languages detected in the previous run are used. The trends saved by the previous
+    run, including texts added to them afterwards with src.trends.update_trends, are shown if there are any. The progress of
+    the report sections is reported as in run_sentiment_pipeline.
+    '''
+    start_metrics(profile_directory=os.path.join(output_directory, "profiles") if profile else None)
+    start_progress(progress_file, interval=progress_interval, terminal=show_progress)
+
+    print("Loading saved results...")
+    with stage("loading"):
+        # Tables are read in the format of the run that saved the models, older runs did not record it
+        manifest = read_models_manifest(os.path.join(output_directory, "models"))
+        output_format = manifest.get("output_format")
+        # Window of the trends, taken from the saved trends if the run did not record it
+        window = manifest["parameters"].get("trend_window")
+        texts = load_table(output_directory, "Texts", output_format)
+        # Topics are saved as EMOTION_topic in Texts
+        texts["topic"] = texts["topic"].str.rsplit("_", n=1).str[1].astype(int)
+
+        global_topic_model, emotion_models = load_topic_models(os.path.join(output_directory, "models"))
+        global_top_ten_topics = load_table(output_directory, "Most_Frequent_Global_Topics", output_format)
+        topic_models = {}
+        for k in emotion_models.keys():
+            topic_models[k] = [emotion_models[k], load_table(output_directory, k, output_format)]
+        trends = read_trends(output_directory, output_format)
+
+        if lang == "auto":
+            languages = texts["language"] if "language" in texts.columns else ["english"]
+            lang = stopword_language(collection_language(languages), languages)
+
+    print("Generating html report...")
+
+    with stage("report", rows=texts.shape[0]):
+        section_stats = generate_report(title=title, review_dataframe=texts, topic_models=topic_models, Global_topic_Model=[global_topic_model, global_top_ten_topics],
+                                        path=output_directory, umap_summ_color=umap_colour, umap_met=umap_metric,
+                                        neighbours_umap=umap_neighbours, min_dist_umap=umap_minimum_distance, lang=lang,
+                                        scalable_umap=scalable_umap, umap_sample_size=umap_sample_size, umap_max_points=umap_max_points,
+                                        plotly_js=plotly_js, table_mode=table_mode, table_shard_size=table_shard_size,
+                                        report_workers=report_workers, viz_cache=os.path.join(output_directory, "viz_cache"),
+                                        trends=trends, rolling_windows=rolling_windows, trend_window=window)
+
+    write_metrics(output_directory, extra={"rows": texts.shape[0], "report_sections": section_stats})
+    finish_progress()
+
+    return section_stats
\ No newline at end of file
@@ -0,0 +1,95 @@
+'''
+Functions to save the tables produced by the pipeline as csv, parquet or arrow files and to load them again.
+'''
+
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+def save_table(df, output_directory, name, output_format="csv", compression=None, partition_cols=None):
+    '''
+    Save a dataframe in output_directory as name.csv (separated by semicolons), name.parquet or name.arrow (Arrow IPC).
+    Parquet and arrow tables are written as a directory partitioned by partition_cols if given. Compression only applies to
+    parquet and arrow files, if None the default of each format is used.
+    '''
+    if output_format == "csv":
+        file_path = os.path.join(output_directory, name + ".csv")
+        df.to_csv(file_path, sep=";", index=False)
+        return file_path
+
+    if output_format not in ("parquet", "arrow"):
+        raise Exception("Only the following output formats are allowed: csv, parquet, arrow")
+
+    file_path = os.path.join(output_directory, f"{name}.{output_format}")
+    # Removing the results of previous runs so partitions of different runs are not mixed
+    if os.path.isdir(file_path):
+        shutil.rmtree(file_path)
+
+    # Categorical columns (like emotion) are saved as dictionary encoded columns
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if output_format == "parquet":
+        if partition_cols:
+            pq.write_to_dataset(table, root_path=file_path, partition_cols=partition_cols,
+                                compression=compression or "snappy")
+        else:
+            pq.write_table(table, file_path, compression=compression or "snappy")
+    else:
+        if partition_cols:
+            file_options = ds.IpcFileFormat().make_write_options(compression=compression)
+            ds.write_dataset(table, file_path, format="ipc", partitioning=partition_cols, partitioning_flavor="hive",
+                             file_options=file_options)
+        else:
+            feather.write_feather(table, file_path, compression=compression)
+
+    return file_path
+
+def saved_columns(table):
+    '''
+    Columns of a table read with pyarrow in the order of the dataframe it was saved from. Partition columns are read last,
+    the pandas metadata saved with the table keeps their original position.
+    '''
+    metadata = table.schema.pandas_metadata or {}
+    order = [c["name"] for c in metadata.get("columns", []) if c["name"] in table.column_names]
+    return order + [c for c in table.column_names if c not in order]
+
+def table_path(output_directory, name, output_format=None):
+    '''
+    Path of a table saved by save_table in output_format. If output_format is None, the table saved last in any format.
+    '''
+    if output_format is not None:
+        return os.path.join(output_directory, f"{name}.{output_format}")
+    paths = [os.path.join(output_directory, f"{name}.{extension}") for extension in ("csv", "parquet", "arrow")]
+    paths = [path for path in paths if os.path.exists(path)]
+    if len(paths) == 0:
+        return os.path.join(output_directory, name + ".csv")
+    return max(paths, key=os.path.getmtime)
+
+def load_table(output_directory, name, output_format=None):
+    '''
+    Load a table saved by save_table in output_format, or in the format it was saved last if output_format is None, with its
+    columns in the order they were saved.
+    '''
+    file_path = table_path(output_directory, name, output_format)
+
+    if file_path.endswith(".parquet"):
+        table = pq.read_table(file_path)
+    elif os.path.isdir(file_path):
+        table = ds.dataset(file_path, format="ipc", partitioning="hive").to_table()
+    elif file_path.endswith(".arrow"):
+        table = feather.read_table(file_path)
+    else:
+        return pd.read_csv(file_path, sep=";")
+    return table.to_pandas()[saved_columns(table)]
+
+def table_exists(output_directory, name, output_format=None):
+    '''
+    Whether a table was saved by save_table in output_directory in output_format, or in any format if it is None.
+    '''
+    if output_format is not None:
+        return os.path.exists(table_path(output_directory, name, output_format))
+    return any(os.path.exists(os.path.join(output_directory, f"{name}.{extension}")) for extension in ("csv", "parquet", "arrow"))
@@ -2,14 +2,45 @@
 Script containing functions to load and use roberta pretrained models.
 '''
 
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification, CamembertTokenizer
-from pysentimiento import create_analyzer
+import numpy as np
+# transformers and pysentimiento are imported when a model is loaded since they are slow to import.
+
+def classification_model_name(language = "english", model_type="social_media"):
+    '''
+    Name of the model load_classification_model loads for a language and model type.
+    '''
+    if model_type == "social_media":
+        if language == "english":
+            return "cardiffnlp/twitter-roberta-base-sentiment"
+        if language == "spanish":
+            return "pysentimiento/robertuito-sentiment-analysis"
+    elif language == "english":
+        return "siebert/sentiment-roberta-large-english"
+    return "nlptown/bert-base-multilingual-uncased-sentiment"
+
+def tokenizer_model_name(language = "english", model_type="social_media"):
+    '''
+    Name of the tokenizer load_tokenizer loads to count the tokens of the texts of a language and model type.
+    '''
+    if language == "english":
+        return classification_model_name(language, model_type)
+    return "pysentimiento/robertuito-sentiment-analysis"
+
+def set_torch_threads(threads = None):
+    '''
+    Number of threads torch uses to run the models in this process, the default of torch (one per core) is kept if None.
+    '''
+    if threads is not None:
+        import torch
+
+        torch.set_num_threads(threads)
 
 def load_classification_model(language = "english", model_type="social_media"):
     '''
     Load classification model Roberta
     '''
-    
+    from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
+
     if model_type == "social_media":
         # Models to use when analyzing social media text
         if language == "english":
@@ -24,6 +55,7 @@ def load_classification_model(language = "english", model_type="social_media"):
             return classifier
         
         elif language == "spanish":
+            from pysentimiento import create_analyzer
             analyzer = create_analyzer(task="sentiment", lang="es")
             return analyzer
         
@@ -37,66 +69,39 @@ def load_classification_model(language = "english", model_type="social_media"):
     #classifier = pipeline("sentiment-analysis", model=model_name, tokenizer = model_name)
 
 
-def classify_text_sentiment(text, classification_model, model_type="social_media"):
+# Labels texts can be classified as, the position of each label is its id in the arrays returned by classify_texts
+sentiment_labels = ["NEGATIVE", "NEUTRAL", "POSITIVE", "MIXED"]
+
+def stars_label(stars):
     '''
-    Use Roberta to classify the sentiments of a text into POSITIVE, NEUTRAL, and NEGATIVE.
+    Convert the stars given by bert-base-multilingual-uncased-sentiment into NEGATIVE, NEUTRAL or POSITIVE.
     '''
-    
-    # Dictionary with posible labels
-    labels = {
-        "LABEL_0": "NEGATIVE",
-        "LABEL_1": "NEUTRAL",
-        "LABEL_2": "POSITIVE"
-    }
-
-    # Apliying ROBERTA model
-
-    result = classification_model(text)[0]
-
-    # Asigning the corresponding label to key "label" in the dictionary.
-    if model_type == "social_media":
-        return {
-            "label": labels[result["label"]],
-            "score": result["score"]
-        }
-    
-    return {
-            "label": result["label"],
-            "score": result["score"]
-        }
+    if stars > 3:
+        return "POSITIVE"
+    if stars < 3:
+        return "NEGATIVE"
+    return "NEUTRAL"
 
-def classify_text_no_english(text, model, language="spanish", model_type="social_media"):
+def classify_texts(texts, model, language="english", model_type="social_media", batch_size=32):
     '''
-    Perform sentiment classification using a Pysentimiento or bert-base-multilingual-uncased-sentiment model.
+    Classify a list of texts in batches of batch_size. Returns an array with the id of the label of each text (its position
+    in sentiment_labels) and an array with the score of each classification.
     '''
+    label_ids = {l: i for i, l in enumerate(sentiment_labels)}
 
-    if language == "spanish" and model_type == "social_media":
-        sentiment = model.predict(text)
-            
-        labels = {
-            "NEG": "NEGATIVE",
-            "NEU": "NEUTRAL",
-            "POS": "POSITIVE"
-        }
-
-        return {
-            "label" : labels[sentiment.output],
-            "score": sentiment.probas[sentiment.output]
-        }
-    
-    sentiment = model(text)[0]
-
-    stars = int(sentiment['label'].split(' ')[0])
-    label = ""
-
-    if stars > 3:
-        label = "POSITIVE"
-    elif stars < 3:
-        label = "NEGATIVE"
+    if (language == "spanish") and (model_type == "social_media"):
+        labels = {"NEG": "NEGATIVE", "NEU": "NEUTRAL", "POS": "POSITIVE"}
+        results = [(labels[s.output], s.probas[s.output]) for s in model.predict(texts)]
     else:
-        label = "NEUTRAL"
-
-    return {
-        "label": label,
-        "score": sentiment["score"]
-    }
\ No newline at end of file
+        results = model(texts, batch_size=batch_size)
+        if (language == "english") and (model_type == "social_media"):
+            labels = {"LABEL_0": "NEGATIVE", "LABEL_1": "NEUTRAL", "LABEL_2": "POSITIVE"}
+            results = [(labels[r["label"]], r["score"]) for r in results]
+        elif language == "english":
+            results = [(r["label"], r["score"]) for r in results]
+        else:
+            results = [(stars_label(int(r["label"].split(" ")[0])), r["score"]) for r in results]
+
+    ids = np.fromiter((label_ids[r[0]] for r in results), dtype=np.int8, count=len(results))
+    scores = np.fromiter((r[1] for r in results), dtype=np.float32, count=len(results))
+    return ids, scores
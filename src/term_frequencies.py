@@ -0,0 +1,101 @@
+'''
+Frequencies of the words of large collections of texts in bounded memory, used to draw the word clouds of the report. Texts
+are tokenized by chunks and the count of every word is added to a count-min sketch (a fixed size table of counters indexed by
+several hashes of the word), while only the words estimated to be the most frequent are kept. Memory depends on the size of
+the chunks, the sketch and the number of words kept, not on the number of texts.
+'''
+
+import numpy as np
+import pandas as pd
+
+# Urls are removed before tokenizing, words are tokenized as WordCloud does
+url_pattern = r"http\S+|www\.\S+"
+word_pattern = r"\w[\w']*"
+
+def new_sketch(width=2**18, depth=4):
+    '''
+    Empty count-min sketch with depth rows of width counters. Estimates exceed the true counts by at most 2.7 * (total count) /
+    width with probability 1 - 0.37**depth.
+    '''
+    return {"table": np.zeros((depth, width), dtype=np.int64)}
+
+def sketch_positions(sketch, hashes):
+    '''
+    Counter of each row of the sketch where each hash is counted, derived from the two halves of the 64 bit hashes.
+    '''
+    depth, width = sketch["table"].shape
+    low = (hashes & np.uint64(0xFFFFFFFF)).astype(np.int64)
+    # The step is odd so the positions of a word in different rows do not repeat
+    high = (hashes >> np.uint64(32)).astype(np.int64) | 1
+    return (low[None, :] + np.arange(depth, dtype=np.int64)[:, None] * high[None, :]) % width
+
+def sketch_add(sketch, hashes, counts):
+    '''
+    Add the counts of the words with the given hashes to the sketch.
+    '''
+    table = sketch["table"]
+    positions = sketch_positions(sketch, hashes)
+    for row in range(table.shape[0]):
+        table[row] += np.bincount(positions[row], weights=counts, minlength=table.shape[1]).astype(np.int64)
+
+def sketch_estimate(sketch, hashes):
+    '''
+    Estimated count of the words with the given hashes, never lower than their true count.
+    '''
+    table = sketch["table"]
+    positions = sketch_positions(sketch, hashes)
+    return table[np.arange(table.shape[0])[:, None], positions].min(axis=0)
+
+def hash_words(words):
+    '''
+    64 bit hash of each word.
+    '''
+    return pd.util.hash_array(np.asarray(words, dtype=object))
+
+def chunk_word_counts(texts, stopwords=frozenset()):
+    '''
+    Count the words of a series of texts, in lower case and without urls, numbers, stopwords and the 's of possessives.
+    '''
+    words = texts.astype(str).str.replace(url_pattern, "", regex=True).str.lower().str.findall(word_pattern).explode().dropna()
+    words = words.str.replace(r"'s$", "", regex=True)
+    words = words[(words.str.len() > 0) & ~words.str.isdigit() & ~words.isin(list(stopwords))]
+    return words.value_counts(sort=False)
+
+def merge_plurals(frequencies):
+    '''
+    Add the frequency of plurals ending in s to their singular when both are found, as WordCloud does.
+    '''
+    for word in list(frequencies.keys()):
+        if word.endswith("s") and not word.endswith("ss") and (word[:-1] in frequencies):
+            frequencies[word[:-1]] += frequencies.pop(word)
+    return frequencies
+
+def word_frequencies(texts, stopwords=frozenset(), top_k=1000, chunk_size=10000, width=2**18, depth=4):
+    '''
+    Estimated frequencies of the top_k most frequent words of some texts, in a dictionary that can be passed to
+    WordCloud.generate_from_frequencies. Texts are tokenized by chunks of chunk_size texts, so only one chunk is held as words at
+    a time, and the words of each chunk are counted in a count-min sketch. After each chunk the words kept are the top_k with the
+    highest estimated count among those already kept and those of the chunk.
+    '''
+    if not isinstance(texts, pd.Series):
+        texts = pd.Series(list(texts), dtype=object)
+    sketch = new_sketch(width, depth)
+    top_words = np.array([], dtype=object)
+    top_counts = np.array([], dtype=np.int64)
+
+    for start in range(0, texts.shape[0], chunk_size):
+        counts = chunk_word_counts(texts.iloc[start:start + chunk_size], stopwords)
+        if counts.shape[0] == 0:
+            continue
+        words = counts.index.to_numpy(dtype=object)
+        sketch_add(sketch, hash_words(words), counts.to_numpy())
+
+        # Words kept are estimated again since their counts may have increased in this chunk
+        candidates = pd.unique(np.concatenate([top_words, words]))
+        estimates = sketch_estimate(sketch, hash_words(candidates))
+        if candidates.shape[0] > top_k:
+            best = np.argpartition(-estimates, top_k - 1)[:top_k]
+            candidates, estimates = candidates[best], estimates[best]
+        top_words, top_counts = candidates, estimates
+
+    return merge_plurals({w: int(c) for w, c in zip(top_words, top_counts)})
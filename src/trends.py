@@ -0,0 +1,147 @@
+'''
+Trends of the emotions and topics of time stamped texts. The texts are grouped by time windows (pandas frequencies, e.g. "D"
+or "W") and for every window the pipeline keeps the number of texts of each emotion and the sum and sum of squares of their
+scores, and the number of texts of each global topic. Sums can be added together, so the trends of new texts are merged into
+saved trends, and rolling windows are computed from the sums of each window, without reading the texts already analyzed.
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.save_results import save_table, load_table, table_exists
+
+# Columns of the trends tables that are added up when trends are merged, the rest are computed from them
+emotion_sum_columns = ["texts", "score_sum", "score_sum_squares"]
+
+def time_windows(dates, window="D"):
+    '''
+    Start of the time window of each date, dates that can not be parsed are left empty.
+    '''
+    return pd.to_datetime(dates, errors="coerce").dt.to_period(window).dt.start_time
+
+def add_score_statistics(emotion_trends):
+    '''
+    Add the mean and standard deviation of the scores and the share of the texts of their window of every row of emotion trends.
+    '''
+    texts = emotion_trends["texts"].to_numpy(dtype=np.float64)
+    mean = emotion_trends["score_sum"].to_numpy(dtype=np.float64) / texts
+    # Population variance from the sums, negative values are rounding errors
+    variance = np.maximum(emotion_trends["score_sum_squares"].to_numpy(dtype=np.float64) / texts - mean**2, 0)
+    emotion_trends["score_mean"] = mean.astype(np.float32)
+    emotion_trends["score_std"] = np.sqrt(variance).astype(np.float32)
+    emotion_trends["share"] = (texts / emotion_trends.groupby("window_start")["texts"].transform("sum").to_numpy()).astype(np.float32)
+    return emotion_trends
+
+def trend_statistics(review_dataframe, time_column, window="D", topic_column="global_topic"):
+    '''
+    Count the texts of each emotion and of each topic per time window of time_column, and sum the scores of each emotion and
+    their squares. The texts are grouped once by window, emotion and topic, and the trends of emotions and topics are added up
+    from those groups. Returns the emotion trends (window_start, emotion, texts, score_sum, score_sum_squares, score_mean,
+    score_std and share) and the topic trends (window_start, topic_column and texts). Texts without a valid date are left out.
+    If the texts have no topic_column (they were classified without topic models) the topic trends are empty.
+    '''
+    scores = review_dataframe["emotion_score"].to_numpy(dtype=np.float64)
+    columns = {"window_start": time_windows(review_dataframe[time_column], window), "emotion": review_dataframe["emotion"]}
+    has_topics = topic_column in review_dataframe.columns
+    if has_topics:
+        columns[topic_column] = review_dataframe[topic_column]
+    frame = pd.DataFrame({**columns, "score_sum": scores, "score_sum_squares": scores**2}, copy=False)
+    groups = frame.groupby(list(columns.keys()), observed=True, sort=True).agg(
+        texts=("score_sum", "size"), score_sum=("score_sum", "sum"), score_sum_squares=("score_sum_squares", "sum"))
+
+    emotion_trends = groups.groupby(level=["window_start", "emotion"], observed=True, sort=True)[emotion_sum_columns].sum().reset_index()
+    if has_topics:
+        topic_trends = groups.groupby(level=["window_start", topic_column], observed=True, sort=True)[["texts"]].sum().reset_index()
+    else:
+        topic_trends = pd.DataFrame({"window_start": pd.Series(dtype="datetime64[ns]"), topic_column: pd.Series(dtype=np.int64),
+                                     "texts": pd.Series(dtype=np.int64)})
+    emotion_trends["emotion"] = emotion_trends["emotion"].astype(str)
+    return add_score_statistics(emotion_trends), topic_trends
+
+def merge_trends(emotion_trends, topic_trends, new_emotion_trends, new_topic_trends, topic_column="global_topic"):
+    '''
+    Add the trends of new texts to previous trends. Only the sums of each window are added up, so windows the new texts fall
+    in are updated and the rest are kept as they were. Returns the merged emotion and topic trends.
+    '''
+    emotions = pd.concat([emotion_trends[["window_start", "emotion"] + emotion_sum_columns],
+                          new_emotion_trends[["window_start", "emotion"] + emotion_sum_columns]], ignore_index=True)
+    emotions = emotions.groupby(["window_start", "emotion"], sort=True)[emotion_sum_columns].sum().reset_index()
+    topics = pd.concat([topic_trends, new_topic_trends], ignore_index=True)
+    topics = topics.groupby(["window_start", topic_column], sort=True)[["texts"]].sum().reset_index()
+    return add_score_statistics(emotions), topics
+
+def window_starts(starts, window=None):
+    '''
+    Start of every time window between the first and the last of starts, including the windows without texts. If window is
+    None it is taken as the shortest time between two of the starts.
+    '''
+    if window is not None:
+        return pd.period_range(starts.min(), starts.max(), freq=window).start_time
+    if starts.shape[0] < 2:
+        return pd.DatetimeIndex(starts)
+    return pd.date_range(starts.min(), starts.max(), freq=pd.Series(starts).sort_values().diff().min())
+
+def rolling_trends(emotion_trends, windows=7, window=None):
+    '''
+    Emotion trends over rolling periods of the last windows time windows (pandas frequency window, taken from the windows of
+    the trends if None), added up from the sums of each window. Windows without texts, or without texts of an emotion, count
+    as zero texts.
+    '''
+    sums = emotion_trends.pivot_table(index="window_start", columns="emotion", values=emotion_sum_columns, aggfunc="sum",
+                                      fill_value=0).sort_index()
+    sums = sums.reindex(window_starts(sums.index, window), fill_value=0)
+    sums.index.name = "window_start"
+    rolling = sums.rolling(windows, min_periods=1).sum().stack("emotion", future_stack=True).reset_index()
+    rolling = rolling[rolling["texts"] > 0].reset_index(drop=True)
+    rolling["texts"] = rolling["texts"].astype(np.int64)
+    return add_score_statistics(rolling[["window_start", "emotion"] + emotion_sum_columns].copy())
+
+def read_trends(output_directory, output_format=None):
+    '''
+    Load the trends saved in output_directory in output_format (the format saved last if None), returns None if there are none.
+    '''
+    if not table_exists(output_directory, "Emotion_Trends", output_format):
+        return None
+    emotion_trends = load_table(output_directory, "Emotion_Trends", output_format)
+    topic_trends = load_table(output_directory, "Topic_Trends", output_format)
+    # Dates are read as text from csv files
+    emotion_trends["window_start"] = pd.to_datetime(emotion_trends["window_start"])
+    topic_trends["window_start"] = pd.to_datetime(topic_trends["window_start"])
+    return emotion_trends, topic_trends
+
+def save_trends(trends, output_directory, output_format="csv", compression=None):
+    '''
+    Save emotion and topic trends as Emotion_Trends and Topic_Trends.
+    '''
+    save_table(trends[0], output_directory, "Emotion_Trends", output_format=output_format, compression=compression)
+    save_table(trends[1], output_directory, "Topic_Trends", output_format=output_format, compression=compression)
+
+def update_trends(output_directory, new_texts, time_column, window=None, output_format=None, compression=None,
+                  topic_column="global_topic"):
+    '''
+    Add new texts (a dataframe with time_column, emotion, emotion_score and topic_column, like the records returned by
+    src.api.classify_records) to the trends saved in output_directory by a previous run, and save them again. The window and
+    output format are the ones recorded in the models manifest of the run if they are None ("D" and "csv" if it has none),
+    and trends of a different window than the recorded one are not merged. Only the new texts are grouped, the texts of the
+    previous run are not needed. New texts without topic_column, from classify_records without topic models, only update the
+    emotion trends. Returns the updated trends.
+    '''
+    from src.get_topics import read_models_manifest
+
+    models_directory = os.path.join(output_directory, "models")
+    manifest = read_models_manifest(models_directory) if os.path.exists(os.path.join(models_directory, "manifest.json")) else {}
+    recorded_window = manifest.get("parameters", {}).get("trend_window")
+    if (window is not None) and (recorded_window is not None) and (window != recorded_window):
+        raise Exception(f"The trends in {output_directory} are counted by windows of '{recorded_window}', texts can not be "
+                        f"added to them by windows of '{window}'.")
+    window = window or recorded_window or "D"
+
+    new_trends = trend_statistics(new_texts, time_column, window, topic_column=topic_column)
+    # Trends are read in the format of the run, or the one saved last if it was not recorded
+    previous = read_trends(output_directory, manifest.get("output_format"))
+    output_format = output_format or manifest.get("output_format") or "csv"
+    trends = new_trends if previous is None else merge_trends(*previous, *new_trends, topic_column=topic_column)
+    save_trends(trends, output_directory, output_format=output_format, compression=compression)
+    return trends
@@ -0,0 +1,8 @@
+'''
+The tests import the modules of src from the root of the repository, as LinguaLoupe.py does.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,37 @@
+import pandas as pd
+
+from src.autotune import candidate_threads, settings_key, machine_key, read_cache, save_cache, tuned_settings
+
+def test_candidate_threads():
+    assert candidate_threads(1) == [1]
+    assert candidate_threads(6) == [1, 2, 4, 6]
+    assert candidate_threads(8) == [1, 2, 4, 8]
+
+def test_settings_key_depends_on_model_workers_and_budget():
+    key = settings_key("model", False, 8.04)
+
+    assert key == f"{machine_key()}|model|single|8.0GB"
+    assert settings_key("model", True, 8.0) == f"{machine_key()}|model|processes:tuned|8.0GB"
+    assert settings_key("model", True, 8.0, workers=3) == f"{machine_key()}|model|processes:3|8.0GB"
+    assert len({key, settings_key("other", False, 8.0), settings_key("model", False, 16.0)}) == 3
+
+def test_cache_keeps_the_settings_of_other_keys(tmp_path):
+    cache_path = str(tmp_path / "cache" / "autotune.json")
+    assert read_cache(cache_path) == {}
+
+    save_cache(cache_path, "a", {"threads": 2})
+    save_cache(cache_path, "b", {"threads": 4})
+
+    assert read_cache(cache_path) == {"a": {"threads": 2}, "b": {"threads": 4}}
+
+def test_tuned_settings_are_read_from_the_cache(tmp_path):
+    cache_path = str(tmp_path / "autotune.json")
+    settings = {"threads": 2, "batch_size": 16, "workers": 1}
+    save_cache(cache_path, settings_key("cardiffnlp/twitter-roberta-base-sentiment", False, 4.0), settings)
+
+    def load_models(language, m_type):
+        raise AssertionError("The models are not loaded when the settings are cached")
+
+    texts = pd.Series(["a text", "another text"])
+    assert tuned_settings(texts, load_models, memory_budget=4.0, cache_path=cache_path) == settings
+    assert tuned_settings(texts.iloc[:0], load_models, cache_path=cache_path) is None
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from src.executors import open_executor, partition_bounds, map_partitions, shares_process
+
+def test_partition_bounds():
+    assert partition_bounds(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert partition_bounds(8, 4) == [(0, 4), (4, 8)]
+    assert partition_bounds(0, 4) == []
+
+def partition_sum(partition, offset):
+    return int(partition.sum()) + offset
+
+@pytest.mark.parametrize("backend", [None, "thread"])
+def test_map_partitions_keeps_the_order_of_the_partitions(backend):
+    values = pd.Series(range(10))
+    partitions = [values.iloc[start:end] for start, end in partition_bounds(values.shape[0], 3)]
+    tracker = {"name": "test", "total": 10, "unit": "rows", "done": 0, "start": 0.0, "last": 0.0, "reported": False}
+
+    with open_executor(backend, workers=2) as executor:
+        results = map_partitions(executor, partition_sum, partitions, 100, tracker=tracker)
+
+    assert results == [103, 112, 121, 109]
+    assert tracker["done"] == 10
+    assert shares_process(executor)
+
+def failing(partition):
+    if partition.iloc[0] == 0:
+        raise ValueError("failed partition")
+    return partition.shape[0]
+
+def test_map_partitions_raises_the_error_of_a_partition():
+    partitions = [pd.Series([0]), pd.Series([1])]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(ValueError, match="failed partition"):
+            map_partitions(executor, failing, partitions)
+
+def test_open_executor_rejects_unknown_backends():
+    with pytest.raises(Exception, match="can only be one of"):
+        with open_executor("spark"):
+            pass
@@ -0,0 +1,48 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pytest
+
+from src.read_data import parse_row_filter, apply_row_filters, arrow_filter_expression, text_data_files, read_text_data
+
+def test_parse_row_filter_operators():
+    assert parse_row_filter("stars<3") == ("stars", "<", "3")
+    assert parse_row_filter(" created_at >= 2024-01-01 ") == ("created_at", ">=", "2024-01-01")
+    assert parse_row_filter("country!=ES") == ("country", "!=", "ES")
+    assert parse_row_filter("language in en, es ,pt") == ("language", "in", ["en", "es", "pt"])
+
+def test_parse_row_filter_rejects_filters_without_operator():
+    with pytest.raises(Exception, match="Could not understand the filter"):
+        parse_row_filter("stars")
+
+def test_apply_row_filters_converts_values_to_the_column_type():
+    data = pd.DataFrame({"stars": [1, 3, 5], "language": ["en", "es", "fr"],
+                         "date": pd.to_datetime(["2023-12-31", "2024-01-01", "2024-02-01"])})
+    filters = [parse_row_filter(f) for f in ("stars>=3", "language in en,es", "date>=2024-01-01")]
+
+    assert apply_row_filters(data, filters).index.tolist() == [1]
+    assert apply_row_filters(data, []) is data
+
+def test_apply_row_filters_unknown_column():
+    with pytest.raises(Exception, match="not in the text data"):
+        apply_row_filters(pd.DataFrame({"stars": [1]}), [("rating", ">", "1")])
+
+def test_arrow_filter_expression_matches_pandas_filters():
+    data = pd.DataFrame({"stars": [1, 3, 5, 4], "language": ["en", "es", "fr", "en"]})
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    filters = [parse_row_filter(f) for f in ("stars>2", "language in en,fr")]
+
+    filtered = ds.dataset(table).to_table(filter=arrow_filter_expression(table.schema, filters)).to_pandas()
+
+    assert filtered.to_dict("list") == apply_row_filters(data, filters).reset_index(drop=True).to_dict("list")
+
+def test_manifest_files_are_read_once(tmp_path):
+    for name in ("a.csv", "b.csv"):
+        (tmp_path / name).write_text("text\nhello\n")
+    manifest = tmp_path / "texts.manifest"
+    # Overlapping lines, comments and empty lines
+    manifest.write_text("a.csv\n# all the exports\n*.csv\n\n./b.csv\n")
+
+    assert text_data_files(str(manifest)) == [str(tmp_path / "a.csv"), str(tmp_path / "b.csv")]
+    data = read_text_data(str(manifest), "text")
+    assert data["source_file"].tolist() == [str(tmp_path / "a.csv"), str(tmp_path / "b.csv")]
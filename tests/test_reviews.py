@@ -0,0 +1,33 @@
+import numpy as np
+
+from src.reviews import vote_chunks
+from src.sentiment import sentiment_labels
+
+def label_ids(labels):
+    return np.array([sentiment_labels.index(l) for l in labels], dtype=np.int64)
+
+def test_vote_chunks_majority_and_draws():
+    # Text 0: two POSITIVE chunks against one NEGATIVE, text 1: a draw, text 2: MIXED, text 3: a single chunk
+    doc_ids = np.array([0, 0, 0, 1, 1, 2, 3])
+    labels = label_ids(["POSITIVE", "POSITIVE", "NEGATIVE", "NEGATIVE", "POSITIVE", "MIXED", "NEUTRAL"])
+    scores = np.array([0.9, 0.7, 0.8, 0.6, 0.8, 0.5, 0.4])
+
+    emotions, doc_scores = vote_chunks(doc_ids, labels, scores, 4)
+
+    assert list(emotions) == ["POSITIVE", "NEGATIVE-POSITIVE", "NEGATIVE-POSITIVE", "NEUTRAL"]
+    # Mean score of the chunks of the chosen label, or of the means of the labels drawn
+    np.testing.assert_allclose(doc_scores, [0.8, 0.7, 0.5, 0.4], rtol=1e-6)
+    assert doc_scores.dtype == np.float32
+
+def test_vote_chunks_categories_follow_emotion_order():
+    emotions, _ = vote_chunks(np.array([0, 1, 2]), label_ids(["NEGATIVE", "NEUTRAL", "POSITIVE"]), np.ones(3), 3)
+
+    # Unused emotions are removed and the rest keep the order of the report
+    assert list(emotions.categories) == ["POSITIVE", "NEUTRAL", "NEGATIVE"]
+
+def test_vote_chunks_three_way_draw():
+    emotions, doc_scores = vote_chunks(np.zeros(3, dtype=np.int64), label_ids(["NEGATIVE", "NEUTRAL", "POSITIVE"]),
+                                       np.array([0.3, 0.6, 0.9]), 1)
+
+    assert list(emotions) == ["NEGATIVE-NEUTRAL-POSITIVE"]
+    np.testing.assert_allclose(doc_scores, [0.6], rtol=1e-6)
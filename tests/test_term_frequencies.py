@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from src.term_frequencies import new_sketch, sketch_add, sketch_estimate, hash_words, word_frequencies
+
+def test_sketch_never_underestimates():
+    rng = np.random.default_rng(0)
+    words = np.array([f"word{i}" for i in range(5000)], dtype=object)
+    counts = rng.integers(1, 100, size=words.shape[0])
+    # A small sketch so words share counters
+    sketch = new_sketch(width=1024, depth=4)
+
+    sketch_add(sketch, hash_words(words), counts)
+    estimates = sketch_estimate(sketch, hash_words(words))
+
+    assert (estimates >= counts).all()
+    assert sketch_estimate(new_sketch(), hash_words(words)).sum() == 0
+
+def test_word_frequencies_counts_words():
+    texts = pd.Series(["The cats and the cat", "A dog's bone http://example.com/dogs", "dogs 2024 and cats"])
+
+    frequencies = word_frequencies(texts, stopwords=frozenset(["the", "and", "a"]))
+
+    # Plurals are added to their singular, possessives, urls, numbers and stopwords are left out
+    assert frequencies == {"cat": 3, "dog": 2, "bone": 1}
+
+def test_word_frequencies_by_chunks_keeps_the_most_frequent():
+    texts = pd.Series(["common rare%d" % i for i in range(100)] + ["frequent common"] * 50)
+
+    by_chunks = word_frequencies(texts, top_k=2, chunk_size=7)
+
+    assert by_chunks == {"common": 150, "frequent": 50}
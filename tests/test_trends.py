@@ -0,0 +1,80 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.trends import trend_statistics, merge_trends, rolling_trends, update_trends, read_trends
+from src.get_topics import models_format_version
+
+def texts(dates, emotions, scores, topics=None):
+    data = pd.DataFrame({"date": dates, "emotion": emotions, "emotion_score": scores})
+    if topics is not None:
+        data["global_topic"] = topics
+    return data
+
+all_texts = texts(["2024-01-01", "2024-01-01", "2024-01-02", "2024-01-02", "2024-01-03", "2024-01-03"],
+                  ["POSITIVE", "NEGATIVE", "POSITIVE", "POSITIVE", "NEUTRAL", "POSITIVE"],
+                  [0.9, 0.6, 0.8, 0.7, 0.5, 0.95], [0, 1, 0, 2, 1, 0])
+
+def test_trend_statistics_counts_and_scores():
+    emotion_trends, topic_trends = trend_statistics(all_texts, "date", "D")
+
+    positive = emotion_trends[emotion_trends["emotion"] == "POSITIVE"].set_index("window_start")
+    assert positive["texts"].tolist() == [1, 2, 1]
+    np.testing.assert_allclose(positive["score_mean"], [0.9, 0.75, 0.95], rtol=1e-6)
+    np.testing.assert_allclose(positive["score_std"], [0, 0.05, 0], atol=1e-6)
+    np.testing.assert_allclose(positive["share"], [0.5, 1, 0.5], rtol=1e-6)
+    assert topic_trends["texts"].sum() == all_texts.shape[0]
+
+def test_merge_trends_equals_trends_of_all_texts():
+    # Windows of 2024-01-02 are split between the previous and the new texts
+    previous = trend_statistics(all_texts.iloc[:3], "date", "D")
+    new = trend_statistics(all_texts.iloc[3:], "date", "D")
+
+    merged_emotions, merged_topics = merge_trends(*previous, *new)
+    expected_emotions, expected_topics = trend_statistics(all_texts, "date", "D")
+
+    pd.testing.assert_frame_equal(merged_emotions, expected_emotions, check_dtype=False)
+    pd.testing.assert_frame_equal(merged_topics, expected_topics, check_dtype=False)
+
+def test_trend_statistics_without_topics():
+    emotion_trends, topic_trends = trend_statistics(all_texts.drop(columns="global_topic"), "date", "D")
+
+    assert emotion_trends["texts"].sum() == all_texts.shape[0]
+    assert topic_trends.shape[0] == 0
+    assert list(topic_trends.columns) == ["window_start", "global_topic", "texts"]
+
+def test_rolling_trends_count_windows_without_texts():
+    emotion_trends, _ = trend_statistics(texts(["2024-01-01", "2024-01-10", "2024-01-11"], ["POSITIVE"] * 3, [0.5, 0.6, 0.7]),
+                                         "date", "D")
+
+    rolling = rolling_trends(emotion_trends, 3, "D").set_index("window_start")
+
+    # The text of 2024-01-01 is more than 3 days before 2024-01-11
+    assert rolling.loc[pd.Timestamp("2024-01-11"), "texts"] == 2
+    assert rolling.loc[pd.Timestamp("2024-01-03"), "texts"] == 1
+    assert pd.Timestamp("2024-01-04") not in rolling.index
+
+def write_manifest(output_directory, output_format, trend_window):
+    (output_directory / "models").mkdir()
+    manifest = {"format_version": models_format_version, "language": "english", "output_format": output_format,
+                "parameters": {"trend_window": trend_window}, "models": {}}
+    (output_directory / "models" / "manifest.json").write_text(json.dumps(manifest))
+
+def test_update_trends_uses_the_format_and_window_of_the_run(tmp_path):
+    write_manifest(tmp_path, "parquet", "W")
+
+    update_trends(str(tmp_path), all_texts.iloc[:3], "date")
+    emotion_trends, _ = update_trends(str(tmp_path), all_texts.iloc[3:], "date")
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["Emotion_Trends.parquet", "Topic_Trends.parquet", "models"]
+    assert emotion_trends["texts"].sum() == all_texts.shape[0]
+    assert emotion_trends["window_start"].nunique() == 1
+    pd.testing.assert_frame_equal(read_trends(str(tmp_path), "parquet")[0], emotion_trends, check_dtype=False)
+
+def test_update_trends_refuses_other_windows(tmp_path):
+    write_manifest(tmp_path, "csv", "W")
+
+    with pytest.raises(Exception, match="windows of 'W'"):
+        update_trends(str(tmp_path), all_texts, "date", window="D")